@@ -1,25 +1,84 @@
+import asyncio
+import logging
 import os
-from fastapi import FastAPI, Request
+import time
+from fastapi import Depends, FastAPI, Request
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+from sqlmodel import Session
 
 from src.config.exception_handler import CustomException
-from src.config.base import create_db_and_tables
-from src.entities.user.routes import user_controller, user_role_controller
-from src.entities.state.routes import state_controller
-from src.entities.device.routes import device_controller
-from src.entities.device.routes import device_relation_controller
+from src.config.base import (
+    ReadYourWritesMiddleware,
+    create_db_and_tables,
+    engine,
+    replicas,
+    shards,
+)
+from src.registry import import_models, register_routers, seeders
+from src.services.admission import AdmissionMiddleware, admission
+from src.services.credentials import credential_service
+from src.services.jobs import job_engine
+from src.services.permissions import require_permission, role_permissions
+from src.services.profiling import ProfilingMiddleware, memory_profiler
+from src.services.tokens import TokenAuthMiddleware
+from src.shared.change_feed import change_feed
+from src.shared.entity_cache import CACHES
+from src.shared.idempotency import IdempotentReplay, idempotent_replay_handler
+from src.shared.statements import compiled_cache
+from src.shared.write_behind import (
+    drain_write_behind_queues,
+    start_write_behind_queues,
+)
 from .services.security import DecryptionMiddleware, EncryptionMiddleware
 
+# Se registra junto a los mensajes de arranque de uvicorn
+logger = logging.getLogger("uvicorn.error")
+
+# Las tablas deben estar registradas antes de crear el esquema
+import_models()
+
+# python -m src.server refresca las réplicas y ejecuta los trabajos una sola
+# vez, en el supervisor, en lugar de en cada proceso de trabajo
+SUPERVISOR_TASKS = os.environ.get("SUPERVISOR_TASKS") == "1"
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    create_db_and_tables()
+    started_at = time.perf_counter()
+    schema_applied = create_db_and_tables(seeders())
+    # Precalcular los permisos de cada rol
+    with Session(engine) as session:
+        role_permissions.load(session)
+    if not SUPERVISOR_TASKS:
+        # Copiar el primario a las réplicas de lectura y refrescarlas en
+        # segundo plano
+        replicas.start()
+        job_engine.start()
+    start_write_behind_queues()
+    change_feed.start(asyncio.get_running_loop())
+    credential_service.start()
+    logger.info(
+        "Arranque en %.1f ms (esquema %s)",
+        (time.perf_counter() - started_at) * 1000,
+        "aplicado" if schema_applied else "al día",
+    )
     yield
+    # Escribir las actualizaciones pendientes antes de terminar
+    drain_write_behind_queues()
+    change_feed.stop()
+    job_engine.stop()
+    credential_service.shutdown()
+    replicas.stop()
 
 
-key = os.urandom(32)  # Clave AES-256 (32 bytes)
+# Clave AES-256 (32 bytes en hexadecimal); con varios workers debe ser
+# compartida (python -m src.server la genera si falta)
+PAYLOAD_KEY = os.environ.get("PAYLOAD_KEY", "")
+key = bytes.fromhex(PAYLOAD_KEY) if PAYLOAD_KEY else os.urandom(32)
+if len(key) != 32:
+    raise ValueError("PAYLOAD_KEY debe tener 32 bytes (64 caracteres hexadecimales)")
 
 # Inicializar la aplicación FastAPI
 app = FastAPI(
@@ -36,10 +95,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Payload-Encoding", "Idempotent-Replayed", "X-Last-Write"],
 )
 
 # Agregar middlewares en el orden correcto
+# Hora del último commit para leer lo propio desde cualquier réplica/worker
+app.add_middleware(ReadYourWritesMiddleware, max_age=replicas.max_lag)
+# Perfilado de memoria por ruta, lo más cerca posible de los endpoints; sin
+# PROFILING=1 no se instala
+if memory_profiler.enabled:
+    app.add_middleware(ProfilingMiddleware)
+app.add_middleware(TokenAuthMiddleware)
 app.add_middleware(DecryptionMiddleware, key=key)
+# Admisión antes de descifrar: las solicitudes rechazadas no consumen CPU
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(EncryptionMiddleware, key=key)
 
 
@@ -49,6 +118,11 @@ async def custom_exception_handler(request: Request, exc: CustomException):
     return JSONResponse(status_code=exc.status_code, content={"message": exc.message})
 
 
+# Respuestas repetidas por Idempotency-Key (los routers perezosos no pueden
+# registrar manejadores una vez construida la pila de middlewares)
+app.add_exception_handler(IdempotentReplay, idempotent_replay_handler)
+
+
 # Ruta principal
 @app.get("/")
 async def root():
@@ -59,12 +133,23 @@ async def root():
     }
 
 
-# Registro de routers
-user_controller.register_routes(app)
-user_role_controller.register_routes(app)
-state_controller.register_routes(app)
-device_controller.register_routes(app)
-device_relation_controller.register_routes(app)
+# Registro de routers (ENABLED_ROUTERS / LAZY_ROUTERS en src/registry.py)
+register_routers(app)
+
+
+@app.get("/cache/stats", dependencies=[Depends(require_permission("admin:stats"))])
+async def cache_stats():
+    return {name: cache.stats() for name, cache in CACHES.items()}
+
+
+@app.get("/cache/statements", dependencies=[Depends(require_permission("admin:stats"))])
+async def statement_cache_stats():
+    return compiled_cache.stats([engine, *shards.engines.values(), *replicas.engines])
+
+
+@app.get("/admission/stats", dependencies=[Depends(require_permission("admin:stats"))])
+async def admission_stats():
+    return admission.stats()
 
 
 @app.get("/test")
@@ -72,7 +157,7 @@ async def test_endpoint():
     return {"message": "Datos recibidos"}
 
 
-# Punto de entrada para ejecución directa
+# Punto de entrada para desarrollo (producción: python -m src.server)
 if __name__ == "__main__":
     import uvicorn
 
@@ -1,49 +1,182 @@
+import os
+import time
+from collections.abc import Callable, Iterable
 from typing import Annotated
-from fastapi import Depends
+from fastapi import Depends, Request
+from sqlalchemy import Engine, Pool, event
 from sqlmodel import Session, SQLModel, create_engine
-from src.entities.user.models import UserRole
-from src.entities.state.models import State
+from .migrations import (
+    add_missing_columns,
+    add_missing_indexes,
+    drop_stale_indexes,
+    enable_incremental_vacuum,
+    migrate_ids_to_compact,
+)
+from .replicas import (
+    LAST_WRITE_COOKIE,
+    LAST_WRITE_HEADER,
+    ReadYourWritesMiddleware,
+    ReplicaSet,
+)
+from .schema import (
+    lock_path,
+    record_fingerprint,
+    schema_fingerprint,
+    startup_lock,
+    stored_fingerprint,
+)
+from .shards import RoutingSession, ShardSet
+from .utils import ID_STORAGE
 
 # Configuración de la base de datos
 SQLITE_FILE_NAME = "database.db"
 SQLITE_URL = f"sqlite:///{SQLITE_FILE_NAME}"
 CONNECT_ARGS = {"check_same_thread": False}
 engine = create_engine(SQLITE_URL, connect_args=CONNECT_ARGS)
+# Modo WAL en el primario y los shards: los lectores no bloquean a los
+# escritores y las copias en línea no se reinician con cada escritura
+SQLITE_WAL = os.environ.get("SQLITE_WAL", "1") == "1"
 
+# Réplicas de solo lectura (rutas separadas por comas; vacío = sin réplicas)
+SQLITE_REPLICAS = [
+    path.strip()
+    for path in os.environ.get("SQLITE_REPLICAS", "").split(",")
+    if path.strip()
+]
+replicas = ReplicaSet(
+    engine,
+    SQLITE_FILE_NAME,
+    SQLITE_REPLICAS,
+    refresh_interval=float(os.environ.get("REPLICA_REFRESH_INTERVAL", 5)),
+    pin_window=float(os.environ.get("READ_YOUR_WRITES_WINDOW", 10)),
+    # Antigüedad máxima de una réplica legible (0 = tres intervalos)
+    max_lag=float(os.environ.get("REPLICA_MAX_LAG", 0)) or None,
+)
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
-    create_default_users()
-    create_default_states()
+# Archivos de shard para dispositivos (separados por comas; vacío = sin shards)
+SQLITE_SHARDS = [
+    path.strip()
+    for path in os.environ.get("SQLITE_SHARDS", "").split(",")
+    if path.strip()
+]
+SHARDED_TABLES = ("device", "devicerelation")
+shards = ShardSet(
+    engine,
+    SQLITE_SHARDS,
+    os.environ.get("SHARD_MAP_FILE", "shards.json"),
+    SHARDED_TABLES,
+)
 
 
-def create_default_users():
-    with Session(engine) as session:
-        if session.query(UserRole).count() == 0:
-            users = [
-                UserRole(name="Admin"),
-                UserRole(name="User"),
-                UserRole(name="Master"),
-            ]
-            session.add_all(users)
-            session.commit()
+def enable_wal(target: Engine):
+    """Puts the file of `target` in WAL mode when a connection opens.
 
+    The mode is stored in the file, so only the first connection changes it.
+    """
 
-def get_session():
-    with Session(engine) as session:
+    @event.listens_for(target, "connect")
+    def _journal_mode_wal(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA journal_mode = WAL")
+
+
+if SQLITE_WAL:
+    for target in (engine, *shards.engines.values()):
+        enable_wal(target)
+
+
+def create_db_and_tables(seeders: Iterable[Callable[[Engine], None]] = ()) -> bool:
+    """Brings the schema and seed data up to date, once per schema version.
+
+    The fast path is a single query comparing the stored schema fingerprint
+    with the models. Otherwise DDL, migrations and seeding run under a file
+    lock, so only one worker applies them and the rest find them done.
+    The models must already be imported; `seeders` receive the engine.
+
+    Returns:
+        True if this process applied the schema, False if it was current.
+    """
+    fingerprint = schema_fingerprint(engine, [ID_STORAGE, *SQLITE_SHARDS])
+    if stored_fingerprint(engine) == fingerprint:
+        return False
+    with startup_lock(lock_path(SQLITE_FILE_NAME)):
+        if stored_fingerprint(engine) == fingerprint:
+            return False
+        for target in (engine, *shards.engines.values()):
+            enable_incremental_vacuum(target)
+        SQLModel.metadata.create_all(engine)
+        shards.create_all()
+        for target in (engine, *shards.engines.values()):
+            add_missing_columns(target)
+            add_missing_indexes(target)
+        if ID_STORAGE == "blob":
+            migrate_ids_to_compact(engine)
+        drop_stale_indexes(engine)
+        for seed in seeders:
+            seed(engine)
+        record_fingerprint(engine, fingerprint)
+    return True
+
+
+def client_key(request: Request) -> str | None:
+    """Identifies the client (idempotency keys, job ownership)."""
+    principal = getattr(request.state, "principal", None)
+    if principal is not None:
+        return principal.subject
+    authorization = request.headers.get("authorization")
+    if authorization:
+        return authorization
+    return request.client.host if request.client else None
+
+
+def last_write(request: Request) -> float | None:
+    """Returns the commit time the client sent back (header or cookie)."""
+    value = request.headers.get(LAST_WRITE_HEADER) or request.cookies.get(
+        LAST_WRITE_COOKIE
+    )
+    try:
+        # Un valor futuro no fija al cliente al primario indefinidamente
+        return min(float(value), time.time()) if value else None
+    except ValueError:
+        return None
+
+
+def get_session(request: Request):
+    with RoutingSession(engine, shards) as session:
+        session.info["request_state"] = request.state
+        yield session
+
+
+def get_read_session(request: Request):
+    read_engine = replicas.read_engine(last_write(request))
+    with RoutingSession(read_engine, shards) as session:
+        session.info["read_only"] = True
+        # Las réplicas pueden ir por detrás: lo leído de ellas no se cachea
+        session.info["replica"] = read_engine is not engine
         yield session
 
 
-def create_default_states():
-    with Session(engine) as session:
-        if session.query(State).count() == 0:
-            states = [
-                State(nombre="Activo", descripcion="Usuario activo"),
-                State(nombre="Inactivo", descripcion="Usuario inactivo"),
-                State(nombre="Suspendido", descripcion="Usuario suspendido"),
-            ]
-            session.add_all(states)
-            session.commit()
+@event.listens_for(Session, "after_begin")
+def _begin_read_only(session: Session, transaction, connection):
+    # Lecturas: transacción explícita (instantánea consistente) sin escrituras
+    if session.info.get("read_only"):
+        connection.exec_driver_sql("PRAGMA query_only = ON")
+        connection.exec_driver_sql("BEGIN")
+        connection.info["query_only"] = True
+
+
+@event.listens_for(Pool, "checkin")
+def _reset_query_only(dbapi_connection, connection_record):
+    if connection_record.info.pop("query_only", False) and dbapi_connection:
+        dbapi_connection.execute("PRAGMA query_only = OFF")
+
+
+@event.listens_for(Session, "after_commit")
+def _record_last_write(session: Session):
+    # ReadYourWritesMiddleware la devuelve al cliente
+    state = session.info.get("request_state")
+    if state is not None:
+        state.last_write = time.time()
 
 
 SessionDep = Annotated[Session, Depends(get_session)]
+ReadSessionDep = Annotated[Session, Depends(get_read_session)]
@@ -0,0 +1,151 @@
+import sqlite3
+from uuid import UUID
+
+from sqlalchemy import Engine, inspect
+from sqlalchemy.schema import CreateColumn
+from sqlmodel import SQLModel
+
+from .utils import CompactUUID
+
+# Filas reescritas por lote al migrar IDs
+MIGRATION_BATCH_SIZE = 1000
+
+
+def _compact_columns() -> list[tuple[str, str]]:
+    """Returns every (table, column) pair declared with `CompactUUID`."""
+    return [
+        (table.name, column.name)
+        for table in SQLModel.metadata.sorted_tables
+        for column in table.columns
+        if isinstance(column.type, CompactUUID)
+    ]
+
+
+def migrate_ids_to_compact(engine: Engine) -> int:
+    """Rewrites legacy 36-character TEXT IDs as 16-byte BLOBs in place.
+
+    Each column is converted independently: the conversion is deterministic,
+    so primary keys and the foreign keys that reference them stay consistent.
+    Rows already stored as BLOB are skipped, which makes the migration
+    idempotent and cheap to run on every start.
+
+    Args:
+        engine: Engine bound to the SQLite database to migrate.
+
+    Returns:
+        The number of values rewritten.
+    """
+    converted = 0
+    with engine.begin() as conn:
+        raw: sqlite3.Connection = conn.connection.driver_connection
+        tables = {
+            row[0]
+            for row in raw.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        }
+        for table, column in _compact_columns():
+            if table not in tables:
+                continue
+            cursor = raw.execute(
+                f'SELECT rowid, "{column}" FROM "{table}" '
+                f'WHERE typeof("{column}") = \'text\' AND length("{column}") = 36'
+            )
+            while rows := cursor.fetchmany(MIGRATION_BATCH_SIZE):
+                raw.executemany(
+                    f'UPDATE "{table}" SET "{column}" = ? WHERE rowid = ?',
+                    [(UUID(value).bytes, rowid) for rowid, value in rows],
+                )
+                converted += len(rows)
+    return converted
+
+
+# Índices retirados de los modelos que pueden seguir en bases de datos existentes
+STALE_INDEXES = ("ix_useridentity_password",)
+
+
+def drop_stale_indexes(engine: Engine):
+    """Drops indexes that were removed from the models (e.g. on password hashes)."""
+    with engine.begin() as conn:
+        for name in STALE_INDEXES:
+            conn.exec_driver_sql(f'DROP INDEX IF EXISTS "{name}"')
+
+
+def add_missing_columns(engine: Engine) -> list[str]:
+    """Adds model columns missing from existing tables with ALTER TABLE.
+
+    SQLite adds nullable columns and columns with a server default (e.g.
+    ``version``) in place; a new NOT NULL column without one fails. Tables
+    that do not exist in the file (such as unsharded tables in a shard
+    file) are skipped.
+
+    Returns:
+        The ``table.column`` names added.
+    """
+    added = []
+    existing = inspect(engine)
+    tables = set(existing.get_table_names())
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if table.name not in tables:
+                continue
+            present = {column["name"] for column in existing.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in present:
+                    continue
+                ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                conn.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN {ddl}')
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def add_missing_indexes(engine: Engine) -> list[str]:
+    """Creates model indexes missing from existing tables.
+
+    ``create_all`` skips tables that already exist, so indexes added to a
+    model later (e.g. on ``statehistory``) are created here.
+
+    Returns:
+        The names of the indexes created.
+    """
+    added = []
+    existing = inspect(engine)
+    tables = set(existing.get_table_names())
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if table.name not in tables:
+                continue
+            present = {index["name"] for index in existing.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in present:
+                    index.create(conn)
+                    added.append(index.name)
+    return added
+
+
+def enable_incremental_vacuum(engine: Engine) -> bool:
+    """Turns on incremental auto-vacuum in a database file without tables.
+
+    The mode can only change while the file is empty (or with a full
+    ``VACUUM``, see ``python -m src.services.retention convert``), so it is
+    set before the first ``create_all``.
+
+    Returns:
+        True if the mode was set.
+    """
+    with engine.connect() as conn:
+        raw: sqlite3.Connection = conn.connection.driver_connection
+        if raw.execute("SELECT count(*) FROM sqlite_master").fetchone()[0]:
+            return False
+        raw.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # En un archivo vacío el VACUUM es inmediato y fija el modo
+        raw.execute("VACUUM")
+    return True
+
+
+if __name__ == "__main__":
+    from src.config.base import engine
+    import src.entities.device.models  # noqa: F401  registra las tablas restantes
+
+    print(f"Columnas añadidas: {add_missing_columns(engine)}")
+    print(f"Índices añadidos: {add_missing_indexes(engine)}")
+    print(f"IDs migrados: {migrate_ids_to_compact(engine)}")
+    drop_stale_indexes(engine)
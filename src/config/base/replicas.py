@@ -0,0 +1,222 @@
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+from sqlalchemy import Engine
+from sqlmodel import create_engine
+
+logger = logging.getLogger(__name__)
+
+# Páginas copiadas por paso de backup y pausa entre pasos (libera el bloqueo)
+BACKUP_PAGES_PER_STEP = 1024
+BACKUP_SLEEP = 0.005
+# Hora (Unix) del último commit del cliente, devuelta tras cada escritura
+LAST_WRITE_HEADER = "X-Last-Write"
+LAST_WRITE_COOKIE = "last_write"
+
+
+class ReplicaSet:
+    """Routes reads to SQLite replicas and keeps them refreshed.
+
+    Replicas are read-only copies of the primary file produced with SQLite's
+    online backup API: each refresh copies into a per-process temporary file
+    and atomically replaces the replica. The refresh of a replica is guarded
+    by a file lock and skipped while the file is fresh, so with several
+    workers only one of them copies the primary per interval. The replica's
+    modification time is set to when its copy started; every worker disposes
+    its pool when that time changes and falls back to the primary when the
+    replica is missing or older than `max_lag` seconds.
+    Responses to writes carry the commit time (`ReadYourWritesMiddleware`);
+    reads sending it back are served by a replica copied after that time,
+    or by the primary, so a client always reads its own writes from any
+    worker. Such clients also skip result sharing for `pin_window` seconds.
+    """
+
+    def __init__(
+        self,
+        primary: Engine,
+        primary_file: str,
+        replica_files: list[str],
+        refresh_interval: float = 5.0,
+        pin_window: float = 10.0,
+        max_lag: float | None = None,
+    ):
+        """Initializes the replica engines (files are created on `start`).
+
+        Args:
+            primary: Engine of the primary database, used for writes.
+            primary_file: Path of the primary SQLite file.
+            replica_files: Paths of the replica files; empty disables routing.
+            refresh_interval: Seconds between replica refreshes.
+            pin_window: Seconds a client's reads are not shared after a write.
+            max_lag: Age after which a replica is not read (default three
+                refresh intervals), e.g. when no process refreshes it.
+        """
+        self.primary = primary
+        self.primary_file = primary_file
+        self.replica_files = replica_files
+        self.refresh_interval = refresh_interval
+        self.pin_window = pin_window
+        self.max_lag = max_lag if max_lag is not None else 3 * refresh_interval
+        self.engines: list[Engine] = [
+            create_engine(
+                f"sqlite:///file:{path}?mode=ro&uri=true",
+                connect_args={"check_same_thread": False},
+            )
+            for path in replica_files
+        ]
+        self._round_robin = itertools.count()
+        self._lock = threading.Lock()
+        # Hora de copia de cada réplica que usan las conexiones del pool
+        self._copied_at: list[float | None] = [None] * len(replica_files)
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def is_pinned(self, last_write: float | None) -> bool:
+        """Whether a client that last wrote at `last_write` did so recently."""
+        return last_write is not None and time.time() - last_write < self.pin_window
+
+    def read_engine(self, last_write: float | None = None) -> Engine:
+        """Returns the engine for a read from a client that last wrote at
+        `last_write`: a fresh replica copied after that write, else the primary.
+        """
+        if not self.engines:
+            return self.primary
+        start = next(self._round_robin)
+        now = time.time()
+        for offset in range(len(self.engines)):
+            index = (start + offset) % len(self.engines)
+            copied_at = self.copied_at(index)
+            if copied_at is None or now - copied_at > self.max_lag:
+                continue
+            if last_write is None or copied_at > last_write:
+                return self.engines[index]
+        return self.primary
+
+    def copied_at(self, index: int) -> float | None:
+        """Returns when replica `index` was copied, or None if it is missing.
+
+        A new copy (possibly made by another process) disposes the pool, so
+        connections opened on the replaced file are not reused.
+        """
+        try:
+            copied_at = os.stat(self.replica_files[index]).st_mtime
+        except FileNotFoundError:
+            return None
+        if copied_at != self._copied_at[index]:
+            with self._lock:
+                if copied_at != self._copied_at[index]:
+                    self.engines[index].dispose()
+                    self._copied_at[index] = copied_at
+        return copied_at
+
+    def refresh(self):
+        """Copies the primary into every replica with the online backup API.
+
+        Replicas refreshed by another process within the last interval, or
+        being refreshed right now, are skipped.
+        """
+        for index, path in enumerate(self.replica_files):
+            with open(f"{path}.lock", "a") as lock_file:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                copied_at = self.copied_at(index)
+                if copied_at is not None and (
+                    time.time() - copied_at < self.refresh_interval
+                ):
+                    continue
+                self._copy(path)
+                self.copied_at(index)
+
+    def _copy(self, path: str):
+        # Archivo temporal propio del proceso: nunca se mezclan dos copias
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        started_at = time.time()
+        source = sqlite3.connect(self.primary_file)
+        target = sqlite3.connect(tmp_path)
+        try:
+            source.backup(target, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_SLEEP)
+            # La copia hereda el modo WAL del primario; una réplica de
+            # solo lectura no lo necesita
+            target.execute("PRAGMA journal_mode = DELETE")
+        except BaseException:
+            target.close()
+            os.remove(tmp_path)
+            raise
+        finally:
+            target.close()
+            source.close()
+        # La copia contiene al menos lo confirmado antes de empezar
+        os.utime(tmp_path, (started_at, started_at))
+        os.replace(tmp_path, path)
+
+    def start(self):
+        """Creates the replicas and starts refreshing them in the background."""
+        if not self.engines or self._thread is not None:
+            return
+        self.refresh()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="replica-refresh", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background refresh."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Replica refresh failed")
+
+
+class ReadYourWritesMiddleware:
+    """Returns the commit time of a request's writes to the client.
+
+    `get_session` records it in the request state after each commit; this
+    middleware sends it as the ``X-Last-Write`` header and a cookie that
+    lives as long as a replica may lag, which `get_read_session` reads back.
+    """
+
+    def __init__(self, app, max_age: float):
+        self.app = app
+        self.max_age = int(max_age) + 1
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        state = scope.setdefault("state", {})
+
+        async def send_with_last_write(message):
+            last_write = state.get("last_write")
+            if message["type"] == "http.response.start" and last_write is not None:
+                value = f"{last_write:.6f}"
+                cookie = (
+                    f"{LAST_WRITE_COOKIE}={value}; Max-Age={self.max_age}; "
+                    "Path=/; HttpOnly; SameSite=Lax"
+                )
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (LAST_WRITE_HEADER.lower().encode(), value.encode()),
+                    (b"set-cookie", cookie.encode()),
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_last_write)
@@ -0,0 +1,82 @@
+import hashlib
+import os
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import Engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateIndex, CreateTable
+from sqlmodel import Field, Session, SQLModel
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+
+class SchemaVersion(SQLModel, table=True):
+    # Fila única con la huella del esquema aplicado
+    id: int = Field(default=1, primary_key=True)
+    fingerprint: str = Field(max_length=64)
+    applied_at: datetime = Field(default_factory=datetime.now)
+
+
+def schema_fingerprint(engine: Engine, extra: Iterable[str] = ()) -> str:
+    """Hashes the DDL of every model plus settings that change the schema.
+
+    Any change to a table, column, type, index or extra DDL registered in
+    ``metadata.info["ddl"]`` (or to `extra`, e.g. the ID storage or the shard
+    files) yields a different fingerprint.
+    """
+    digest = hashlib.sha256()
+    for table in SQLModel.metadata.sorted_tables:
+        digest.update(str(CreateTable(table).compile(dialect=engine.dialect)).encode())
+        for index in sorted(table.indexes, key=lambda index: index.name or ""):
+            digest.update(
+                str(CreateIndex(index).compile(dialect=engine.dialect)).encode()
+            )
+    # DDL adicional declarado por los modelos (p. ej. triggers de agregados)
+    for statement in SQLModel.metadata.info.get("ddl", ()):
+        digest.update(statement.encode())
+    for value in extra:
+        digest.update(value.encode())
+    return digest.hexdigest()
+
+
+def stored_fingerprint(engine: Engine) -> str | None:
+    """Returns the fingerprint recorded in the database, if any (one query)."""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(
+                text("SELECT fingerprint FROM schemaversion WHERE id = 1")
+            ).scalar()
+    except OperationalError:
+        return None
+
+
+def record_fingerprint(engine: Engine, fingerprint: str):
+    """Stores the fingerprint of the schema that was just applied."""
+    with Session(engine) as session:
+        session.merge(SchemaVersion(id=1, fingerprint=fingerprint))
+        session.commit()
+
+
+@contextmanager
+def startup_lock(path: str) -> Iterator[None]:
+    """Serializes schema setup across worker processes with a file lock."""
+    with open(path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def lock_path(database_file: str) -> str:
+    """Returns the lock file used next to a database file."""
+    return os.path.join(
+        os.path.dirname(database_file), f".{os.path.basename(database_file)}.lock"
+    )
@@ -0,0 +1,272 @@
+import json
+import os
+import sqlite3
+import sys
+import zlib
+from collections.abc import Iterable
+from typing import Any
+from uuid import UUID
+
+from sqlalchemy import Engine, event, inspect
+from sqlalchemy.orm import MANYTOONE, ORMExecuteState
+from sqlmodel import Session, SQLModel, create_engine
+
+# Cubetas virtuales: el mapa asigna cada cubeta a un archivo de shard
+SHARD_BUCKETS = 64
+
+
+class ShardRoutingError(Exception):
+    """Raised when a sharded table is queried without choosing a shard."""
+
+
+def shard_bucket(id: str | bytes) -> int:
+    """Returns the virtual bucket of an ID (stable across processes).
+
+    Accepts the string form used by the models and the 16-byte form stored by
+    `CompactUUID`, so SQLite can compute the same bucket with this function.
+    """
+    if isinstance(id, bytes):
+        id = str(UUID(bytes=id)) if len(id) == 16 else id.decode(errors="replace")
+    return zlib.crc32(str(id).encode()) % SHARD_BUCKETS
+
+
+class ShardSet:
+    """Partitions some tables by ID across several SQLite files.
+
+    Every ID hashes to one of `SHARD_BUCKETS` virtual buckets and a JSON map
+    assigns buckets to files, so adding a file only moves the buckets that
+    `rebalance` hands over to it. Each file has its own write lock, letting
+    writers to different shards proceed in parallel. The map is read when the
+    process starts; move buckets with the application stopped.
+    """
+
+    def __init__(
+        self,
+        primary: Engine,
+        files: list[str],
+        map_file: str,
+        tables: Iterable[str],
+    ):
+        """Initializes the shard engines and loads (or creates) the bucket map.
+
+        Args:
+            primary: Engine used for the tables when sharding is disabled.
+            files: Paths of the shard files; empty disables sharding.
+            map_file: Path of the JSON bucket map.
+            tables: Names of the tables partitioned across the shards.
+        """
+        self.primary = primary
+        self.files = files
+        self.map_file = map_file
+        self.tables = frozenset(tables)
+        self.engines: dict[str, Engine] = {
+            path: create_engine(
+                f"sqlite:///{path}", connect_args={"check_same_thread": False}
+            )
+            for path in files
+        }
+        self.bucket_map: list[str] = self._load_map() if files else []
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.engines)
+
+    def is_sharded(self, mapper: Any) -> bool:
+        """Whether a mapped class or mapper belongs to a sharded table."""
+        if not self.enabled:
+            return False
+        table = getattr(inspect(mapper, raiseerr=False), "local_table", None)
+        return table is not None and table.name in self.tables
+
+    def shard_for(self, id: str) -> str:
+        """Returns the shard file holding the row with `id`."""
+        return self.bucket_map[shard_bucket(id)]
+
+    def route(self, db: Session, shard: str):
+        """Sends the following queries on sharded tables in `db` to `shard`."""
+        db.info["shard"] = shard
+
+    def partition(
+        self, table: str, rows: list[dict[str, Any]]
+    ) -> list[tuple[Engine, list[dict[str, Any]]]]:
+        """Groups rows with an ``id`` key by the engine that stores them."""
+        if not self.enabled or table not in self.tables:
+            return [(self.primary, rows)]
+        groups: dict[str, list[dict[str, Any]]] = {}
+        for row in rows:
+            groups.setdefault(self.shard_for(row["id"]), []).append(row)
+        return [(self.engines[shard], group) for shard, group in groups.items()]
+
+    def create_all(self):
+        """Creates the sharded tables in every shard file."""
+        tables = [SQLModel.metadata.tables[name] for name in sorted(self.tables)]
+        for engine in self.engines.values():
+            SQLModel.metadata.create_all(engine, tables=tables)
+
+    def move_bucket(self, bucket: int, target: str) -> int:
+        """Copies the rows of a bucket to `target`, deletes them at the source
+        and updates the map.
+
+        Returns:
+            The number of rows moved.
+        """
+        source = self.bucket_map[bucket]
+        if target not in self.engines:
+            raise ValueError(f"Shard desconocido: {target}")
+        if source == target:
+            return 0
+        moved = 0
+        conn = sqlite3.connect(source, isolation_level=None)
+        try:
+            conn.create_function("shard_bucket", 1, shard_bucket, deterministic=True)
+            conn.execute("ATTACH DATABASE ? AS target", (target,))
+            conn.execute("BEGIN IMMEDIATE")
+            for table in sorted(self.tables):
+                moved += conn.execute(
+                    f'INSERT INTO target."{table}" '
+                    f'SELECT * FROM main."{table}" WHERE shard_bucket(id) = ?',
+                    (bucket,),
+                ).rowcount
+                conn.execute(
+                    f'DELETE FROM main."{table}" WHERE shard_bucket(id) = ?', (bucket,)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        self.bucket_map[bucket] = target
+        self._save_map()
+        return moved
+
+    def rebalance(self) -> list[tuple[int, str, str]]:
+        """Moves buckets until every shard holds an even share.
+
+        Returns:
+            The ``(bucket, source, target)`` moves performed.
+        """
+        share, extra = divmod(SHARD_BUCKETS, len(self.files))
+        quota = {path: share + (i < extra) for i, path in enumerate(self.files)}
+        owned: dict[str, list[int]] = {path: [] for path in self.files}
+        for bucket, path in enumerate(self.bucket_map):
+            owned.setdefault(path, []).append(bucket)
+        surplus = [
+            bucket
+            for path, buckets in owned.items()
+            for bucket in buckets[quota.get(path, 0) :]
+        ]
+        moves = []
+        for path in self.files:
+            while len(owned[path]) < quota[path] and surplus:
+                bucket = surplus.pop()
+                moves.append((bucket, self.bucket_map[bucket], path))
+                self.move_bucket(bucket, path)
+                owned[path].append(bucket)
+        return moves
+
+    def _load_map(self) -> list[str]:
+        if os.path.exists(self.map_file):
+            with open(self.map_file) as f:
+                bucket_map = json.load(f)
+            if len(bucket_map) != SHARD_BUCKETS:
+                raise ValueError(f"Mapa de shards inválido: {self.map_file}")
+            unknown = set(bucket_map) - set(self.files)
+            if unknown:
+                raise ValueError(f"Shards sin configurar: {sorted(unknown)}")
+            return bucket_map
+        bucket_map = [
+            self.files[bucket % len(self.files)] for bucket in range(SHARD_BUCKETS)
+        ]
+        self.bucket_map = bucket_map
+        self._save_map()
+        return bucket_map
+
+    def _save_map(self):
+        tmp_path = f"{self.map_file}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.bucket_map, f)
+        os.replace(tmp_path, self.map_file)
+
+
+class RoutingSession(Session):
+    """Session that sends sharded tables to their shard file.
+
+    Flushes route each instance by its own ID; queries use the shard chosen
+    with `ShardSet.route`. Expired attributes are reloaded from the shard of
+    the instance's ID and lazy loads of a sharded many-to-one relationship
+    (e.g. ``DeviceRelation.device1``) from the shard of the foreign key
+    value, while collections of a sharded table span every shard and must be
+    loaded through the repository. Other tables use the session's bind.
+    """
+
+    def __init__(self, bind: Engine, shards: ShardSet, **kwargs):
+        super().__init__(bind, **kwargs)
+        self.shards = shards
+        if shards.enabled:
+            self.connection_callable = self._shard_connection
+
+    def get_bind(self, mapper=None, *, clause=None, instance=None, shard=None, **kw):
+        if mapper is not None and self.shards.is_sharded(mapper):
+            if instance is not None:
+                return self.shards.engines[self.shards.shard_for(instance.id)]
+            shard = shard or self.info.get("shard")
+            if shard is None:
+                raise ShardRoutingError(
+                    "Consulta sobre una tabla particionada sin shard"
+                )
+            return self.shards.engines[shard]
+        return super().get_bind(mapper, clause=clause, **kw)
+
+    def _shard_connection(self, mapper=None, instance=None, **kw):
+        return self.get_transaction().connection(mapper, instance=instance)
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _route_instance_load(orm_execute_state: ORMExecuteState):
+    # Cargas ligadas a una instancia: no dependen del shard elegido con route()
+    shards: ShardSet = orm_execute_state.session.shards
+    if not shards.enabled or not orm_execute_state.is_select:
+        return
+    refreshed = orm_execute_state.load_options._refresh_state
+    if refreshed is not None:
+        # Atributos expirados: la fila está en el shard de su propio ID
+        if refreshed.key is not None and shards.is_sharded(refreshed.mapper):
+            id, *_ = refreshed.key[1]
+            orm_execute_state.bind_arguments["shard"] = shards.shard_for(id)
+        return
+    parent = orm_execute_state.lazy_loaded_from
+    if parent is None:
+        return
+    relationship = orm_execute_state.loader_strategy_path[-1]
+    if not shards.is_sharded(relationship.mapper):
+        return
+    if relationship.direction is not MANYTOONE:
+        raise ShardRoutingError(
+            f"{relationship} abarca todos los shards: cárguela con el repositorio"
+        )
+    # La clave foránea del padre es el ID de la fila cargada
+    (local, _), *_ = relationship.local_remote_pairs
+    key = parent.mapper.get_property_by_column(local).key
+    id = getattr(parent.obj(), key)
+    if id is not None:
+        orm_execute_state.bind_arguments["shard"] = shards.shard_for(id)
+
+
+if __name__ == "__main__":
+    from src.config.base import shards
+    import src.entities.device.models  # noqa: F401  registra las tablas particionadas
+
+    if not shards.enabled:
+        sys.exit("Configura SQLITE_SHARDS para usar esta herramienta")
+    command = sys.argv[1] if len(sys.argv) > 1 else "status"
+    if command == "move":
+        bucket, target = int(sys.argv[2]), sys.argv[3]
+        print(f"Filas movidas: {shards.move_bucket(bucket, target)}")
+    elif command == "rebalance":
+        shards.create_all()
+        for bucket, source, target in shards.rebalance():
+            print(f"Cubeta {bucket}: {source} -> {target}")
+    for path in shards.files:
+        print(f"{path}: {shards.bucket_map.count(path)} cubetas")
@@ -1,5 +1,114 @@
-from uuid import uuid4
+import os
+import time
+from uuid import UUID, uuid4
+
+from sqlalchemy.types import LargeBinary, TypeDecorator
+from sqlmodel import AutoString
+
+# Estrategia de generación de IDs: "uuid7" (ordenado por tiempo) o "uuid4" (aleatorio)
+ID_STRATEGY = os.environ.get("ID_STRATEGY", "uuid7")
+# Almacenamiento de IDs: "blob" (16 bytes) o "text" (36 caracteres)
+ID_STORAGE = os.environ.get("ID_STORAGE", "blob")
+
+
+def uuid7() -> UUID:
+    """Generates a time-ordered UUID version 7 (RFC 9562).
+
+    The first 48 bits hold the Unix timestamp in milliseconds, so keys created
+    later sort after earlier ones and inserts append to the end of the B-tree.
+    """
+    timestamp_ms = time.time_ns() // 1_000_000
+    return UUID(int=_uuid7_value(timestamp_ms, int.from_bytes(os.urandom(10))))
+
+
+def _uuid7_value(timestamp_ms: int, rand: int) -> int:
+    value = (timestamp_ms & 0xFFFF_FFFF_FFFF) << 80
+    value |= 0x7 << 76  # versión 7
+    value |= ((rand >> 62) & 0xFFF) << 64  # rand_a (12 bits)
+    value |= 0b10 << 62  # variante RFC 4122
+    value |= rand & 0x3FFF_FFFF_FFFF_FFFF  # rand_b (62 bits)
+    return value
+
+
+def new_stored_ids(count: int) -> list[str | bytes]:
+    """Generates `count` keys already in their stored form, for bulk inserts.
+
+    UUIDv7 keys come sorted, so a batch appends to the end of the B-tree.
+    """
+    if ID_STRATEGY == "uuid7":
+        timestamp_ms = time.time_ns() // 1_000_000
+        rand = os.urandom(10 * count)
+        values = sorted(
+            _uuid7_value(timestamp_ms, int.from_bytes(rand[i : i + 10]))
+            for i in range(0, len(rand), 10)
+        )
+        keys = [value.to_bytes(16) for value in values]
+    else:
+        keys = [_ID_GENERATORS[ID_STRATEGY]().bytes for _ in range(count)]
+    if ID_STORAGE == "blob":
+        return keys
+    return [str(UUID(bytes=key)) for key in keys]
+
+
+_ID_GENERATORS = {
+    "uuid4": uuid4,
+    "uuid7": uuid7,
+}
 
 
 def get_uuid() -> str:
-    return str(uuid4())
+    return str(_ID_GENERATORS[ID_STRATEGY]())
+
+
+class CompactUUID(TypeDecorator):
+    """Stores UUID strings as 16-byte BLOBs and renders them back as strings.
+
+    Values that are not valid UUIDs are bound as raw bytes, so lookups with a
+    malformed ID simply find nothing instead of failing. Legacy TEXT values
+    are returned as-is until `migrate_ids_to_compact` rewrites them.
+    """
+
+    impl = LargeBinary(16)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, bytes):
+            return value
+        try:
+            return UUID(str(value)).bytes
+        except ValueError:
+            return str(value).encode()
+
+    def process_result_value(self, value, dialect):
+        if isinstance(value, bytes) and len(value) == 16:
+            return str(UUID(bytes=value))
+        return value
+
+
+def stored_id(id: str) -> str | bytes:
+    """Returns `id` in its stored form, which `IdType` binds unchanged.
+
+    Converting a repeated ID once saves the per-row conversion of large
+    ``executemany`` batches.
+    """
+    if ID_STORAGE == "blob":
+        return CompactUUID().process_bind_param(id, None)
+    return id
+
+
+def canonical_id(id: str) -> str:
+    """Returns `id` as `IdType` reads it back from the database.
+
+    In blob mode any spelling of a UUID (e.g. upper case) finds the same row,
+    which is then reported in lowercase hyphenated form.
+    """
+    if ID_STORAGE == "blob":
+        try:
+            return str(UUID(id))
+        except ValueError:
+            return id
+    return id
+
+
+# Tipo de columna usado por todas las claves primarias y foráneas
+IdType = CompactUUID if ID_STORAGE == "blob" else AutoString
@@ -0,0 +1,70 @@
+from datetime import datetime
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.concurrency import run_in_threadpool
+
+from src.services.permissions import require_permission
+from src.services.retention import ARCHIVED_TABLES
+from src.shared.archive import cold_archive
+
+# Lectura lenta de las filas movidas al almacenamiento en frío por la retención
+archive_router = APIRouter(prefix="/archive", tags=["archive"])
+
+
+@archive_router.get(
+    "/state-history", dependencies=[Depends(require_permission("device:read"))]
+)
+async def get_archived_state_history(
+    entity_id: str | None = None,
+    entity_type: str | None = None,
+    state_id: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    offset: Annotated[int, Query(ge=0)] = 0,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+):
+    filters = {"entity_id": entity_id, "entity_type": entity_type, "state_id": state_id}
+    wanted = {field: value for field, value in filters.items() if value is not None}
+    return await run_in_threadpool(
+        cold_archive.query,
+        "statehistory",
+        ARCHIVED_TABLES["statehistory"],
+        since,
+        until,
+        lambda row: all(row[field] == value for field, value in wanted.items()),
+        offset,
+        limit,
+    )
+
+
+@archive_router.get(
+    "/device-relations",
+    dependencies=[Depends(require_permission("device_relation:read"))],
+)
+async def get_archived_device_relations(
+    device_id: str | None = None,
+    relation_type: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    offset: Annotated[int, Query(ge=0)] = 0,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+):
+    def match(row: dict) -> bool:
+        if device_id is not None and device_id not in (
+            row["device_id1"],
+            row["device_id2"],
+        ):
+            return False
+        return relation_type is None or row["relation_type"] == relation_type
+
+    return await run_in_threadpool(
+        cold_archive.query,
+        "devicerelation",
+        ARCHIVED_TABLES["devicerelation"],
+        since,
+        until,
+        match,
+        offset,
+        limit,
+    )
@@ -0,0 +1,72 @@
+from fastapi import APIRouter, Depends
+from fastapi.concurrency import run_in_threadpool
+
+from src.config.base import SessionDep
+from src.config.exception_handler import unauthorized_exception
+from src.services.credentials import DUMMY_HASH, credential_service
+from src.services.permissions import PSEUDO_ROLES, require_permission
+from src.services.tokens import TOKEN_TTL, issue_token
+from src.entities.user.routes import user_repository
+from src.entities.device.routes import device_repository
+from .schemes import (
+    LoginRequest,
+    LoginResponse,
+    DeviceAuthRequest,
+    DeviceAuthResponse,
+)
+
+auth_router = APIRouter(prefix="/auth", tags=["auth"])
+
+
+@auth_router.post("/login", response_model=LoginResponse)
+async def login(credentials: LoginRequest, session: SessionDep):
+    identity = await run_in_threadpool(
+        user_repository.get_identity_by_username, session, credentials.username
+    )
+    # Verificar siempre un hash para no revelar si el usuario existe
+    encoded = identity.password if identity else DUMMY_HASH
+    valid, needs_rehash = await credential_service.verify(credentials.password, encoded)
+    if identity is None or not valid:
+        raise unauthorized_exception("Credenciales inválidas")
+
+    if needs_rehash:
+        new_hash = await credential_service.hash(credentials.password)
+        await run_in_threadpool(
+            user_repository.set_password, session, identity, new_hash
+        )
+    role_ids = await run_in_threadpool(
+        lambda: [role.id for role in identity.user.roles]
+    )
+    return LoginResponse(
+        user_id=identity.user_id,
+        username=identity.username,
+        access_token=issue_token(identity.user_id, role_ids),
+        expires_in=TOKEN_TTL,
+    )
+
+
+@auth_router.post("/device", response_model=DeviceAuthResponse)
+async def device_auth(credentials: DeviceAuthRequest, session: SessionDep):
+    device = await run_in_threadpool(
+        device_repository.get_by_serial_number, session, credentials.serial_number
+    )
+    encoded = device.password_hash if device else DUMMY_HASH
+    valid, needs_rehash = await credential_service.verify(credentials.password, encoded)
+    if device is None or not valid:
+        raise unauthorized_exception("Credenciales inválidas")
+
+    if needs_rehash:
+        new_hash = await credential_service.hash(credentials.password)
+        await run_in_threadpool(
+            device_repository.set_password_hash, session, device, new_hash
+        )
+    return DeviceAuthResponse(
+        device_id=device.id,
+        access_token=issue_token(device.id, list(PSEUDO_ROLES)),
+        expires_in=TOKEN_TTL,
+    )
+
+
+@auth_router.get("/stats", dependencies=[Depends(require_permission("admin:stats"))])
+async def credential_stats():
+    return credential_service.stats()
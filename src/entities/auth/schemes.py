@@ -0,0 +1,28 @@
+from sqlmodel import SQLModel
+
+
+# Credenciales de un usuario
+class LoginRequest(SQLModel):
+    username: str
+    password: str
+
+
+class LoginResponse(SQLModel):
+    user_id: str
+    username: str
+    access_token: str
+    token_type: str = "bearer"
+    expires_in: int
+
+
+# Credenciales de un dispositivo
+class DeviceAuthRequest(SQLModel):
+    serial_number: str
+    password: str
+
+
+class DeviceAuthResponse(SQLModel):
+    device_id: str
+    access_token: str
+    token_type: str = "bearer"
+    expires_in: int
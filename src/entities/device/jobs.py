@@ -0,0 +1,101 @@
+"""Background jobs over devices, run by `src.services.jobs` in worker processes."""
+
+import json
+
+from sqlmodel import select
+
+from src.config.base import RoutingSession, engine, shards
+from src.entities.device.routes import device_relation_repository, device_repository
+from src.entities.state.models import StateHistory
+from src.services.jobs import JobContext
+from src.shared.base_repository import IN_CLAUSE_CHUNK_SIZE
+
+# Filas por página (también acota las cláusulas IN de cada página)
+PAGE_SIZE = IN_CLAUSE_CHUNK_SIZE
+
+
+def export_devices(job: JobContext) -> str:
+    """Writes every device (without its secret) as NDJSON."""
+    with RoutingSession(engine, shards) as db:
+        total = device_repository.count(db)
+        done = 0
+        with job.result(".ndjson") as file:
+            for page in device_repository.iter_pages(db, PAGE_SIZE):
+                for device in page:
+                    record = {
+                        "id": device.id,
+                        "nombre": device.nombre,
+                        "serial_number": device.serial_number,
+                        "state_id": device.state_id,
+                        "created_at": device.created_at.isoformat(),
+                    }
+                    file.write(json.dumps(record) + "\n")
+                done += len(page)
+                db.expunge_all()
+                job.report(done, total, f"{done} de {total} dispositivos")
+    return f"{done} dispositivos exportados"
+
+
+def rebuild_relations(job: JobContext) -> str:
+    """Deletes relations pointing to devices that no longer exist.
+
+    With ``{"dry_run": true}`` it only lists them. The removed relations are
+    written as NDJSON.
+    """
+    dry_run = bool(job.params.get("dry_run", False))
+    with RoutingSession(engine, shards) as db:
+        total = device_relation_repository.count(db)
+        done = removed = 0
+        with job.result(".ndjson") as file:
+            for page in device_relation_repository.iter_pages(db, PAGE_SIZE):
+                referenced = {r.device_id1 for r in page} | {r.device_id2 for r in page}
+                found = device_repository.get_by_ids(db, list(referenced))
+                for relation in page:
+                    if relation.device_id1 in found and relation.device_id2 in found:
+                        continue
+                    file.write(json.dumps({"id": relation.id}) + "\n")
+                    removed += 1
+                    if not dry_run:
+                        db.delete(relation)
+                # Las filas se enrutan a su shard por su propio ID al confirmar
+                db.commit()
+                done += len(page)
+                db.expunge_all()
+                job.report(done, total, f"{done} de {total} relaciones")
+    action = "encontradas" if dry_run else "eliminadas"
+    return f"{done} relaciones revisadas, {removed} huérfanas {action}"
+
+
+def backfill_state_history(job: JobContext) -> str:
+    """Adds the initial state history entry of devices that have none."""
+    with RoutingSession(engine, shards) as db:
+        total = device_repository.count(db)
+        done = added = 0
+        for page in device_repository.iter_pages(db, PAGE_SIZE):
+            ids = [device.id for device in page]
+            with_history = set(
+                db.exec(
+                    select(StateHistory.entity_id).where(
+                        StateHistory.entity_type == "Device",
+                        StateHistory.entity_id.in_(ids),
+                    )
+                ).all()
+            )
+            for device in page:
+                if device.id in with_history:
+                    continue
+                db.add(
+                    StateHistory(
+                        entity_type="Device",
+                        entity_id=device.id,
+                        previous_state_id=None,
+                        state_id=device.state_id,
+                        changed_at=device.created_at,
+                    )
+                )
+                added += 1
+            db.commit()
+            done += len(page)
+            db.expunge_all()
+            job.report(done, total, f"{done} de {total} dispositivos")
+    return f"{added} historiales iniciales creados"
@@ -1,19 +1,22 @@
 from sqlmodel import SQLModel, Field, Relationship
-from src.config.base.utils import get_uuid
+from src.config.base.utils import IdType, get_uuid
 from datetime import datetime
 from src.entities.state.models import State
+from src.shared.aggregates import aggregates
 
 
 # ================================================
 # Dispositivos
 # ================================================
 class Device(SQLModel, table=True):
-    id: str = Field(default_factory=get_uuid, primary_key=True)
-    state_id: str = Field(foreign_key="state.id")
+    id: str = Field(default_factory=get_uuid, primary_key=True, sa_type=IdType)
+    state_id: str = Field(foreign_key="state.id", sa_type=IdType)
     nombre: str = Field(max_length=100, index=True)
     serial_number: str = Field(max_length=50, unique=True, index=True)
     password_hash: str = Field(max_length=255)
     created_at: datetime = Field(default_factory=datetime.now)
+    # Concurrencia optimista: cada escritura la incrementa (If-Match)
+    version: int = Field(default=1, sa_column_kwargs={"server_default": "1"})
 
     # Relaciones
     state: State = Relationship(back_populates="devices")
@@ -36,11 +39,12 @@ class Device(SQLModel, table=True):
 
 
 class DeviceRelation(SQLModel, table=True):
-    id: str = Field(default_factory=get_uuid, primary_key=True)
-    device_id1: str = Field(foreign_key="device.id")
-    device_id2: str = Field(foreign_key="device.id")
+    id: str = Field(default_factory=get_uuid, primary_key=True, sa_type=IdType)
+    device_id1: str = Field(foreign_key="device.id", sa_type=IdType)
+    device_id2: str = Field(foreign_key="device.id", sa_type=IdType)
     relation_type: str = Field(max_length=50)  # Ej: "parent", "sibling"
     created_at: datetime = Field(default_factory=datetime.now)
+    version: int = Field(default=1, sa_column_kwargs={"server_default": "1"})
 
     # Relaciones
     device1: Device = Relationship(
@@ -53,6 +57,11 @@ class DeviceRelation(SQLModel, table=True):
     )
 
 
+# Resúmenes mantenidos por triggers (GET /stats/...)
+aggregates.count_by("devices_by_state", Device, "state_id")
+aggregates.count_by("relations_by_type", DeviceRelation, "relation_type")
+
+
 # ================================================
 # Relación Dispositivo-Service
 # ================================================
@@ -1,8 +1,12 @@
+from sqlalchemy import bindparam
 from sqlmodel import Session, select
 from fastapi import HTTPException
 from typing import override
 from collections.abc import Sequence
-from src.shared.base_repository import BaseRepository
+from src.config.base.shards import ShardSet
+from src.shared.entity_cache import EntityCache
+from src.shared.sharded_repository import ShardedRepository
+from src.shared.statements import cached_statement
 
 from .models import DeviceRelation
 from .schemes import DeviceRelationCreate, DeviceRelationUpdate
@@ -13,35 +17,45 @@ from .schemes import DeviceCreate, DeviceUpdate
 from src.entities.state.models import State
 
 
+def select_by_serial_number(model: type[Device]):
+    return select(model).where(model.serial_number == bindparam("serial")).limit(1)
+
+
 class DeviceRelationRepository(
-    BaseRepository[DeviceRelation, DeviceRelationCreate, DeviceRelationUpdate]
+    ShardedRepository[DeviceRelation, DeviceRelationCreate, DeviceRelationUpdate]
 ):
+    def __init__(
+        self,
+        model: type[DeviceRelation],
+        shards: ShardSet,
+        cache: EntityCache | None = None,
+    ):
+        super().__init__(model, shards, cache)
+        # Los extremos se buscan en la tabla de dispositivos, en su shard
+        self.devices = DeviceRepository(model=Device, shards=shards)
+
     @override
     def create(self, db: Session, obj_in: DeviceRelationCreate) -> DeviceRelation:
         # Verificar existencia de la instancia
-        id1 = self.get_by_id(db, obj_in.device_id1)
-        id2 = self.get_by_id(db, obj_in.device_id2)
+        id1 = self.devices.get_by_id(db, obj_in.device_id1)
+        id2 = self.devices.get_by_id(db, obj_in.device_id2)
         # Crear una instancia de DeviceRelation
         if id1 and id2:
             return super().create(db, obj_in)
         raise HTTPException(status_code=404, detail="IDs no validos")
 
     @override
-    def update(
-        self, db: Session, id: str, obj_in: DeviceRelationUpdate
-    ) -> DeviceRelation:
-        if obj_in.device_id1:
-            id1 = self.get_by_id(db, obj_in.device_id1)
-            if not id1:
-                raise HTTPException(status_code=404, detail="ID1 no valido")
-        if obj_in.device_id2:
-            id2 = self.get_by_id(db, obj_in.device_id2)
-            if not id2:
-                raise HTTPException(status_code=404, detail="ID2 no valido")
-        return super().update(db, id, obj_in)
-
-
-class DeviceRepository(BaseRepository[Device, DeviceCreate, DeviceUpdate]):
+    def validate_update(self, db: Session, obj_in: DeviceRelationUpdate) -> None:
+        # Una sola consulta para ambos IDs
+        ids = [id for id in (obj_in.device_id1, obj_in.device_id2) if id]
+        found = self.devices.get_by_ids(db, ids) if ids else {}
+        if obj_in.device_id1 and obj_in.device_id1 not in found:
+            raise HTTPException(status_code=404, detail="ID1 no valido")
+        if obj_in.device_id2 and obj_in.device_id2 not in found:
+            raise HTTPException(status_code=404, detail="ID2 no valido")
+
+
+class DeviceRepository(ShardedRepository[Device, DeviceCreate, DeviceUpdate]):
     @override
     def create(self, db: Session, obj_in: DeviceCreate) -> Device:
         # Verificar existencia de la instancia
@@ -52,9 +66,23 @@ class DeviceRepository(BaseRepository[Device, DeviceCreate, DeviceUpdate]):
         raise HTTPException(status_code=404, detail="Datos no validos")
 
     @override
-    def update(self, db: Session, id: str, obj_in: DeviceUpdate) -> Device:
+    def validate_update(self, db: Session, obj_in: DeviceUpdate) -> None:
         if obj_in.state_id:
             estado = db.get(State, obj_in.state_id)
             if not estado:
                 raise HTTPException(status_code=404, detail="Estado no valido")
-        return super().update(db, id, obj_in)
+
+    def get_by_serial_number(self, db: Session, serial_number: str) -> Device | None:
+        """Fetches a device by its unique serial number (searching every shard)."""
+        statement = cached_statement(select_by_serial_number, Device)
+        found = self.scatter(db, statement, {"serial": serial_number})
+        return next(iter(found), None)
+
+    def set_password_hash(self, db: Session, device: Device, encoded: str) -> None:
+        """Stores a new secret hash for a device."""
+        self._route(db, device.id)
+        device.password_hash = encoded
+        db.add(device)
+        db.commit()
+        if self.cache is not None:
+            self.cache.invalidate(device.id)
@@ -1,5 +1,7 @@
 from src.shared.base_controller import ControllerBuilder
-from src.shared.base_repository import BaseRepository
+from src.config.base import shards
+from src.shared.entity_cache import EntityCache, default_shared_tier
+from src.services.credentials import credential_service
 from src.entities.device.repository import DeviceRelationRepository, DeviceRepository
 from src.entities.device.models import Device, DeviceRelation
 from src.entities.device.schemes import (
@@ -11,23 +13,51 @@ from src.entities.device.schemes import (
     DeviceRelationUpdate,
 )
 
-
 # Inicializar el repositorio
-device_relation_repository = DeviceRelationRepository(model=DeviceRelation)
-
-device_relation_controller = ControllerBuilder(
-    repository=device_relation_repository,
-    response_schema=DeviceRelationPublic,
-    path_name="device_relation",
-).enable_full_crud(
-    update_schema=DeviceRelationUpdate, create_schema=DeviceRelationCreate
+device_relation_repository = DeviceRelationRepository(
+    model=DeviceRelation, shards=shards
+)
+
+device_relation_controller = (
+    ControllerBuilder(
+        repository=device_relation_repository,
+        response_schema=DeviceRelationPublic,
+        path_name="device_relation",
+    )
+    .enable_full_crud(
+        update_schema=DeviceRelationUpdate, create_schema=DeviceRelationCreate
+    )
+    .enable_idempotency()
+    .enable_change_feed()
+    .require_permissions()
 )
 
-device_repository = DeviceRepository(model=Device)
+
+async def hash_device_secret(obj: DeviceCreate | DeviceUpdate):
+    # El secreto del dispositivo nunca se almacena en claro
+    if obj.password_hash:
+        obj.password_hash = await credential_service.hash(obj.password_hash)
+    return obj
 
 
-device_controller = ControllerBuilder(
-    repository=device_repository,
-    response_schema=DevicePublic,
-    path_name="device",
-).enable_full_crud(update_schema=DeviceUpdate, create_schema=DeviceCreate)
+device_repository = DeviceRepository(
+    model=Device,
+    shards=shards,
+    cache=EntityCache("device", shared=default_shared_tier(), related=("state",)),
+)
+
+
+device_controller = (
+    ControllerBuilder(
+        repository=device_repository,
+        response_schema=DevicePublic,
+        path_name="device",
+    )
+    .enable_full_crud(update_schema=DeviceUpdate, create_schema=DeviceCreate)
+    .with_input_hook(hash_device_secret)
+    .enable_single_flight()
+    .enable_write_behind()
+    .enable_idempotency()
+    .enable_change_feed()
+    .require_permissions()
+)
@@ -22,6 +22,7 @@ class DevicePublic(SQLModel):
     state_id: str
     nombre: str
     created_at: datetime
+    version: int
 
     # Relaciones
     current_state: str
@@ -45,6 +46,7 @@ class DeviceRelationPublic(SQLModel):
     device_id2: str
     relation_type: str
     created_at: datetime
+    version: int
 
 
 # ================================================
@@ -0,0 +1,643 @@
+"""Bulk loads of devices and relations from CSV or NDJSON files.
+
+Rows are read incrementally and handled in batches: each batch is validated
+with one call against the create schema, references are resolved with one
+query per shard, and the rows are inserted with ``executemany`` in one
+transaction per batch and data file, bypassing the ORM. Rejected rows never stop the load;
+they are written as NDJSON (``{"line", "error", "row"}``, without secret
+fields) for correction.
+
+Run ``python -m src.entities.imports.importer devices|relations FILE`` to
+load a file from the command line (``--help`` lists the options).
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sqlite3
+import sys
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterable, Iterator
+from datetime import datetime
+from typing import IO, Any, NotRequired, TypedDict
+
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import Engine, Table, select
+from sqlmodel import SQLModel
+
+from src.config.base import engine, shards
+from src.config.base.utils import IdType, new_stored_ids
+from src.entities.device.models import Device, DeviceRelation
+from src.entities.device.schemes import DeviceCreate, DeviceRelationCreate
+from src.entities.state.models import State
+from src.services.credentials import SCRYPT_PREFIX, CredentialService
+from src.shared.aggregates import aggregates
+from src.shared.change_feed import change_feed
+
+# Filas por lote: una validación y una transacción por archivo de datos
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", 10_000))
+# Claves por consulta IN al resolver referencias (límite de variables de SQLite)
+LOOKUP_CHUNK_SIZE = 500
+# Referencias recordadas entre lotes (se vacía al superarlo); con menos
+# dispositivos que este límite se cargan todos en memoria al empezar
+LOOKUP_CACHE_SIZE = int(os.environ.get("IMPORT_LOOKUP_CACHE_SIZE", 1_000_000))
+
+FORMATS = ("csv", "ndjson")
+
+# (línea, fila leída o None, error de lectura o None)
+SourceRow = tuple[int, dict[str, Any] | None, str | None]
+
+
+def read_rows(lines: Iterable[str], format: str) -> Iterator[SourceRow]:
+    """Parses CSV (with a header row) or NDJSON lines one row at a time."""
+    if format == "csv":
+        reader = csv.reader(lines)
+        header = [name.strip() for name in next(reader, [])]
+        for values in reader:
+            if not values:
+                continue
+            if len(values) != len(header):
+                yield reader.line_num, None, f"Se esperaban {len(header)} columnas"
+                continue
+            yield reader.line_num, dict(zip(header, values)), None
+    elif format == "ndjson":
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield number, None, f"JSON inválido: {e.msg}"
+                continue
+            if not isinstance(row, dict):
+                yield number, None, "Se esperaba un objeto JSON"
+                continue
+            yield number, row, None
+    else:
+        raise ValueError(f"Formato desconocido: {format}")
+
+
+def _row_validator(
+    schema: type[SQLModel], resolved: tuple[str, ...] = ()
+) -> TypeAdapter:
+    # Un TypedDict con los campos del esquema valida un lote entero en una
+    # llamada, sin construir un modelo por fila. Los campos `resolved` pueden
+    # llegar ya resueltos por otra columna en "_campo"
+    fields: dict[str, Any] = {}
+    for name, field in schema.model_fields.items():
+        if name in resolved:
+            fields[name] = NotRequired[field.annotation]
+            fields[f"_{name}"] = NotRequired[Any]
+        else:
+            fields[name] = field.annotation
+    return TypeAdapter(list[TypedDict(f"{schema.__name__}Row", fields)])
+
+
+class BulkImporter(ABC):
+    """Loads rows of one table in batches of raw inserts.
+
+    Subclasses fill schema fields from alternative columns with `resolve`,
+    check the validated rows against the database with `prepare` and turn
+    the accepted rows into insert parameters with `to_record`.
+    """
+
+    schema: type[SQLModel]
+    model: type[SQLModel]
+    columns: tuple[str, ...]
+    # INSERT OR IGNORE: las filas que violan una clave única se rechazan
+    duplicate_error: str | None = None
+    # Columnas únicas: con shards se comprueban en todos antes de insertar
+    unique_columns: tuple[str, ...] = ()
+    # Campos que nunca se copian al archivo de rechazados (se puede descargar)
+    secret_fields: tuple[str, ...] = ()
+
+    def __init__(self, batch_size: int = IMPORT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.table: Table = self.model.__table__
+        self.validator = _row_validator(self.schema)
+        self.inserted = 0
+        self.rejected = 0
+        self._rejected_file: IO[str] | None = None
+        self._to_stored = IdType().bind_processor(engine.dialect) or (lambda v: v)
+        # Mismo formato de fecha que escribe SQLAlchemy en SQLite
+        timestamp = self.table.c.created_at.type.dialect_impl(engine.dialect)
+        self._timestamp = timestamp.bind_processor(engine.dialect)
+        verb = "INSERT OR IGNORE" if self.duplicate_error else "INSERT"
+        self._insert_sql = (
+            f'{verb} INTO "{self.table.name}" '
+            f"({', '.join(self.columns)}) VALUES ({', '.join('?' * len(self.columns))})"
+        )
+
+    @property
+    def engines(self) -> list[Engine]:
+        return list(shards.engines.values()) if self.sharded else [engine]
+
+    @property
+    def sharded(self) -> bool:
+        return shards.enabled and self.table.name in shards.tables
+
+    def run(
+        self,
+        rows: Iterable[SourceRow],
+        rejected: IO[str],
+        progress: Callable[[], None] | None = None,
+    ):
+        """Imports every row, writing the rejected ones to `rejected`."""
+        self._rejected_file = rejected
+        batch: list[tuple[int, dict[str, Any]]] = []
+        for line, row, error in rows:
+            if error is not None:
+                self.reject(line, error, row)
+                continue
+            batch.append((line, row))
+            if len(batch) >= self.batch_size:
+                self.load_batch(batch)
+                batch = []
+                if progress is not None:
+                    progress()
+        if batch:
+            self.load_batch(batch)
+            if progress is not None:
+                progress()
+
+    def reject(self, line: int, error: str, row: dict[str, Any] | None):
+        self.rejected += 1
+        if row is not None:
+            # Sin los valores internos ("_campo") ya resueltos ni los secretos
+            row = {
+                key: value
+                for key, value in row.items()
+                if key[:1] != "_" and key not in self.secret_fields
+            }
+        record = {"line": line, "error": error, "row": row}
+        self._rejected_file.write(json.dumps(record, default=str) + "\n")
+
+    def load_batch(self, batch: list[tuple[int, dict[str, Any]]]):
+        valid = self.prepare(self.validate(self.resolve(batch)))
+        if self.sharded and self.unique_columns:
+            valid = self.reject_duplicates(valid)
+        if not valid:
+            return
+        created_at = self._timestamp(datetime.now())
+        items = [
+            (self.to_record(id, row, created_at), line, row)
+            for id, (line, row) in zip(new_stored_ids(len(valid)), valid)
+        ]
+        if not self.sharded:
+            self.insert(engine, items)
+            return
+        groups: dict[str, list[tuple[tuple, int, dict[str, Any]]]] = {}
+        for item in items:
+            groups.setdefault(shards.shard_for(item[0][0]), []).append(item)
+        for shard, group in groups.items():
+            self.insert(shards.engines[shard], group)
+
+    def resolve(
+        self, batch: list[tuple[int, dict[str, Any]]]
+    ) -> list[tuple[int, dict[str, Any]]]:
+        """Fills schema fields from alternative columns before validation."""
+        return batch
+
+    def validate(
+        self, batch: list[tuple[int, dict[str, Any]]]
+    ) -> list[tuple[int, dict[str, Any]]]:
+        """Validates the whole batch at once; invalid rows are rejected."""
+        while batch:
+            try:
+                rows = self.validator.validate_python([row for _, row in batch])
+            except ValidationError as e:
+                errors: dict[int, str] = {}
+                for error in e.errors(include_url=False):
+                    index, *field = error["loc"]
+                    errors.setdefault(
+                        index, f"{'.'.join(map(str, field))}: {error['msg']}"
+                    )
+                for index, message in errors.items():
+                    self.reject(batch[index][0], message, batch[index][1])
+                # Revalidar el resto: los índices del error ya no aplican
+                batch = [item for i, item in enumerate(batch) if i not in errors]
+                continue
+            return [(line, row) for (line, _), row in zip(batch, rows)]
+        return []
+
+    def prepare(
+        self, valid: list[tuple[int, dict[str, Any]]]
+    ) -> list[tuple[int, dict[str, Any]]]:
+        """Checks validated rows against the database before inserting."""
+        return valid
+
+    def reject_duplicates(
+        self, valid: list[tuple[int, dict[str, Any]]]
+    ) -> list[tuple[int, dict[str, Any]]]:
+        """Rejects rows repeating a unique value of the batch or of any shard.
+
+        Each shard only enforces its unique indexes for its own rows, and the
+        rows of one batch go to different shards.
+        """
+        for column in self.unique_columns:
+            values = list({row[column] for _, row in valid})
+            existing = set()
+            for target in self.engines:
+                with target.connect() as conn:
+                    raw: sqlite3.Connection = conn.connection.driver_connection
+                    for start in range(0, len(values), LOOKUP_CHUNK_SIZE):
+                        chunk = values[start : start + LOOKUP_CHUNK_SIZE]
+                        existing.update(
+                            value
+                            for (value,) in raw.execute(
+                                f'SELECT {column} FROM "{self.table.name}" '
+                                f"WHERE {column} IN ({', '.join('?' * len(chunk))})",
+                                chunk,
+                            )
+                        )
+            accepted = []
+            for line, row in valid:
+                if row[column] in existing:
+                    self.reject(line, self.duplicate_error, row)
+                else:
+                    existing.add(row[column])
+                    accepted.append((line, row))
+            valid = accepted
+        return valid
+
+    @abstractmethod
+    def to_record(self, id: str | bytes, row: dict[str, Any], created_at) -> tuple:
+        """Returns the insert parameters of a row, in `columns` order."""
+
+    def insert(self, target: Engine, items: list[tuple[tuple, int, dict[str, Any]]]):
+        table = self.table.name
+        tracked = table in change_feed.tracked
+        try:
+            ids, inserted = self._insert(target, table, tracked, items)
+        except Exception:
+            # El rollback ya los restaura; nunca dejar el contador sin trigger
+            aggregates.restore_insert_triggers(target, table)
+            raise
+        if tracked and target is not engine:
+            # El outbox vive en el primario: se confirma después del shard
+            with engine.begin() as conn:
+                conn.connection.driver_connection.executemany(
+                    "INSERT INTO changerecord (entity, entity_id, op, changed_at) "
+                    "VALUES (?, ?, 'create', ?)",
+                    [(table, id, time.time()) for id in ids],
+                )
+        self.inserted += inserted
+
+    def _insert(
+        self,
+        target: Engine,
+        table: str,
+        tracked: bool,
+        items: list[tuple[tuple, int, dict[str, Any]]],
+    ) -> tuple[list, int]:
+        with target.begin() as conn:
+            raw: sqlite3.Connection = conn.connection.driver_connection
+            records = [record for record, _, _ in items]
+            counters = aggregates.suspend_insert_triggers(raw, table)
+            inserted = raw.executemany(self._insert_sql, records).rowcount
+            # Con el bloqueo de escritura tomado, las filas de este lote son
+            # las de rowid más alto
+            (last,) = raw.execute(f'SELECT max(rowid) FROM "{table}"').fetchone()
+            loaded = f'FROM "{table}" WHERE rowid > {(last or 0) - inserted}'
+            aggregates.count_inserted(raw, counters, loaded)
+            ids = [record[0] for record in records]
+            if inserted < len(records):
+                present = {id for (id,) in raw.execute(f"SELECT id {loaded}")}
+                for record, line, row in items:
+                    if record[0] not in present:
+                        self.reject(line, self.duplicate_error, row)
+                ids = [id for id in ids if id in present]
+            if tracked and target is engine:
+                raw.execute(
+                    "INSERT INTO changerecord (entity, entity_id, op, changed_at) "
+                    f"SELECT ?, id, 'create', ? {loaded} ORDER BY rowid",
+                    (table, time.time()),
+                )
+        return ids, inserted
+
+
+class DeviceImporter(BulkImporter):
+    """Imports devices; the state may be given by ``state_id`` or ``state``.
+
+    Secrets must already be scrypt hashes unless `plain_secrets` is set:
+    plaintext values are then hashed before inserting, one call per batch
+    spread over a pool of `CREDENTIAL_WORKERS` processes.
+    """
+
+    schema = DeviceCreate
+    model = Device
+    columns = (
+        "id",
+        "state_id",
+        "nombre",
+        "serial_number",
+        "password_hash",
+        "created_at",
+        "version",
+    )
+    duplicate_error = "serial_number: ya existe un dispositivo con ese número"
+    unique_columns = ("serial_number",)
+    secret_fields = ("password_hash",)
+
+    def __init__(self, plain_secrets: bool = False, **kwargs):
+        super().__init__(**kwargs)
+        self.plain_secrets = plain_secrets
+        # Pool propio: el importador corre en un trabajo o en la línea de órdenes
+        self.credentials = CredentialService() if plain_secrets else None
+        with engine.connect() as conn:
+            states = conn.execute(select(State.id, State.nombre)).all()
+        # Tabla de estados en memoria: ID -> ID almacenado, nombre -> ID
+        self.states = {id: self._to_stored(id) for id, _ in states}
+        self.states_by_name = {nombre: id for id, nombre in states}
+
+    def resolve(self, batch):
+        for _, row in batch:
+            if not row.get("state_id") and row.get("state"):
+                # Un nombre desconocido se rechaza como estado desconocido
+                row["state_id"] = self.states_by_name.get(row["state"], row["state"])
+        return batch
+
+    def run(self, *args, **kwargs):
+        try:
+            super().run(*args, **kwargs)
+        finally:
+            if self.credentials is not None:
+                self.credentials.shutdown()
+
+    def prepare(self, valid):
+        accepted = []
+        plaintext = []
+        prefix = f"{SCRYPT_PREFIX}$"
+        for line, row in valid:
+            if row["state_id"] not in self.states:
+                self.reject(line, "state_id: estado desconocido", row)
+                continue
+            if not row["password_hash"].startswith(prefix):
+                if not self.plain_secrets:
+                    self.reject(line, "password_hash: se esperaba un hash scrypt", row)
+                    continue
+                plaintext.append(row)
+            accepted.append((line, row))
+        if plaintext:
+            hashes = self.credentials.hash_many(
+                [row["password_hash"] for row in plaintext]
+            )
+            for row, encoded in zip(plaintext, hashes):
+                row["password_hash"] = encoded
+        return accepted
+
+    def to_record(self, id, row, created_at):
+        return (
+            id,
+            self.states[row["state_id"]],
+            row["nombre"],
+            row["serial_number"],
+            row["password_hash"],
+            created_at,
+            1,
+        )
+
+
+class RelationImporter(BulkImporter):
+    """Imports relations; each end may be given by ``device_idN`` or by the
+    device's ``device_serialN``.
+    """
+
+    schema = DeviceRelationCreate
+    model = DeviceRelation
+    columns = (
+        "id",
+        "device_id1",
+        "device_id2",
+        "relation_type",
+        "created_at",
+        "version",
+    )
+    ends = ("device_id1", "device_id2")
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.validator = _row_validator(self.schema, resolved=self.ends)
+        # (campo, columna alternativa con el número de serie, valor resuelto)
+        self.references = [
+            (end, f"device_serial{n}", f"_{end}")
+            for n, end in enumerate(self.ends, start=1)
+        ]
+        # Referencias a dispositivos existentes, recordadas entre lotes:
+        # número de serie o ID del archivo -> ID almacenado
+        self.by_serial: dict[str, str | bytes] = {}
+        self.by_id: dict[str, str | bytes] = {}
+        # IDs almacenados de todos los dispositivos, si caben en memoria
+        self.device_ids: set[str | bytes] | None = None
+
+    def resolve(self, batch):
+        serials = {
+            row[serial]
+            for _, row in batch
+            for end, serial, _ in self.references
+            if not row.get(end) and row.get(serial)
+        }
+        self._lookup("serial_number", serials - self.by_serial.keys())
+        resolved = []
+        for line, row in batch:
+            for end, serial, stored in self.references:
+                if row.get(end):
+                    continue
+                value = row.get(serial)
+                if value not in self.by_serial:
+                    field = serial if value else end
+                    self.reject(line, f"{field}: dispositivo no encontrado", row)
+                    break
+                row[stored] = self.by_serial[value]
+            else:
+                resolved.append((line, row))
+        return resolved
+
+    def prepare(self, valid):
+        ids = {row[end] for _, row in valid for end in self.ends if end in row}
+        self._lookup("id", ids - self.by_id.keys())
+        accepted = []
+        for line, row in valid:
+            for end, _, stored in self.references:
+                if end not in row:
+                    continue
+                if row[end] not in self.by_id:
+                    self.reject(line, f"{end}: dispositivo no encontrado", row)
+                    break
+                row[stored] = self.by_id[row[end]]
+            else:
+                accepted.append((line, row))
+        return accepted
+
+    def to_record(self, id, row, created_at):
+        return (
+            id,
+            row["_device_id1"],
+            row["_device_id2"],
+            row["relation_type"],
+            created_at,
+            1,
+        )
+
+    def _preload(self):
+        # Una lectura secuencial por archivo en lugar de búsquedas por lote
+        self.device_ids = set()
+        for target in self.device_engines:
+            with target.connect() as conn:
+                raw: sqlite3.Connection = conn.connection.driver_connection
+                (count,) = raw.execute("SELECT COUNT(*) FROM device").fetchone()
+                if len(self.by_serial) + count > LOOKUP_CACHE_SIZE:
+                    self.by_serial.clear()
+                    self.device_ids = set()
+                    return
+                for serial, stored in raw.execute(
+                    "SELECT serial_number, id FROM device"
+                ):
+                    self.by_serial[serial] = stored
+                    self.device_ids.add(stored)
+
+    def _lookup(self, column: str, keys: set[str]):
+        if self.device_ids is None:
+            self._preload()
+        if column == "id":
+            # Valor almacenado -> ID tal como aparece en el archivo
+            requested = {self._to_stored(key): key for key in keys}
+            for stored in requested.keys() & self.device_ids:
+                self.by_id[requested.pop(stored)] = stored
+        else:
+            requested = {key: key for key in keys}
+        if not requested:
+            return
+        cache = self.by_id if column == "id" else self.by_serial
+        if len(cache) + len(requested) > LOOKUP_CACHE_SIZE:
+            cache.clear()
+        # Sin precarga o creados después: consultar cada archivo de dispositivos
+        values = list(requested)
+        for target in self.device_engines:
+            with target.connect() as conn:
+                raw: sqlite3.Connection = conn.connection.driver_connection
+                for start in range(0, len(values), LOOKUP_CHUNK_SIZE):
+                    chunk = values[start : start + LOOKUP_CHUNK_SIZE]
+                    for value, stored in raw.execute(
+                        f"SELECT {column}, id FROM device "
+                        f"WHERE {column} IN ({', '.join('?' * len(chunk))})",
+                        chunk,
+                    ):
+                        cache[requested[value]] = stored
+
+    @property
+    def device_engines(self) -> list[Engine]:
+        if shards.enabled and Device.__tablename__ in shards.tables:
+            return list(shards.engines.values())
+        return [engine]
+
+
+IMPORTERS: dict[str, type[BulkImporter]] = {
+    "devices": DeviceImporter,
+    "relations": RelationImporter,
+}
+
+
+def open_source(path: str) -> tuple[IO[bytes], IO[str]]:
+    """Opens `path` for reading rows; the binary handle reports progress."""
+    raw = open(path, "rb")
+    return raw, io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+
+
+def rebuild_indexes(target: Engine, table: Table) -> Callable[[], None]:
+    """Drops the non-unique indexes of `table` for a large load.
+
+    Returns:
+        A function that creates them again (one pass over the loaded rows
+        instead of one index update per inserted row).
+    """
+    indexes = [index for index in table.indexes if not index.unique]
+    with target.begin() as conn:
+        for index in indexes:
+            conn.exec_driver_sql(f'DROP INDEX IF EXISTS "{index.name}"')
+
+    def restore():
+        for index in indexes:
+            index.create(target, checkfirst=True)
+
+    return restore
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m src.entities.imports.importer",
+        description="Importa dispositivos o relaciones desde CSV o NDJSON.",
+    )
+    parser.add_argument("entity", choices=sorted(IMPORTERS))
+    parser.add_argument("file")
+    parser.add_argument(
+        "--format", choices=FORMATS, help="por defecto, según la extensión"
+    )
+    parser.add_argument(
+        "--plain-secrets",
+        action="store_true",
+        help="acepta secretos en claro (se guardan como hash scrypt)",
+    )
+    parser.add_argument(
+        "--rebuild-indexes",
+        action="store_true",
+        help="elimina los índices no únicos durante la carga y los recrea al final",
+    )
+    parser.add_argument("--rejected", help="por defecto, FILE.rejected.ndjson")
+    args = parser.parse_args(argv)
+
+    from src.registry import import_models, seeders
+    from src.config.base import create_db_and_tables
+
+    import_models()
+    create_db_and_tables(seeders())
+    # Registra las tablas seguidas por el feed de cambios
+    import src.entities.device.routes  # noqa: F401
+
+    format = args.format or os.path.splitext(args.file)[1].lstrip(".").lower()
+    if format not in FORMATS:
+        parser.error("no se pudo deducir el formato: use --format")
+    options = {"plain_secrets": args.plain_secrets} if args.entity == "devices" else {}
+    importer = IMPORTERS[args.entity](**options)
+
+    restores = []
+    if args.rebuild_indexes:
+        restores = [rebuild_indexes(t, importer.table) for t in importer.engines]
+    started = time.perf_counter()
+    size = os.path.getsize(args.file)
+    raw, lines = open_source(args.file)
+
+    def progress():
+        print(
+            f"\r{raw.tell() * 100 // max(size, 1):3d}%  "
+            f"{importer.inserted} importados, {importer.rejected} rechazados",
+            end="",
+            file=sys.stderr,
+            flush=True,
+        )
+
+    try:
+        with (
+            raw,
+            open(
+                args.rejected or f"{args.file}.rejected.ndjson", "w", encoding="utf-8"
+            ) as rejected,
+        ):
+            importer.run(read_rows(lines, format), rejected, progress)
+    finally:
+        for restore in restores:
+            restore()
+    elapsed = time.perf_counter() - started
+    print(
+        f"\n{importer.inserted} importados, {importer.rejected} rechazados "
+        f"en {elapsed:.1f} s ({importer.inserted / max(elapsed, 1e-9):,.0f} filas/s)",
+        file=sys.stderr,
+    )
+    return 0 if not importer.rejected else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""Bulk import jobs over uploaded files, run by `src.services.jobs`."""
+
+import os
+import time
+from uuid import UUID
+
+from src.services.jobs import JOBS_DIR, JobContext
+from .importer import FORMATS, BulkImporter, DeviceImporter, RelationImporter
+from .importer import open_source, read_rows
+
+# Archivos subidos a /import en espera de su trabajo
+IMPORT_UPLOADS_DIR = os.path.join(JOBS_DIR, "uploads")
+# Segundos que se conserva la subida de un trabajo que no terminó bien
+IMPORT_UPLOAD_TTL = float(os.environ.get("IMPORT_UPLOAD_TTL", 86400))
+
+
+def upload_path(upload: str) -> str:
+    # Solo IDs generados por el servidor: nunca una ruta del cliente
+    return os.path.join(IMPORT_UPLOADS_DIR, str(UUID(upload)))
+
+
+def purge_uploads(max_age: float = IMPORT_UPLOAD_TTL) -> int:
+    """Deletes uploads older than `max_age` seconds, left by failed jobs.
+
+    Returns:
+        The number of files deleted.
+    """
+    cutoff = time.time() - max_age
+    deleted = 0
+    try:
+        entries = list(os.scandir(IMPORT_UPLOADS_DIR))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                deleted += 1
+        except FileNotFoundError:
+            continue
+    return deleted
+
+
+def import_devices(job: JobContext) -> str:
+    """Loads the uploaded devices; see `DeviceImporter`."""
+    plain_secrets = bool(job.params.get("plain_secrets", False))
+    return _run(job, DeviceImporter(plain_secrets=plain_secrets))
+
+
+def import_relations(job: JobContext) -> str:
+    """Loads the uploaded relations; see `RelationImporter`."""
+    return _run(job, RelationImporter())
+
+
+def _run(job: JobContext, importer: BulkImporter) -> str:
+    # Registra las tablas seguidas por el feed de cambios
+    import src.entities.device.routes  # noqa: F401
+
+    format = job.params.get("format", "csv")
+    if format not in FORMATS:
+        raise ValueError(f"Formato desconocido: {format}")
+    path = upload_path(job.params["upload"])
+    purge_uploads()
+    size = os.path.getsize(path)
+    raw, lines = open_source(path)
+    with raw, job.result(".rejected.ndjson") as rejected:
+        importer.run(
+            read_rows(lines, format),
+            rejected,
+            lambda: job.report(
+                raw.tell(),
+                size,
+                f"{importer.inserted} importados, {importer.rejected} rechazados",
+            ),
+        )
+    # Solo tras el éxito: si el trabajo falla o se reencola el archivo sigue
+    # disponible, hasta que `purge_uploads` lo elimine
+    os.remove(path)
+    return f"{importer.inserted} importados, {importer.rejected} rechazados"
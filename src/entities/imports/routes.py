@@ -0,0 +1,70 @@
+import os
+from uuid import uuid4
+
+from fastapi import APIRouter, Request
+from fastapi.concurrency import run_in_threadpool
+
+from src.config.base import SessionDep, client_key
+from src.config.exception_handler import CustomException
+from src.entities.job.routes import KIND_GUARDS
+from src.entities.job.schemes import JobPublic
+from src.services.jobs import job_engine
+from .jobs import IMPORT_UPLOADS_DIR, upload_path
+
+import_router = APIRouter(prefix="/import", tags=["import"])
+
+# Tipo de contenido del cuerpo -> formato del archivo
+CONTENT_TYPES = {"text/csv": "csv", "application/x-ndjson": "ndjson"}
+# Tamaño máximo de un archivo subido (bytes)
+IMPORT_MAX_BYTES = int(os.environ.get("IMPORT_MAX_BYTES", 2 * 1024**3))
+
+
+async def _submit(request: Request, session, kind: str, **params):
+    """Streams the request body to disk and queues the import job.
+
+    The body is never held in memory: it is written chunk by chunk and the
+    job process reads it back incrementally.
+    """
+    await KIND_GUARDS[kind](request)
+    media_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if media_type not in CONTENT_TYPES:
+        raise CustomException(
+            status_code=415,
+            message=f"Tipos de contenido admitidos: {', '.join(CONTENT_TYPES)}",
+        )
+    too_large = CustomException(
+        status_code=413, message=f"El archivo supera {IMPORT_MAX_BYTES} bytes"
+    )
+    if int(request.headers.get("content-length") or 0) > IMPORT_MAX_BYTES:
+        raise too_large
+
+    upload = str(uuid4())
+    path = upload_path(upload)
+    os.makedirs(IMPORT_UPLOADS_DIR, exist_ok=True)
+    size = 0
+    try:
+        with open(path, "wb") as file:
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > IMPORT_MAX_BYTES:
+                    raise too_large
+                await run_in_threadpool(file.write, chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    params = {"upload": upload, "format": CONTENT_TYPES[media_type], **params}
+    return await run_in_threadpool(
+        job_engine.submit, session, kind, params, client_key(request)
+    )
+
+
+@import_router.post("/devices", response_model=JobPublic, status_code=202)
+async def import_devices(
+    request: Request, session: SessionDep, plain_secrets: bool = False
+):
+    return await _submit(request, session, "device_import", plain_secrets=plain_secrets)
+
+
+@import_router.post("/relations", response_model=JobPublic, status_code=202)
+async def import_relations(request: Request, session: SessionDep):
+    return await _submit(request, session, "relation_import")
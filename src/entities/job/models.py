@@ -0,0 +1,29 @@
+from datetime import datetime
+
+from sqlalchemy import JSON
+from sqlmodel import SQLModel, Field
+from src.config.base.utils import IdType, get_uuid
+
+
+# Trabajos en segundo plano (exportaciones, reconstrucciones, rellenos)
+class Job(SQLModel, table=True):
+    id: str = Field(default_factory=get_uuid, primary_key=True, sa_type=IdType)
+    kind: str = Field(max_length=50)
+    params: dict = Field(default_factory=dict, sa_type=JSON)
+    # queued, running, succeeded, failed, cancelled
+    status: str = Field(default="queued", max_length=10, index=True)
+    progress: float = 0.0
+    message: str | None = None
+    error: str | None = None
+    result_file: str | None = None
+    result_size: int | None = None
+    cancel_requested: bool = False
+    attempts: int = 0
+    # Cliente que lo creó y proceso que lo ejecuta
+    owner: str | None = None
+    worker: str | None = None
+    created_at: datetime = Field(default_factory=datetime.now)
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    # Última señal de vida del proceso que lo ejecuta (epoch)
+    heartbeat_at: float | None = None
@@ -0,0 +1,74 @@
+import os
+
+from fastapi import APIRouter, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+
+from src.config.base import ReadSessionDep, SessionDep, client_key
+from src.config.exception_handler import (
+    CustomException,
+    bad_request_exception,
+    not_found_exception,
+)
+from src.services.jobs import FINISHED, JOB_KINDS, job_engine
+from src.services.permissions import require_permission
+from .models import Job
+from .schemes import JobCreate, JobPublic
+
+jobs_router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+# Cada tipo de trabajo exige el permiso de los datos que lee o modifica
+KIND_GUARDS = {kind: require_permission(perm) for kind, (_, perm) in JOB_KINDS.items()}
+# Los trabajos de otros clientes (estado, cancelación, resultado) son privados
+OTHER_CLIENTS_GUARD = require_permission("admin:jobs")
+
+
+async def _load(request: Request, session, id: str) -> Job:
+    job = await run_in_threadpool(session.get, Job, id)
+    if job is None:
+        raise not_found_exception("Trabajo", id)
+    await KIND_GUARDS[job.kind](request)
+    if job.owner != client_key(request):
+        await OTHER_CLIENTS_GUARD(request)
+    return job
+
+
+@jobs_router.post("/", response_model=JobPublic, status_code=202)
+async def create_job(request: Request, body: JobCreate, session: SessionDep):
+    if body.kind not in JOB_KINDS:
+        raise bad_request_exception(
+            f"Tipo de trabajo desconocido: {body.kind}",
+            details={"kinds": sorted(JOB_KINDS)},
+        )
+    await KIND_GUARDS[body.kind](request)
+    return await run_in_threadpool(
+        job_engine.submit, session, body.kind, body.params, client_key(request)
+    )
+
+
+@jobs_router.get("/{id}", response_model=JobPublic)
+async def get_job(request: Request, id: str, session: ReadSessionDep):
+    return await _load(request, session, id)
+
+
+@jobs_router.delete("/{id}", response_model=JobPublic)
+async def cancel_job(request: Request, id: str, session: SessionDep):
+    job = await _load(request, session, id)
+    if job.status in FINISHED:
+        return job
+    return await run_in_threadpool(job_engine.cancel, session, job)
+
+
+@jobs_router.get("/{id}/result", response_class=FileResponse)
+async def download_job_result(request: Request, id: str, session: ReadSessionDep):
+    job = await _load(request, session, id)
+    if job.status != "succeeded" or not job.result_file:
+        raise CustomException(status_code=409, message="El trabajo no tiene resultado")
+    if not os.path.exists(job.result_file):
+        raise not_found_exception("Resultado del trabajo", id)
+    # FileResponse envía el archivo por bloques sin cargarlo en memoria
+    return FileResponse(
+        job.result_file,
+        filename=os.path.basename(job.result_file),
+        media_type="application/x-ndjson",
+    )
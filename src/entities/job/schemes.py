@@ -0,0 +1,24 @@
+from datetime import datetime
+from typing import Any
+
+from sqlmodel import SQLModel
+
+
+class JobCreate(SQLModel):
+    kind: str
+    params: dict[str, Any] = {}
+
+
+class JobPublic(SQLModel):
+    id: str
+    kind: str
+    params: dict[str, Any]
+    status: str
+    progress: float
+    message: str | None
+    error: str | None
+    result_size: int | None
+    attempts: int
+    created_at: datetime
+    started_at: datetime | None
+    finished_at: datetime | None
@@ -0,0 +1,65 @@
+from typing import Annotated, Literal
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.concurrency import run_in_threadpool
+
+from src.config.exception_handler import CustomException, not_found_exception
+from src.services.permissions import require_permission
+from src.services.profiling import memory_profiler, session_objects
+
+
+def _require_enabled():
+    if not memory_profiler.enabled:
+        raise CustomException(
+            status_code=404, message="Perfilado desactivado (PROFILING=1 lo activa)"
+        )
+
+
+# Diagnóstico de memoria del proceso (respuestas sin cifrar, ver security.py)
+profiling_router = APIRouter(
+    prefix="/debug/memory",
+    tags=["debug"],
+    dependencies=[
+        Depends(require_permission("admin:profiling")),
+        Depends(_require_enabled),
+    ],
+)
+
+
+@profiling_router.get("/")
+async def memory_overview():
+    return {
+        **memory_profiler.stats(),
+        # Recorre los objetos del recolector: fuera del bucle de eventos
+        "orm": await run_in_threadpool(session_objects),
+        "routes": memory_profiler.route_stats(),
+    }
+
+
+@profiling_router.post("/snapshots")
+async def take_memory_snapshot():
+    return memory_profiler.take_snapshot()
+
+
+@profiling_router.get("/snapshots")
+async def list_memory_snapshots():
+    return memory_profiler.list_snapshots()
+
+
+@profiling_router.get("/snapshots/{id}")
+async def get_memory_snapshot(
+    id: int,
+    compare_to: int | None = None,
+    group_by: Literal["lineno", "filename", "traceback"] = "lineno",
+    limit: Annotated[int | None, Query(ge=1, le=500)] = None,
+):
+    try:
+        return memory_profiler.top_sites(id, compare_to, group_by, limit)
+    except KeyError as e:
+        raise not_found_exception("Instantánea", e.args[0])
+
+
+@profiling_router.delete("/snapshots")
+async def clear_memory_snapshots():
+    memory_profiler.clear_snapshots()
+    return memory_profiler.stats()
@@ -1,12 +1,13 @@
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field, Relationship
-from datetime import datetime
+from datetime import date, datetime
 from typing import Optional
-from src.config.base.utils import get_uuid
+from src.config.base.utils import IdType, get_uuid
 
 
 # Tabla de estados
 class State(SQLModel, table=True):
-    id: str = Field(default_factory=get_uuid, primary_key=True)
+    id: str = Field(default_factory=get_uuid, primary_key=True, sa_type=IdType)
     nombre: str = Field(max_length=50, unique=True, index=True)
     descripcion: str | None = None
     created_at: datetime = Field(default_factory=datetime.now)
@@ -18,12 +19,17 @@ class State(SQLModel, table=True):
 
 
 class StateHistory(SQLModel, table=True):
-    id: str = Field(default_factory=get_uuid, primary_key=True)
+    # Historial de una entidad por fecha (retención y duraciones)
+    __table_args__ = (
+        Index("ix_statehistory_entity", "entity_type", "entity_id", "changed_at"),
+    )
+
+    id: str = Field(default_factory=get_uuid, primary_key=True, sa_type=IdType)
     entity_type: str = Field(max_length=50)  # Ej: "User", "Device", "Organization"
-    entity_id: str  # ID de la entidad correspondiente
-    previous_state_id: str | None = Field(foreign_key="state.id")
-    state_id: str = Field(foreign_key="state.id")
-    changed_at: datetime = Field(default_factory=datetime.now)
+    entity_id: str = Field(sa_type=IdType)  # ID de la entidad correspondiente
+    previous_state_id: str | None = Field(foreign_key="state.id", sa_type=IdType)
+    state_id: str = Field(foreign_key="state.id", sa_type=IdType)
+    changed_at: datetime = Field(default_factory=datetime.now, index=True)
 
     # Relaciones
     previous_state: Optional[State] = Relationship(
@@ -32,3 +38,13 @@ class StateHistory(SQLModel, table=True):
     current_state: State = Relationship(
         sa_relationship_kwargs={"foreign_keys": "[StateHistory.state_id]"}
     )
+
+
+# Segundos pasados en cada estado por entidad y día, acumulados al archivar el
+# historial (src.services.retention)
+class StateDurationDaily(SQLModel, table=True):
+    entity_type: str = Field(max_length=50, primary_key=True)
+    entity_id: str = Field(sa_type=IdType, primary_key=True)
+    day: date = Field(primary_key=True)
+    state_id: str = Field(foreign_key="state.id", sa_type=IdType, primary_key=True)
+    seconds: float = 0.0
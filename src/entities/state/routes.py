@@ -1,11 +1,19 @@
 from src.shared.base_controller import ControllerBuilder
 from src.shared.base_repository import BaseRepository
+from src.shared.entity_cache import EntityCache, default_shared_tier
 
 from .models import State
 from .schemes import StatePublic
 
-state_repository = BaseRepository[State, StatePublic, StatePublic](model=State)
+state_repository = BaseRepository[State, StatePublic, StatePublic](
+    model=State, cache=EntityCache("state", shared=default_shared_tier())
+)
 
-state_controller = ControllerBuilder(
-    repository=state_repository, path_name="state", response_schema=StatePublic
-).enable_read_only()
+state_controller = (
+    ControllerBuilder(
+        repository=state_repository, path_name="state", response_schema=StatePublic
+    )
+    .enable_read_only()
+    .enable_single_flight(window=0.5)
+    .require_permissions()
+)
@@ -0,0 +1,19 @@
+from sqlalchemy import Engine
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import Session
+
+from .models import State
+
+
+def create_default_states(engine: Engine):
+    states = [
+        State(nombre="Activo", descripcion="Usuario activo"),
+        State(nombre="Inactivo", descripcion="Usuario inactivo"),
+        State(nombre="Suspendido", descripcion="Usuario suspendido"),
+    ]
+    with Session(engine) as session:
+        session.exec(
+            insert(State).on_conflict_do_nothing(index_elements=["nombre"]),
+            params=[state.model_dump() for state in states],
+        )
+        session.commit()
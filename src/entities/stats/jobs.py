@@ -0,0 +1,12 @@
+"""Background jobs over the aggregate counters, run by `src.services.jobs`."""
+
+import src.entities.device.models  # noqa: F401  declara los contadores
+from src.config.base import engine
+from src.services.jobs import JobContext
+from src.shared.aggregates import aggregates
+
+
+def reconcile_counters(job: JobContext) -> str:
+    """Recounts every aggregate from its table and reports the drift found."""
+    drift = aggregates.reconcile(engine, progress=job.report)
+    return ", ".join(f"{name}: {wrong} corregidos" for name, wrong in drift.items())
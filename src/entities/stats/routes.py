@@ -0,0 +1,111 @@
+from datetime import date, datetime, timedelta
+
+from fastapi import APIRouter, Depends
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import Session, select
+
+from src.config.base import engine
+from src.entities.state.models import State, StateDurationDaily, StateHistory
+from src.services.permissions import require_permission
+from src.services.retention import split_by_day
+from src.shared.aggregates import aggregates
+
+stats_router = APIRouter(prefix="/stats", tags=["stats"])
+
+
+def devices_by_state() -> list[dict]:
+    counts = aggregates.counts("devices_by_state", engine)
+    with Session(engine) as db:
+        states = db.exec(select(State).order_by(State.nombre)).all()
+        return [
+            {
+                "state_id": state.id,
+                "state": state.nombre,
+                "count": counts.get(state.id, 0),
+            }
+            for state in states
+        ]
+
+
+@stats_router.get(
+    "/devices/by-state", dependencies=[Depends(require_permission("device:read"))]
+)
+async def get_devices_by_state():
+    # Lee los contadores (una fila por estado), nunca recorre la tabla device
+    return await run_in_threadpool(devices_by_state)
+
+
+@stats_router.get(
+    "/relations/by-type",
+    dependencies=[Depends(require_permission("device_relation:read"))],
+)
+async def get_relations_by_type():
+    return await run_in_threadpool(aggregates.counts, "relations_by_type", engine)
+
+
+def state_durations(device_id: str, since: date, until: date) -> list[dict]:
+    """Seconds per day and state of a device in ``[since, until)``.
+
+    Archived history comes from the daily rollups; the history still in the
+    database (including the current state, up to now) is added on the fly.
+    """
+    start = datetime.combine(since, datetime.min.time())
+    end = min(datetime.combine(until, datetime.min.time()), datetime.now())
+    totals: dict[tuple[date, str], float] = {}
+    with Session(engine) as db:
+        rollups = db.exec(
+            select(StateDurationDaily).where(
+                StateDurationDaily.entity_type == "Device",
+                StateDurationDaily.entity_id == device_id,
+                StateDurationDaily.day >= since,
+                StateDurationDaily.day < until,
+            )
+        ).all()
+        for rollup in rollups:
+            key = (rollup.day, rollup.state_id)
+            totals[key] = totals.get(key, 0.0) + rollup.seconds
+        of_device = (
+            StateHistory.entity_type == "Device",
+            StateHistory.entity_id == device_id,
+        )
+        # La entrada vigente al inicio del rango y las posteriores
+        previous = db.exec(
+            select(StateHistory)
+            .where(*of_device, StateHistory.changed_at < start)
+            .order_by(StateHistory.changed_at.desc())
+            .limit(1)
+        ).all()
+        entries = [
+            *previous,
+            *db.exec(
+                select(StateHistory)
+                .where(
+                    *of_device,
+                    StateHistory.changed_at >= start,
+                    StateHistory.changed_at < end,
+                )
+                .order_by(StateHistory.changed_at)
+            ).all(),
+        ]
+    for entry, following in zip(entries, [*entries[1:], None]):
+        finish = following.changed_at if following is not None else end
+        for day, seconds in split_by_day(max(entry.changed_at, start), finish):
+            key = (day, entry.state_id)
+            totals[key] = totals.get(key, 0.0) + seconds
+    return [
+        {"day": day, "state_id": state_id, "seconds": round(seconds, 3)}
+        for (day, state_id), seconds in sorted(totals.items())
+    ]
+
+
+@stats_router.get(
+    "/devices/{id}/state-durations",
+    dependencies=[Depends(require_permission("device:read"))],
+)
+async def get_state_durations(
+    id: str, since: date | None = None, until: date | None = None
+):
+    # Por defecto, los últimos 30 días (hoy incluido)
+    until = until or date.today() + timedelta(days=1)
+    since = since or until - timedelta(days=30)
+    return await run_in_threadpool(state_durations, id, since, until)
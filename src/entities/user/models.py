@@ -1,16 +1,16 @@
 from sqlmodel import SQLModel, Field, Relationship
-from src.config.base.utils import get_uuid
+from src.config.base.utils import IdType, get_uuid
 
 
 # Tabla de enlace para relación muchos-a-muchos entre User y UserRole
 class UserRoleUserLink(SQLModel, table=True):
-    user_id: str = Field(foreign_key="user.id", primary_key=True)
-    role_id: str = Field(foreign_key="userrole.id", primary_key=True)
+    user_id: str = Field(foreign_key="user.id", primary_key=True, sa_type=IdType)
+    role_id: str = Field(foreign_key="userrole.id", primary_key=True, sa_type=IdType)
 
 
 # Modelo UserRole (Roles únicos)
 class UserRole(SQLModel, table=True):
-    id: str = Field(default_factory=get_uuid, primary_key=True)
+    id: str = Field(default_factory=get_uuid, primary_key=True, sa_type=IdType)
     name: str = Field(unique=True, index=True)
     # Relación inversa: usuarios que tienen este rol
     users: list["User"] = Relationship(
@@ -22,10 +22,10 @@ class UserRole(SQLModel, table=True):
 
 # Modelo UserIdentity (Credenciales únicas por usuario)
 class UserIdentity(SQLModel, table=True):
-    id: str = Field(default_factory=get_uuid, primary_key=True)
+    id: str = Field(default_factory=get_uuid, primary_key=True, sa_type=IdType)
     username: str = Field(unique=True, index=True)
-    password: str = Field(index=True)
-    user_id: str = Field(foreign_key="user.id")
+    password: str  # Hash scrypt de la contraseña
+    user_id: str = Field(foreign_key="user.id", sa_type=IdType)
     # Relación inversa con User
     user: "User" = Relationship(
         back_populates="identity",
@@ -35,7 +35,7 @@ class UserIdentity(SQLModel, table=True):
 
 # Modelo User (Datos principales del usuario)
 class User(SQLModel, table=True):
-    id: str = Field(default_factory=get_uuid, primary_key=True)
+    id: str = Field(default_factory=get_uuid, primary_key=True, sa_type=IdType)
     Name: str = Field(index=True)
     LastName: str = Field(index=True)
     Email: str = Field(unique=True, index=True)
@@ -1,8 +1,10 @@
+from sqlalchemy import bindparam
 from sqlmodel import Session, select
 from fastapi import HTTPException
 from typing import override
 from collections.abc import Sequence
 from src.shared.base_controller import BaseRepository
+from src.shared.statements import cached_statement
 from .models import (
     User,
     UserRole,
@@ -13,6 +15,27 @@ from .models import (
 from .schemes import UserCreate, UserUpdate, UserUpdateDict
 
 
+def select_admins_page(model: type[User]):
+    return (
+        select(model)
+        .where(model.roles.any(name="Admin"))
+        .offset(bindparam("offset"))
+        .limit(bindparam("limit"))
+    )
+
+
+def select_roles_by_ids(model: type[UserRole]):
+    return select(model).where(model.id.in_(bindparam("ids", expanding=True)))
+
+
+def select_identity_by_username(model: type[UserIdentity]):
+    return select(model).where(model.username == bindparam("username"))
+
+
+def select_links_by_user(model: type[UserRoleUserLink]):
+    return select(model).where(model.user_id == bindparam("user_id"))
+
+
 class UserRepository(BaseRepository[User, UserCreate, UserUpdate]):
     @override
     def get_all(
@@ -21,30 +44,27 @@ class UserRepository(BaseRepository[User, UserCreate, UserUpdate]):
         offset: int = 0,
         limit: int = 100,
     ) -> Sequence[User]:
-        statement = (
-            select(User).where(User.roles.any(name="Admin")).offset(offset).limit(limit)
-        )
-        users = db.exec(statement).all()
+        statement = cached_statement(select_admins_page, User)
+        users = db.exec(statement, params={"offset": offset, "limit": limit}).all()
         return users
 
     @override
     def create(self, db: Session, obj_in: UserCreate) -> User:
         # Crear una instancia de User
         user: User = User(
-            **obj_in.model_dump(exclude={"role_ids", "username", "password"})
+            **obj_in.model_dump(exclude={"RoleIds", "UserName", "Password"})
         )
         # Crear la identidad asociada
         identity: UserIdentity = UserIdentity(
-            username=obj_in.username,
-            password=obj_in.password,
+            username=obj_in.UserName,
+            password=obj_in.Password,
             user_id=user.id,
         )
         user.identity = identity
 
-        if obj_in.role_ids:
-            roles = db.exec(
-                select(UserRole).where(UserRole.id.in_(obj_in.role_ids))
-            ).all()
+        if obj_in.RoleIds:
+            statement = cached_statement(select_roles_by_ids, UserRole)
+            roles = db.exec(statement, params={"ids": obj_in.RoleIds}).all()
             user.roles = roles
 
         db.add(user)
@@ -53,7 +73,10 @@ class UserRepository(BaseRepository[User, UserCreate, UserUpdate]):
         return user
 
     @override
-    def update(self, db: Session, id: str, obj_in: UserUpdate) -> User:
+    def update(
+        self, db: Session, id: str, obj_in: UserUpdate, version: int | None = None
+    ) -> User:
+        # Los usuarios no tienen columna de versión: el controlador nunca la envía
         user: User | None = db.get(self.model, id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
@@ -63,25 +86,24 @@ class UserRepository(BaseRepository[User, UserCreate, UserUpdate]):
 
         user.sqlmodel_update(obj_data)
 
-        if "username" in obj_data or "password" in obj_data:
+        if "UserName" in obj_data or "Password" in obj_data:
             if user.identity:
-                if "username" in obj_data:
-                    user.identity.username = obj_data["username"]
-                if "password" in obj_data:
-                    user.identity.password = obj_data["password"]
+                if "UserName" in obj_data:
+                    user.identity.username = obj_data["UserName"]
+                if "Password" in obj_data:
+                    user.identity.password = obj_data["Password"]
             else:
-                if "username" in obj_data and "password" in obj_data:
+                if "UserName" in obj_data and "Password" in obj_data:
                     identity = UserIdentity(
-                        username=obj_data["username"],
-                        password=obj_data["password"],
+                        username=obj_data["UserName"],
+                        password=obj_data["Password"],
                         user_id=user.id,
                     )
                     user.identity = identity
 
-        if "role_ids" in obj_data:
-            roles = db.exec(
-                select(UserRole).where(UserRole.id.in_(obj_data["role_ids"]))
-            ).all()
+        if "RoleIds" in obj_data:
+            statement = cached_statement(select_roles_by_ids, UserRole)
+            roles = db.exec(statement, params={"ids": obj_data["RoleIds"]}).all()
             user.roles = roles
 
         db.add(user)
@@ -89,16 +111,28 @@ class UserRepository(BaseRepository[User, UserCreate, UserUpdate]):
         db.refresh(user)
         return user
 
+    def get_identity_by_username(
+        self, db: Session, username: str
+    ) -> UserIdentity | None:
+        """Fetches the credentials of a user by username."""
+        statement = cached_statement(select_identity_by_username, UserIdentity)
+        return db.exec(statement, params={"username": username}).first()
+
+    def set_password(self, db: Session, identity: UserIdentity, encoded: str) -> None:
+        """Stores a new password hash for an identity."""
+        identity.password = encoded
+        db.add(identity)
+        db.commit()
+
     @override
-    def delete(self, db: Session, id: str) -> User:
+    def delete(self, db: Session, id: str, version: int | None = None) -> User:
         user: User | None = db.get(self.model, id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
         # Eliminar las relaciones en la tabla de enlace UserRoleUserLink
-        links = db.exec(
-            select(UserRoleUserLink).where(UserRoleUserLink.user_id == id)
-        ).all()
+        statement = cached_statement(select_links_by_user, UserRoleUserLink)
+        links = db.exec(statement, params={"user_id": id}).all()
         for link in links:
             db.delete(link)
 
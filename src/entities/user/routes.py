@@ -1,5 +1,6 @@
 from src.shared.base_controller import ControllerBuilder
 from src.shared.base_repository import BaseRepository
+from src.services.credentials import credential_service
 from .repository import UserRepository
 from .models import (
     User,
@@ -12,21 +13,38 @@ from .schemes import (
     UserRolePublic,
 )
 
+
+async def hash_user_password(obj: UserCreate | UserUpdate):
+    # La contraseña se almacena como hash scrypt
+    if obj.Password:
+        obj.Password = await credential_service.hash(obj.Password)
+    return obj
+
+
 # Inicializar el repositorio
 user_repository = UserRepository(model=User)
 
-user_controller = ControllerBuilder(
-    repository=user_repository,
-    path_name="users",
-    response_schema=UserPublic,
-).enable_full_crud(create_schema=UserCreate, update_schema=UserUpdate)
+user_controller = (
+    ControllerBuilder(
+        repository=user_repository,
+        path_name="users",
+        response_schema=UserPublic,
+    )
+    .enable_full_crud(create_schema=UserCreate, update_schema=UserUpdate)
+    .with_input_hook(hash_user_password)
+    .require_permissions()
+)
 
 user_role_repository = BaseRepository[UserRole, UserRolePublic, UserRolePublic](
     model=UserRole
 )
 
-user_role_controller = ControllerBuilder(
-    repository=user_role_repository,
-    path_name="roles",
-    response_schema=UserRolePublic,
-).enable_read_only()
+user_role_controller = (
+    ControllerBuilder(
+        repository=user_role_repository,
+        path_name="roles",
+        response_schema=UserRolePublic,
+    )
+    .enable_read_only()
+    .require_permissions()
+)
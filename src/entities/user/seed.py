@@ -0,0 +1,66 @@
+import argparse
+import getpass
+import os
+import sys
+
+from sqlalchemy import Engine
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import Session, select
+
+from .models import UserRole
+
+
+def create_default_users(engine: Engine):
+    roles = [UserRole(name=name) for name in ("Admin", "User", "Master")]
+    with Session(engine) as session:
+        session.exec(
+            insert(UserRole).on_conflict_do_nothing(index_elements=["name"]),
+            params=[role.model_dump() for role in roles],
+        )
+        session.commit()
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Creates the first Admin user, needed to log in once tokens are required."""
+    from src.config.base import create_db_and_tables, engine
+    from src.registry import import_models, seeders
+    from src.services.credentials import hash_password
+    from .repository import UserRepository
+    from .models import User
+    from .schemes import UserCreate
+
+    parser = argparse.ArgumentParser(
+        prog="python -m src.entities.user.seed",
+        description="Crea un usuario con el rol Admin.",
+    )
+    parser.add_argument("username")
+    parser.add_argument("--name", default="Admin")
+    parser.add_argument("--last-name", default="")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--tel", required=True)
+    args = parser.parse_args(argv)
+
+    # La contraseña no se pasa por argumentos (quedaría en el historial)
+    password = os.environ.get("ADMIN_PASSWORD") or getpass.getpass("Contraseña: ")
+    import_models()
+    create_db_and_tables(seeders())
+    with Session(engine) as session:
+        admin = session.exec(select(UserRole).where(UserRole.name == "Admin")).one()
+        user = UserRepository(model=User).create(
+            session,
+            UserCreate(
+                Name=args.name,
+                LastName=args.last_name,
+                Email=args.email,
+                Tel=args.tel,
+                UserName=args.username,
+                Password=hash_password(password),
+                RoleIds=[admin.id],
+            ),
+        )
+        print(user.id)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
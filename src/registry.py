@@ -0,0 +1,187 @@
+"""Registry of the modules the API is assembled from.
+
+Models are always imported (the mappers reference each other and the schema
+fingerprint covers every table), while routers can be registered eagerly,
+limited to an explicit list, or loaded on the first request that hits their
+prefix.
+
+Run ``python -m src.registry`` to print the import-time profile of
+``src.app`` and fail when the project's own modules exceed the budget.
+"""
+
+import os
+import re
+import subprocess
+import sys
+import threading
+from importlib import import_module
+
+from fastapi import APIRouter, FastAPI
+from starlette.routing import BaseRoute, Match
+from starlette.types import Receive, Scope, Send
+
+from src.shared.write_behind import start_write_behind_queues
+
+# Módulos con tablas (siempre se importan antes de crear el esquema)
+MODEL_MODULES = (
+    "src.entities.state.models",
+    "src.entities.user.models",
+    "src.entities.device.models",
+    "src.shared.idempotency",
+    "src.shared.change_feed",
+    "src.shared.write_behind",
+    "src.entities.job.models",
+)
+
+# Datos iniciales que se insertan al aplicar el esquema
+SEEDERS = (
+    "src.entities.user.seed:create_default_users",
+    "src.entities.state.seed:create_default_states",
+    "src.shared.aggregates:install_aggregates",
+)
+
+# Nombre -> (objeto a registrar, prefijos de ruta que atiende)
+ROUTERS = {
+    "users": ("src.entities.user.routes:user_controller", ("/users",)),
+    "roles": ("src.entities.user.routes:user_role_controller", ("/roles",)),
+    "state": ("src.entities.state.routes:state_controller", ("/state",)),
+    "device": ("src.entities.device.routes:device_controller", ("/device",)),
+    "device_relation": (
+        "src.entities.device.routes:device_relation_controller",
+        ("/device_relation",),
+    ),
+    "auth": ("src.entities.auth.routes:auth_router", ("/auth",)),
+    "jobs": ("src.entities.job.routes:jobs_router", ("/jobs",)),
+    "stats": ("src.entities.stats.routes:stats_router", ("/stats",)),
+    "imports": ("src.entities.imports.routes:import_router", ("/import",)),
+    "archive": ("src.entities.archive.routes:archive_router", ("/archive",)),
+    "profiling": ("src.entities.profiling.routes:profiling_router", ("/debug",)),
+}
+
+# Routers a exponer (separados por comas; vacío = todos)
+ENABLED_ROUTERS = [
+    name.strip()
+    for name in os.environ.get("ENABLED_ROUTERS", "").split(",")
+    if name.strip()
+] or list(ROUTERS)
+# Importar cada router con la primera solicitud a su prefijo ("1" lo activa)
+LAZY_ROUTERS = os.environ.get("LAZY_ROUTERS", "0") == "1"
+# Presupuesto de tiempo de importación de los módulos propios (milisegundos)
+IMPORT_BUDGET_MS = float(os.environ.get("IMPORT_BUDGET_MS", 300))
+
+
+def load(target: str):
+    """Imports ``"module:attribute"`` and returns the attribute."""
+    module, _, attribute = target.partition(":")
+    return getattr(import_module(module), attribute)
+
+
+def import_models():
+    for module in MODEL_MODULES:
+        import_module(module)
+
+
+def seeders() -> list:
+    return [load(target) for target in SEEDERS]
+
+
+def register_router(app: FastAPI, name: str):
+    """Imports the router `name` and adds its routes to `app`."""
+    target, _ = ROUTERS[name]
+    router = load(target)
+    if isinstance(router, APIRouter):
+        app.include_router(router)
+    else:
+        router.register_routes(app)
+
+
+class LazyRoute(BaseRoute):
+    """Placeholder that registers a router the first time its prefix matches.
+
+    After loading, the placeholder removes itself and the request is
+    dispatched again, now reaching the real routes.
+    """
+
+    def __init__(self, app: FastAPI, name: str, prefixes: tuple[str, ...]):
+        self.app = app
+        self.name = name
+        self.prefixes = prefixes
+
+    def matches(self, scope: Scope) -> tuple[Match, Scope]:
+        if scope["type"] == "http":
+            path = scope["path"]
+            for prefix in self.prefixes:
+                if path == prefix or path.startswith(prefix + "/"):
+                    return Match.FULL, {}
+        return Match.NONE, {}
+
+    def load(self):
+        with _load_lock:
+            if self not in self.app.router.routes:
+                return
+            self.app.router.routes.remove(self)
+            register_router(self.app, self.name)
+            # El esquema OpenAPI debe incluir las rutas nuevas
+            self.app.openapi_schema = None
+        # Los routers pueden traer colas de escritura diferida nuevas
+        start_write_behind_queues()
+
+    async def handle(self, scope: Scope, receive: Receive, send: Send):
+        self.load()
+        await self.app.router(scope, receive, send)
+
+
+_load_lock = threading.Lock()
+
+
+def register_routers(app: FastAPI, names: list[str] = ENABLED_ROUTERS):
+    """Registers the routers in `names`, eagerly or behind lazy placeholders."""
+    unknown = set(names) - set(ROUTERS)
+    if unknown:
+        raise ValueError(f"Unknown routers: {', '.join(sorted(unknown))}")
+    if not LAZY_ROUTERS:
+        for name in names:
+            register_router(app, name)
+        return
+
+    placeholders = [LazyRoute(app, name, ROUTERS[name][1]) for name in names]
+    app.router.routes.extend(placeholders)
+
+    # La documentación necesita todas las rutas: cargarlas antes de generarla
+    build_openapi = app.openapi
+
+    def openapi():
+        for placeholder in placeholders:
+            placeholder.load()
+        return build_openapi()
+
+    app.openapi = openapi
+
+
+def import_times(module: str = "src.app") -> dict[str, int]:
+    """Returns the self import time (µs) of every ``src`` module of `module`.
+
+    The import runs in a fresh interpreter with ``-X importtime``.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+\d+ \|\s+(.*)$", line)
+        name = match.group(2).strip() if match else ""
+        if name == "src" or name.startswith("src."):
+            times[name] = int(match.group(1))
+    return times
+
+
+if __name__ == "__main__":
+    times = import_times()
+    total_ms = sum(times.values()) / 1000
+    for name, micros in sorted(times.items(), key=lambda item: -item[1])[:15]:
+        print(f"{micros / 1000:8.1f} ms  {name}")
+    print(f"{total_ms:8.1f} ms  total (presupuesto {IMPORT_BUDGET_MS:.0f} ms)")
+    sys.exit(0 if total_ms <= IMPORT_BUDGET_MS else 1)
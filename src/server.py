@@ -0,0 +1,144 @@
+"""Production launcher: ``python -m src.server``.
+
+Runs the API under uvicorn's process supervisor with one worker per CPU,
+uvloop and httptools when installed, and workers that restart after a
+jittered number of requests. The schema is applied once in the parent
+before any worker starts, so every worker boots on the fast path. The
+parent also refreshes the read replicas and runs the job dispatcher, which
+are needed once per server rather than once per worker.
+"""
+
+import logging
+import os
+import random
+import secrets
+from importlib.util import find_spec
+
+from uvicorn import Config, Server
+from uvicorn.supervisors import Multiprocess
+
+HOST = os.environ.get("HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", 8000))
+# Procesos de trabajo (vacío = uno por CPU disponible)
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY") or os.process_cpu_count() or 1)
+# Reciclar cada proceso tras N solicitudes (0 = nunca) más un margen aleatorio
+MAX_REQUESTS = int(os.environ.get("MAX_REQUESTS", 10_000))
+MAX_REQUESTS_JITTER = int(os.environ.get("MAX_REQUESTS_JITTER", 1_000))
+# Mayor que el tiempo de inactividad de los balanceadores habituales (60 s)
+KEEP_ALIVE = int(os.environ.get("KEEP_ALIVE", 75))
+BACKLOG = int(os.environ.get("BACKLOG", 2048))
+GRACEFUL_TIMEOUT = int(os.environ.get("GRACEFUL_TIMEOUT", 30))
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class RecyclingServer(Server):
+    """Server whose request limit gets a per-worker random jitter.
+
+    Without jitter every worker would hit the limit at about the same time
+    and restart together.
+    """
+
+    def __init__(self, config: Config, jitter: int = 0):
+        super().__init__(config)
+        self.jitter = jitter
+
+    def run(self, sockets=None):
+        # Se ejecuta en cada proceso de trabajo: cada uno sortea su propio límite
+        if self.config.limit_max_requests is not None and self.jitter:
+            self.config.limit_max_requests += random.randint(0, self.jitter)
+        return super().run(sockets=sockets)
+
+
+def preload():
+    """Imports the app and applies the schema before the workers start."""
+    from src.app import app  # noqa: F401  falla aquí si la aplicación no importa
+    from src.config.base import create_db_and_tables, engine
+    from src.registry import seeders
+
+    create_db_and_tables(seeders())
+    engine.dispose()
+
+
+def build_config(workers: int = WEB_CONCURRENCY) -> Config:
+    return Config(
+        "src.app:app",
+        host=HOST,
+        port=PORT,
+        workers=workers,
+        loop="uvloop" if find_spec("uvloop") else "asyncio",
+        http="httptools" if find_spec("httptools") else "h11",
+        lifespan="on",
+        backlog=BACKLOG,
+        timeout_keep_alive=KEEP_ALIVE,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        limit_max_requests=MAX_REQUESTS or None,
+        proxy_headers=True,
+    )
+
+
+def share_secrets():
+    """Generates the secrets every worker must share when they are not set.
+
+    Each worker would otherwise draw its own token signing secret and payload
+    key, and tokens or bodies encrypted by one worker would fail on another.
+    Generated values change on every restart, so set them in production.
+    """
+    for name in ("TOKEN_SECRET", "PAYLOAD_KEY"):
+        if not os.environ.get(name):
+            logger.warning("%s no definido: se genera uno para esta ejecución", name)
+            os.environ[name] = secrets.token_hex(32)
+
+
+def split_pools(workers: int):
+    """Sizes the per-worker pools so that together they fit the machine.
+
+    Every worker starts its own credential hashing pool; its default size
+    (half the CPUs) is divided among the workers unless it is set. It also
+    tells the workers that the parent runs the replica refresh and the jobs.
+    """
+    cpus = os.cpu_count() or 2
+    os.environ.setdefault("CREDENTIAL_WORKERS", str(max(1, cpus // 2 // workers)))
+    os.environ["SUPERVISOR_TASKS"] = "1"
+
+
+def start_supervisor_tasks():
+    """Starts the replica refresh and the job dispatcher in the parent."""
+    from src.config.base import replicas
+    from src.services.jobs import job_engine
+
+    replicas.start()
+    job_engine.start()
+
+
+def stop_supervisor_tasks():
+    from src.config.base import replicas
+    from src.services.jobs import job_engine
+
+    job_engine.stop()
+    replicas.stop()
+
+
+def main():
+    config = build_config()
+    # Antes de importar la aplicación: los procesos heredan el entorno
+    share_secrets()
+    split_pools(config.workers)
+    preload()
+    logger.info(
+        "Lanzando %d procesos (loop %s, http %s)",
+        config.workers,
+        config.loop,
+        config.http,
+    )
+    # El supervisor reemplaza a los procesos que terminan, también con uno solo
+    server = RecyclingServer(config, jitter=MAX_REQUESTS_JITTER)
+    start_supervisor_tasks()
+    try:
+        Multiprocess(config, target=server.run, sockets=[config.bind_socket()]).run()
+    finally:
+        stop_supervisor_tasks()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+# Límites por clase de ruta (lecturas comparten el threadpool, SQLite tiene un escritor)
+ADMISSION_READ_LIMIT = int(os.environ.get("ADMISSION_READ_LIMIT", 32))
+ADMISSION_WRITE_LIMIT = int(os.environ.get("ADMISSION_WRITE_LIMIT", 4))
+ADMISSION_MAX_WAITING = int(os.environ.get("ADMISSION_MAX_WAITING", 64))
+# Espera máxima en cola antes de responder 503 (segundos)
+ADMISSION_MAX_WAIT = float(os.environ.get("ADMISSION_MAX_WAIT", 2.0))
+# Ajustar los límites según la latencia observada ("1" lo activa)
+ADMISSION_ADAPTIVE = os.environ.get("ADMISSION_ADAPTIVE", "0") == "1"
+
+READ_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted in time."""
+
+
+class AdmissionLimiter:
+    """Concurrency limit with a bounded FIFO wait queue.
+
+    A request waits at most `max_wait` seconds for a slot. It is rejected
+    up front when the queue is full or when the estimated wait (queue length
+    times the average service time divided by the limit) already exceeds
+    `max_wait`, so callers fail fast instead of timing out.
+
+    With `adaptive` enabled the limit follows AIMD: it shrinks by 10% when the
+    average latency rises above twice the best observed latency, and grows by
+    one while the limiter is saturated and latency stays healthy.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        limit: int,
+        max_waiting: int = ADMISSION_MAX_WAITING,
+        max_wait: float = ADMISSION_MAX_WAIT,
+        adaptive: bool = ADMISSION_ADAPTIVE,
+    ):
+        self.name = name
+        self.limit = limit
+        self.max_limit = limit
+        self.min_limit = 1
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self.adaptive = adaptive
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._latency_avg = 0.0
+        self._latency_min = float("inf")
+        self._stats = {"admitted": 0, "queued": 0, "rejected": 0, "timed_out": 0}
+
+    async def acquire(self):
+        """Waits for a slot.
+
+        Raises:
+            AdmissionRejected: If the request is shed or its wait expires.
+        """
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            self._stats["admitted"] += 1
+            return
+        if (
+            len(self._waiters) >= self.max_waiting
+            or self.expected_wait() > self.max_wait
+        ):
+            self._stats["rejected"] += 1
+            raise AdmissionRejected(self.name)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._stats["queued"] += 1
+        try:
+            await asyncio.wait_for(waiter, timeout=self.max_wait)
+        except (TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # El hueco llegó a la vez que el plazo: devolverlo
+                self.release()
+            else:
+                self._discard(waiter)
+            if isinstance(e, TimeoutError):
+                self._stats["timed_out"] += 1
+                raise AdmissionRejected(self.name)
+            raise
+        self._stats["admitted"] += 1
+
+    def release(self, latency: float | None = None):
+        """Frees a slot and hands it to the oldest waiter."""
+        self.in_flight -= 1
+        if latency is not None:
+            self._observe(latency)
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def expected_wait(self) -> float:
+        """Estimates how long a new waiter would queue, in seconds."""
+        return (len(self._waiters) + 1) * self._latency_avg / max(self.limit, 1)
+
+    def retry_after(self) -> int:
+        """Seconds suggested to rejected clients."""
+        return max(1, round(self.expected_wait()))
+
+    def stats(self) -> dict[str, int | float]:
+        return dict(
+            self._stats,
+            limit=self.limit,
+            in_flight=self.in_flight,
+            waiting=len(self._waiters),
+            latency_avg_ms=round(self._latency_avg * 1000, 3),
+        )
+
+    def _discard(self, waiter: asyncio.Future):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def _observe(self, latency: float):
+        # Media exponencial de la latencia de las solicitudes admitidas
+        self._latency_avg = (
+            latency
+            if not self._latency_avg
+            else 0.9 * self._latency_avg + 0.1 * latency
+        )
+        self._latency_min = min(self._latency_min, latency)
+        if not self.adaptive:
+            return
+        if self._latency_avg > 2 * self._latency_min:
+            self.limit = max(self.min_limit, int(self.limit * 0.9))
+            # Olvidar poco a poco el mínimo para adaptarse a cambios de carga
+            self._latency_min *= 1.05
+        elif self.in_flight + 1 >= self.limit:
+            self.limit = min(self.max_limit, self.limit + 1)
+
+
+class AdmissionController:
+    """Holds one limiter per route class: reads and writes."""
+
+    def __init__(self):
+        self.limiters = {
+            "read": AdmissionLimiter("read", ADMISSION_READ_LIMIT),
+            "write": AdmissionLimiter("write", ADMISSION_WRITE_LIMIT),
+        }
+
+    def limiter_for(self, request: Request) -> AdmissionLimiter:
+        route_class = "read" if request.method in READ_METHODS else "write"
+        return self.limiters[route_class]
+
+    def stats(self) -> dict[str, dict[str, int | float]]:
+        return {name: limiter.stats() for name, limiter in self.limiters.items()}
+
+
+admission = AdmissionController()
+
+
+# Middleware de control de admisión (limita la concurrencia hacia la base de datos)
+class AdmissionMiddleware(BaseHTTPMiddleware):
+    def __init__(self, app, controller: AdmissionController = admission):
+        super().__init__(app)
+        self.controller = controller
+
+    async def dispatch(self, request: Request, call_next):
+        # La documentación no consume la base de datos y los flujos de cambios
+        # no retienen conexiones mientras esperan
+        path = request.url.path
+        if path in ["/docs", "/openapi.json"] or path.endswith("/changes"):
+            return await call_next(request)
+
+        limiter = self.controller.limiter_for(request)
+        try:
+            await limiter.acquire()
+        except AdmissionRejected:
+            return JSONResponse(
+                status_code=503,
+                content={"message": "Servidor saturado, reintente más tarde"},
+                headers={"Retry-After": str(limiter.retry_after())},
+            )
+        started_at = time.perf_counter()
+        try:
+            return await call_next(request)
+        finally:
+            limiter.release(time.perf_counter() - started_at)
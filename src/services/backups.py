@@ -0,0 +1,410 @@
+"""Online snapshots of the SQLite store: ``python -m src.services.backups``.
+
+``backup [--full]`` takes a snapshot while the API keeps running, ``list``
+shows the snapshots and ``restore ID`` rebuilds the files as they were when
+snapshot ``ID`` was taken (run it with the API stopped). Admins can also
+queue a ``database_backup`` job with ``POST /jobs/``.
+
+Each file (primary and shards) is copied with SQLite's online backup API,
+`BACKUP_PAGES_PER_STEP` pages at a time with a pause between steps, so
+writers only wait for one step. The store runs in WAL mode (``SQLITE_WAL``),
+so each file is copied from a read transaction pinned at the start: writers
+never block and the copy is a consistent point in time. In rollback-journal
+mode (``SQLITE_WAL=0``) every write from another connection restarts the
+copy, so under sustained writes a large file may never finish; after
+`BACKUP_MAX_RESTARTS` the snapshot fails instead.
+
+Snapshots are compressed. Every `BACKUP_FULL_EVERY` snapshots one holds
+the complete files (``NAME.full.gz``, a plain gzipped SQLite file); the
+others only hold the pages that changed since the previous snapshot
+(``NAME.delta.gz``), found by comparing per-page digests.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import sys
+import threading
+from collections.abc import Callable
+from datetime import datetime
+from typing import Any
+
+from src.config.base import SQLITE_FILE_NAME, SQLITE_SHARDS, shards
+from src.config.base.replicas import BACKUP_PAGES_PER_STEP, BACKUP_SLEEP
+from src.config.base.schema import startup_lock
+from src.services.jobs import JobContext
+
+# Directorio de las instantáneas (una carpeta por instantánea)
+BACKUP_DIR = os.environ.get("BACKUP_DIR", "backups")
+# Cada cuántas instantáneas se guarda una copia completa
+BACKUP_FULL_EVERY = int(os.environ.get("BACKUP_FULL_EVERY", 7))
+# Reinicios tolerados de una copia en modo rollback (SQLITE_WAL=0), donde
+# cada escritura la reinicia
+BACKUP_MAX_RESTARTS = int(os.environ.get("BACKUP_MAX_RESTARTS", 3))
+BACKUP_COMPRESSLEVEL = int(os.environ.get("BACKUP_COMPRESSLEVEL", 6))
+# Prioridad de CPU que cede la copia (0 = la misma que el proceso)
+BACKUP_NICE = int(os.environ.get("BACKUP_NICE", 10))
+# Bytes del resumen de cada página usado para detectar cambios
+DIGEST_SIZE = 8
+MANIFEST = "manifest.json"
+
+# Cabecera de un archivo delta (tamaño de página, páginas) y número de página
+DELTA_HEADER = struct.Struct(">II")
+PAGE_NUMBER = struct.Struct(">I")
+
+# (hechos, total, mensaje)
+Progress = Callable[[int, int, str], None]
+
+
+class BackupError(Exception):
+    """Raised when a snapshot cannot be taken or restored."""
+
+
+def store_files() -> dict[str, str]:
+    """Returns the SQLite files of the store by snapshot name."""
+    files: dict[str, str] = {}
+    for path in (SQLITE_FILE_NAME, *SQLITE_SHARDS):
+        name = os.path.basename(path)
+        if name in files:
+            raise BackupError(f"Dos archivos se llaman {name}: renombre uno")
+        files[name] = path
+    return files
+
+
+def copy_online(
+    source: str, target: str, progress: Callable[[int, int], None] | None = None
+) -> bool:
+    """Copies a live SQLite file with the online backup API.
+
+    Returns:
+        Whether the source is in WAL mode (the copy is then a snapshot of
+        the moment it started).
+    """
+    if not os.path.exists(source):
+        raise BackupError(f"No existe el archivo {source}")
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        (mode,) = src.execute("PRAGMA journal_mode").fetchone()
+        wal = mode.lower() == "wal"
+        if wal:
+            # Transacción de lectura fija: la copia no se reinicia y los
+            # escritores no esperan
+            src.execute("BEGIN")
+            src.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        restarts = 0
+        last_remaining: int | None = None
+
+        def step(status: int, remaining: int, total: int):
+            nonlocal restarts, last_remaining
+            if last_remaining is not None and remaining > last_remaining:
+                restarts += 1
+                if restarts > BACKUP_MAX_RESTARTS:
+                    raise BackupError(
+                        f"{source} cambió durante la copia {restarts} veces; "
+                        "active el modo WAL para copiar bajo carga"
+                    )
+            last_remaining = remaining
+            if progress is not None:
+                progress(total - remaining, total)
+
+        src.backup(dst, pages=BACKUP_PAGES_PER_STEP, progress=step, sleep=BACKUP_SLEEP)
+        return wal
+    finally:
+        dst.close()
+        src.close()
+
+
+def _page_size(path: str) -> int:
+    with open(path, "rb") as file:
+        header = file.read(18)
+    size = int.from_bytes(header[16:18])
+    # El valor 1 representa 65536 (no cabe en dos bytes)
+    return 65536 if size == 1 else size
+
+
+def _archive(
+    path: str, archive: str, previous: bytes | None
+) -> tuple[int, int, bytes, int]:
+    """Compresses `path` whole, or only the pages whose digest changed.
+
+    Returns:
+        Page size, page count, the digests of every page and the number of
+        pages written.
+    """
+    page_size = _page_size(path)
+    digests = bytearray()
+    written = 0
+    with (
+        open(path, "rb") as source,
+        gzip.open(archive, "wb", compresslevel=BACKUP_COMPRESSLEVEL) as out,
+    ):
+        pages = os.fstat(source.fileno()).st_size // page_size
+        if previous is not None:
+            out.write(DELTA_HEADER.pack(page_size, pages))
+        for number in range(pages):
+            page = source.read(page_size)
+            digest = hashlib.blake2b(page, digest_size=DIGEST_SIZE).digest()
+            digests += digest
+            if previous is None:
+                out.write(page)
+            elif previous[number * DIGEST_SIZE : (number + 1) * DIGEST_SIZE] != digest:
+                out.write(PAGE_NUMBER.pack(number))
+                out.write(page)
+            else:
+                continue
+            written += 1
+    return page_size, pages, bytes(digests), written
+
+
+def list_snapshots() -> list[dict[str, Any]]:
+    """Returns the manifests of the complete snapshots, oldest first."""
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    manifests = []
+    for id in sorted(os.listdir(BACKUP_DIR)):
+        path = os.path.join(BACKUP_DIR, id, MANIFEST)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                manifests.append(json.load(file))
+    return manifests
+
+
+def _load(id: str) -> dict[str, Any]:
+    path = os.path.join(BACKUP_DIR, os.path.basename(id), MANIFEST)
+    if not os.path.exists(path):
+        raise BackupError(f"No existe la instantánea {id}")
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def take_snapshot(full: bool = False, progress: Progress | None = None) -> dict:
+    """Snapshots every file of the store; see the module docstring.
+
+    The copy runs in a thread with `BACKUP_NICE` lower CPU priority, so it
+    yields the CPU to request handling on the same machine.
+
+    Returns:
+        The manifest of the new snapshot.
+    """
+    outcome: dict[str, Any] = {}
+
+    def run():
+        try:
+            if BACKUP_NICE and hasattr(os, "nice"):
+                # En Linux la prioridad es por hilo: el proceso no cambia
+                os.nice(BACKUP_NICE)
+            outcome["manifest"] = _take_snapshot(full, progress)
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=run, name="backup")
+    thread.start()
+    thread.join()
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["manifest"]
+
+
+def _take_snapshot(full: bool, progress: Progress | None) -> dict:
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    with startup_lock(os.path.join(BACKUP_DIR, ".lock")):
+        snapshots = list_snapshots()
+        parent = snapshots[-1] if snapshots else None
+        incremental = (
+            not full and parent is not None and parent["depth"] + 1 < BACKUP_FULL_EVERY
+        )
+        id = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+        directory = os.path.join(BACKUP_DIR, id)
+        partial = f"{directory}.part"
+        os.makedirs(partial)
+        try:
+            files = {}
+            for name, path in store_files().items():
+                copy = os.path.join(partial, name)
+                wal = copy_online(
+                    path,
+                    copy,
+                    progress and (lambda done, total: progress(done, total, name)),
+                )
+                previous = None
+                if (
+                    incremental
+                    and name in parent["files"]
+                    and parent["files"][name]["page_size"] == _page_size(copy)
+                ):
+                    digests = os.path.join(BACKUP_DIR, parent["id"], f"{name}.pages")
+                    with open(digests, "rb") as file:
+                        previous = file.read()
+                kind = "full" if previous is None else "delta"
+                archive = f"{name}.{kind}.gz"
+                page_size, pages, digests, written = _archive(
+                    copy, os.path.join(partial, archive), previous
+                )
+                os.remove(copy)
+                with open(os.path.join(partial, f"{name}.pages"), "wb") as file:
+                    file.write(digests)
+                files[name] = {
+                    "source": path,
+                    "kind": kind,
+                    "archive": archive,
+                    "page_size": page_size,
+                    "pages": pages,
+                    "pages_written": written,
+                    "size": os.path.getsize(os.path.join(partial, archive)),
+                    "wal": wal,
+                }
+            if shards.enabled and os.path.exists(shards.map_file):
+                shutil.copy(shards.map_file, os.path.join(partial, "shards.json"))
+            manifest = {
+                "id": id,
+                "created_at": datetime.now().isoformat(),
+                "parent": parent["id"] if incremental else None,
+                "depth": parent["depth"] + 1 if incremental else 0,
+                "files": files,
+            }
+            with open(os.path.join(partial, MANIFEST), "w", encoding="utf-8") as file:
+                json.dump(manifest, file, indent=2)
+            os.replace(partial, directory)
+        except BaseException:
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+    return manifest
+
+
+def _chain(manifest: dict[str, Any], name: str) -> list[dict[str, Any]]:
+    # Instantáneas que reconstruyen `name`: la completa y los deltas, en orden
+    chain = [manifest]
+    while chain[-1]["files"][name]["kind"] == "delta":
+        chain.append(_load(chain[-1]["parent"]))
+    return chain[::-1]
+
+
+def _rebuild(name: str, chain: list[dict[str, Any]], target: str):
+    with open(target, "wb") as out:
+        base = chain[0]
+        with gzip.open(
+            os.path.join(BACKUP_DIR, base["id"], base["files"][name]["archive"])
+        ) as archive:
+            shutil.copyfileobj(archive, out)
+    with open(target, "r+b") as out:
+        for snapshot in chain[1:]:
+            path = os.path.join(
+                BACKUP_DIR, snapshot["id"], snapshot["files"][name]["archive"]
+            )
+            with gzip.open(path) as archive:
+                page_size, pages = DELTA_HEADER.unpack(archive.read(DELTA_HEADER.size))
+                while number := archive.read(PAGE_NUMBER.size):
+                    (number,) = PAGE_NUMBER.unpack(number)
+                    out.seek(number * page_size)
+                    out.write(archive.read(page_size))
+            out.truncate(pages * page_size)
+
+
+def restore(id: str, directory: str | None = None, force: bool = False) -> list[str]:
+    """Rebuilds the files of snapshot `id`.
+
+    The files are written to their original paths, or into `directory` to
+    inspect a past state without touching the store. Each file is checked
+    with ``PRAGMA quick_check`` before it replaces the current one.
+
+    Returns:
+        The paths written.
+    """
+    manifest = _load(id)
+    targets = {
+        name: os.path.join(directory, name) if directory else info["source"]
+        for name, info in manifest["files"].items()
+    }
+    if not force:
+        existing = [path for path in targets.values() if os.path.exists(path)]
+        if existing:
+            raise BackupError(f"Ya existen {', '.join(existing)}: use --force")
+    written = []
+    for name, target in targets.items():
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        partial = f"{target}.restore"
+        _rebuild(name, _chain(manifest, name), partial)
+        conn = sqlite3.connect(partial)
+        try:
+            (result,) = conn.execute("PRAGMA quick_check").fetchone()
+        finally:
+            conn.close()
+        if result != "ok":
+            os.remove(partial)
+            raise BackupError(f"{name} no superó la comprobación: {result}")
+        # Un WAL del archivo anterior se aplicaría sobre el restaurado
+        for suffix in ("-wal", "-shm", "-journal"):
+            if os.path.exists(target + suffix):
+                os.remove(target + suffix)
+        os.replace(partial, target)
+        written.append(target)
+    map_file = os.path.join(BACKUP_DIR, manifest["id"], "shards.json")
+    if os.path.exists(map_file):
+        target = (
+            os.path.join(directory, "shards.json") if directory else shards.map_file
+        )
+        shutil.copy(map_file, target)
+        written.append(target)
+    return written
+
+
+def backup_database(job: JobContext) -> str:
+    """Job taking a snapshot; ``{"full": true}`` forces a complete copy."""
+    manifest = take_snapshot(
+        full=bool(job.params.get("full", False)),
+        progress=lambda done, total, name: job.report(done, total, f"Copiando {name}"),
+    )
+    size = sum(info["size"] for info in manifest["files"].values())
+    kind = "incremental" if manifest["parent"] else "completa"
+    return f"Instantánea {manifest['id']} ({kind}, {size} bytes)"
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m src.services.backups",
+        description="Instantáneas en línea de los archivos SQLite.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    backup = commands.add_parser("backup", help="toma una instantánea")
+    backup.add_argument("--full", action="store_true", help="copia completa")
+    commands.add_parser("list", help="lista las instantáneas")
+    restore_cmd = commands.add_parser("restore", help="restaura una instantánea")
+    restore_cmd.add_argument("id")
+    restore_cmd.add_argument(
+        "--to", help="directorio de destino (por defecto, los originales)"
+    )
+    restore_cmd.add_argument(
+        "--force", action="store_true", help="reemplaza los archivos existentes"
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "backup":
+            manifest = take_snapshot(full=args.full)
+            for name, info in manifest["files"].items():
+                print(
+                    f"{manifest['id']}  {name}  {info['kind']}  "
+                    f"{info['pages_written']}/{info['pages']} páginas  {info['size']} bytes"
+                )
+        elif args.command == "list":
+            for manifest in list_snapshots():
+                size = sum(info["size"] for info in manifest["files"].values())
+                kind = "incremental" if manifest["parent"] else "completa"
+                print(f"{manifest['id']}  {kind:11}  {size} bytes")
+        else:
+            for path in restore(args.id, args.to, args.force):
+                print(path)
+    except BackupError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import gzip
+import zlib
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Protocol
+
+
+class Compressor(Protocol):
+    """Incremental compressor: feed chunks with `compress`, end with `flush`."""
+
+    def compress(self, data: bytes) -> bytes: ...
+
+    def flush(self) -> bytes: ...
+
+
+@dataclass(frozen=True)
+class Codec:
+    """A payload compression format negotiated with the client."""
+
+    name: str
+    compressor: Callable[[], Compressor]
+    decompress: Callable[[bytes], bytes]
+
+
+def _gzip_compressor() -> Compressor:
+    # wbits=31 produce el formato gzip (cabecera y CRC)
+    return zlib.compressobj(6, zlib.DEFLATED, 31)
+
+
+CODECS: dict[str, Codec] = {
+    "gzip": Codec("gzip", _gzip_compressor, gzip.decompress),
+}
+
+# Códecs opcionales: se registran solo si la dependencia está instalada
+try:
+    from compression import zstd  # Python >= 3.14
+
+    CODECS["zstd"] = Codec("zstd", zstd.ZstdCompressor, zstd.decompress)
+except ImportError:
+    try:
+        import zstandard
+
+        CODECS["zstd"] = Codec(
+            "zstd",
+            lambda: zstandard.ZstdCompressor(level=3).compressobj(),
+            lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data),
+        )
+    except ImportError:
+        pass
+
+try:
+    import brotli
+
+    class _BrotliCompressor:
+        def __init__(self):
+            self._compressor = brotli.Compressor(quality=5)
+
+        def compress(self, data: bytes) -> bytes:
+            return self._compressor.process(data)
+
+        def flush(self) -> bytes:
+            return self._compressor.finish()
+
+    CODECS["br"] = Codec("br", _BrotliCompressor, brotli.decompress)
+except ImportError:
+    pass
+
+
+def negotiate(accept: str | None) -> Codec | None:
+    """Picks the first supported codec from a comma-separated preference list.
+
+    Args:
+        accept: Value of the ``Accept-Payload-Encoding`` header.
+
+    Returns:
+        The chosen codec, or None if the client accepts none of them.
+    """
+    if not accept:
+        return None
+    for name in accept.split(","):
+        codec = CODECS.get(name.split(";")[0].strip().lower())
+        if codec is not None:
+            return codec
+    return None
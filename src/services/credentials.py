@@ -0,0 +1,193 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from src.config.exception_handler import CustomException
+
+# Parámetros de scrypt (memoria ≈ 128 * N * r bytes por hash)
+SCRYPT_N = int(os.environ.get("SCRYPT_N", 2**14))
+SCRYPT_R = int(os.environ.get("SCRYPT_R", 8))
+SCRYPT_P = int(os.environ.get("SCRYPT_P", 1))
+SCRYPT_DKLEN = 32
+SCRYPT_PREFIX = "scrypt"
+
+# Procesos dedicados al hashing y límites de concurrencia
+CREDENTIAL_WORKERS = int(
+    os.environ.get("CREDENTIAL_WORKERS", max(1, (os.cpu_count() or 2) // 2))
+)
+CREDENTIAL_MAX_WAITING = int(os.environ.get("CREDENTIAL_MAX_WAITING", 256))
+
+# Hash de referencia para igualar el tiempo de respuesta cuando no hay usuario
+DUMMY_HASH = "$".join(
+    [
+        SCRYPT_PREFIX,
+        str(SCRYPT_N),
+        str(SCRYPT_R),
+        str(SCRYPT_P),
+        base64.b64encode(bytes(16)).decode(),
+        base64.b64encode(bytes(SCRYPT_DKLEN)).decode(),
+    ]
+)
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(
+        password.encode(),
+        salt=salt,
+        n=n,
+        r=r,
+        p=p,
+        maxmem=256 * n * r * p,
+        dklen=SCRYPT_DKLEN,
+    )
+
+
+def hash_password(password: str) -> str:
+    """Hashes a password with scrypt using the current parameters.
+
+    The result has the form ``scrypt$N$r$p$salt$hash`` (base64 fields), so the
+    parameters travel with the hash and can be upgraded later.
+    """
+    salt = os.urandom(16)
+    digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return "$".join(
+        [
+            SCRYPT_PREFIX,
+            str(SCRYPT_N),
+            str(SCRYPT_R),
+            str(SCRYPT_P),
+            base64.b64encode(salt).decode(),
+            base64.b64encode(digest).decode(),
+        ]
+    )
+
+
+def verify_password(password: str, encoded: str) -> tuple[bool, bool]:
+    """Checks a password against a stored value.
+
+    Values without the scrypt prefix are legacy plaintext credentials and are
+    compared in constant time.
+
+    Returns:
+        A tuple ``(valid, needs_rehash)``; `needs_rehash` is True when the
+        stored value is plaintext or uses outdated parameters.
+    """
+    parts = encoded.split("$")
+    if len(parts) != 6 or parts[0] != SCRYPT_PREFIX:
+        return hmac.compare_digest(password.encode(), encoded.encode()), True
+    n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+    salt, expected = base64.b64decode(parts[4]), base64.b64decode(parts[5])
+    valid = hmac.compare_digest(_scrypt(password, salt, n, r, p), expected)
+    return valid, (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+class CredentialService:
+    """Runs password hashing in a dedicated process pool.
+
+    Calls are awaited from the event loop, so neither the loop nor the request
+    threadpool spends CPU on scrypt. At most `workers` hashes run at once;
+    callers beyond that wait, and once `max_waiting` callers are waiting new
+    ones are rejected with ``503``.
+    """
+
+    def __init__(
+        self,
+        workers: int = CREDENTIAL_WORKERS,
+        max_waiting: int = CREDENTIAL_MAX_WAITING,
+    ):
+        self.workers = workers
+        self.max_waiting = max_waiting
+        self._pool: ProcessPoolExecutor | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._waiting = 0
+        self._stats = {
+            "completed": 0,
+            "rejected": 0,
+            "queue_time_total": 0.0,
+            "queue_time_max": 0.0,
+            "run_time_total": 0.0,
+        }
+
+    def start(self):
+        """Starts the worker processes."""
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+    def shutdown(self):
+        """Stops the worker processes."""
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+            self._slots = None
+
+    async def hash(self, password: str) -> str:
+        """Hashes a password in the process pool."""
+        return await self._submit(hash_password, password)
+
+    async def verify(self, password: str, encoded: str) -> tuple[bool, bool]:
+        """Verifies a password in the process pool; see `verify_password`."""
+        return await self._submit(verify_password, password, encoded)
+
+    def hash_many(self, passwords: list[str]) -> list[str]:
+        """Hashes many passwords in the process pool from synchronous code.
+
+        Used by bulk loads; the hashes are spread over all the workers and
+        returned in order.
+        """
+        self.start()
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        return list(self._pool.map(hash_password, passwords, chunksize=chunksize))
+
+    def stats(self) -> dict[str, int | float]:
+        """Returns counters and average queue/run times in milliseconds."""
+        stats = dict(self._stats, waiting=self._waiting)
+        completed = stats["completed"] or 1
+        stats["queue_time_avg_ms"] = round(
+            stats.pop("queue_time_total") / completed * 1000, 3
+        )
+        stats["run_time_avg_ms"] = round(
+            stats.pop("run_time_total") / completed * 1000, 3
+        )
+        stats["queue_time_max_ms"] = round(stats.pop("queue_time_max") * 1000, 3)
+        return stats
+
+    async def _submit(self, fn, *args):
+        if self._waiting >= self.max_waiting:
+            self._stats["rejected"] += 1
+            raise CustomException(
+                status_code=503, message="Servicio de credenciales saturado"
+            )
+        self.start()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+
+        queued_at = time.perf_counter()
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        started_at = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, fn, *args)
+        finally:
+            self._slots.release()
+            queue_time = started_at - queued_at
+            self._stats["completed"] += 1
+            self._stats["queue_time_total"] += queue_time
+            self._stats["queue_time_max"] = max(
+                self._stats["queue_time_max"], queue_time
+            )
+            self._stats["run_time_total"] += time.perf_counter() - started_at
+
+
+credential_service = CredentialService()
@@ -0,0 +1,333 @@
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import traceback
+from collections.abc import Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from datetime import datetime
+from importlib import import_module
+from typing import IO, Any
+
+from sqlalchemy import or_, update
+from sqlmodel import Session, select
+
+from src.config.base import engine
+from src.entities.job.models import Job
+
+logger = logging.getLogger(__name__)
+
+# Procesos dedicados a los trabajos en cada proceso de la API
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 1))
+# Directorio de los archivos de resultados
+JOBS_DIR = os.environ.get("JOBS_DIR", "jobs")
+# Intervalo de búsqueda de trabajos en cola (segundos)
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 1.0))
+# Un trabajo sin señal de vida durante este tiempo se vuelve a encolar
+JOB_STALE_AFTER = float(os.environ.get("JOB_STALE_AFTER", 60.0))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+# Intervalo mínimo entre escrituras de progreso
+PROGRESS_INTERVAL = 0.5
+
+# Tipo de trabajo -> (función "módulo:atributo", permiso requerido)
+JOB_KINDS = {
+    "device_export": ("src.entities.device.jobs:export_devices", "device:read"),
+    "relation_rebuild": (
+        "src.entities.device.jobs:rebuild_relations",
+        "device_relation:delete",
+    ),
+    "state_history_backfill": (
+        "src.entities.device.jobs:backfill_state_history",
+        "device:write",
+    ),
+    "stats_reconcile": ("src.entities.stats.jobs:reconcile_counters", "admin:stats"),
+    "database_backup": ("src.services.backups:backup_database", "admin:backup"),
+    "data_retention": ("src.services.retention:data_retention", "admin:retention"),
+    "device_import": ("src.entities.imports.jobs:import_devices", "device:write"),
+    "relation_import": (
+        "src.entities.imports.jobs:import_relations",
+        "device_relation:write",
+    ),
+}
+
+FINISHED = ("succeeded", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when cancellation was requested."""
+
+
+class JobContext:
+    """Handle passed to job functions in the worker process.
+
+    Jobs call `report` regularly: it records progress, refreshes the
+    heartbeat that keeps the job from being re-queued, and raises
+    `JobCancelled` once cancellation was requested.
+    """
+
+    def __init__(self, job_id: str, params: dict[str, Any]):
+        self.id = job_id
+        self.params = params
+        self.result_file: str | None = None
+        self._reported_at = 0.0
+
+    def report(self, done: int, total: int, message: str | None = None):
+        now = time.time()
+        if now - self._reported_at < PROGRESS_INTERVAL:
+            return
+        self._reported_at = now
+        with Session(engine) as db:
+            db.exec(
+                update(Job)
+                .where(Job.id == self.id)
+                .values(
+                    progress=min(done / total, 1.0) if total else 0.0,
+                    message=message,
+                    heartbeat_at=now,
+                )
+            )
+            db.commit()
+            cancelled = db.exec(
+                select(Job.cancel_requested).where(Job.id == self.id)
+            ).one()
+        if cancelled:
+            raise JobCancelled()
+
+    @contextmanager
+    def result(self, suffix: str) -> Iterator[IO[str]]:
+        """Opens the result file; it replaces any previous result on success."""
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        path = os.path.join(JOBS_DIR, f"{self.id}{suffix}")
+        partial = f"{path}.part"
+        try:
+            with open(partial, "w", encoding="utf-8") as file:
+                yield file
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        self.result_file = path
+
+
+def run_job(job_id: str, kind: str, params: dict[str, Any]):
+    """Entry point in the worker process: runs a job and stores its outcome."""
+    context = JobContext(job_id, params)
+    target, _ = JOB_KINDS[kind]
+    module, _, attribute = target.partition(":")
+    values: dict[str, Any]
+    try:
+        message = getattr(import_module(module), attribute)(context)
+        values = {"status": "succeeded", "progress": 1.0, "message": message}
+        if context.result_file is not None:
+            values["result_file"] = context.result_file
+            values["result_size"] = os.path.getsize(context.result_file)
+    except JobCancelled:
+        values = {"status": "cancelled"}
+    except Exception as e:
+        logger.exception("Job %s failed", job_id)
+        values = {"status": "failed", "error": "".join(traceback.format_exception(e))}
+    with Session(engine) as db:
+        db.exec(
+            update(Job)
+            .where(Job.id == job_id)
+            .values(finished_at=datetime.now(), heartbeat_at=time.time(), **values)
+        )
+        db.commit()
+
+
+class JobEngine:
+    """Runs persisted jobs in a dedicated process pool.
+
+    Jobs are rows of the ``job`` table, so any API process can pick them up:
+    a dispatcher thread claims queued jobs with a conditional UPDATE (one
+    process wins) and submits them to the pool, never to the request
+    threadpool. The job process reports progress and writes the final
+    status itself. The dispatcher also refreshes the heartbeat of the jobs
+    its pool is still running, so a job that reports rarely is not taken
+    for dead. Jobs whose heartbeat stops (their process or API process
+    died) are queued again up to `max_attempts` times; on shutdown the
+    running jobs of this process are re-queued and their processes stopped.
+    """
+
+    def __init__(
+        self,
+        workers: int = JOB_WORKERS,
+        poll_interval: float = JOB_POLL_INTERVAL,
+        stale_after: float = JOB_STALE_AFTER,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+    ):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._pool: ProcessPoolExecutor | None = None
+        self._running: dict[str, Future] = {}
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._heartbeat_at = 0.0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._pool = self._new_pool()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="job-dispatcher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stops dispatching, re-queues running jobs and stops their processes."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+        if self._running:
+            with Session(engine) as db:
+                db.exec(
+                    update(Job)
+                    .where(Job.id.in_(list(self._running)), Job.status == "running")
+                    .values(status="queued", attempts=Job.attempts - 1)
+                )
+                db.commit()
+        # ProcessPoolExecutor no expone cómo detener tareas en curso (3.13)
+        for process in list(getattr(self._pool, "_processes", {}).values()):
+            process.terminate()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+        self._running.clear()
+
+    def submit(self, db: Session, kind: str, params: dict, owner: str | None) -> Job:
+        """Persists a new job and wakes the dispatcher."""
+        job = Job(kind=kind, params=params, owner=owner)
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        self._wakeup.set()
+        return job
+
+    def cancel(self, db: Session, job: Job) -> Job:
+        """Cancels a queued job or asks a running one to stop."""
+        if job.status == "queued":
+            db.exec(
+                update(Job)
+                .where(Job.id == job.id, Job.status == "queued")
+                .values(status="cancelled", finished_at=datetime.now())
+            )
+        db.exec(
+            update(Job)
+            .where(Job.id == job.id, Job.status.not_in(FINISHED))
+            .values(cancel_requested=True)
+        )
+        db.commit()
+        db.refresh(job)
+        return job
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._heartbeat()
+                self._requeue_stale()
+                self._dispatch()
+            except Exception:
+                logger.exception("Job dispatch failed")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    def _dispatch(self):
+        for id, future in list(self._running.items()):
+            if not future.done():
+                continue
+            del self._running[id]
+            if isinstance(future.exception(), BrokenProcessPool):
+                # Un proceso murió (p. ej. sin memoria): el trabajo se reencola
+                # al caducar su señal de vida y el pool se reemplaza
+                logger.error("Job process for %s died", id)
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = self._new_pool()
+        free = self.workers - len(self._running)
+        if free <= 0:
+            return
+        with Session(engine) as db:
+            candidates = db.exec(
+                select(Job)
+                .where(Job.status == "queued")
+                .order_by(Job.created_at)
+                .limit(free)
+            ).all()
+            for job in candidates:
+                # Solo un proceso gana la actualización condicional
+                claimed = db.exec(
+                    update(Job)
+                    .where(Job.id == job.id, Job.status == "queued")
+                    .values(
+                        status="running",
+                        worker=self.worker,
+                        attempts=Job.attempts + 1,
+                        started_at=datetime.now(),
+                        heartbeat_at=time.time(),
+                    )
+                ).rowcount
+                db.commit()
+                if claimed:
+                    future = self._pool.submit(run_job, job.id, job.kind, job.params)
+                    future.add_done_callback(lambda _: self._wakeup.set())
+                    self._running[job.id] = future
+
+    def _alive(self) -> list[str]:
+        """IDs of the jobs this process's pool is still running."""
+        return [id for id, future in self._running.items() if not future.done()]
+
+    def _heartbeat(self):
+        # Señal de vida desde el proceso de la API: los trabajos que tardan en
+        # llamar a report() (compresión, VACUUM, precargas) siguen vivos
+        now = time.time()
+        alive = self._alive()
+        if not alive or now - self._heartbeat_at < self.stale_after / 4:
+            return
+        self._heartbeat_at = now
+        with Session(engine) as db:
+            db.exec(
+                update(Job)
+                .where(Job.id.in_(alive), Job.status == "running")
+                .values(heartbeat_at=now)
+            )
+            db.commit()
+
+    def _requeue_stale(self):
+        cutoff = time.time() - self.stale_after
+        stale = (
+            Job.status == "running",
+            or_(Job.heartbeat_at.is_(None), Job.heartbeat_at < cutoff),
+            Job.id.not_in(self._alive()),
+        )
+        with Session(engine) as db:
+            db.exec(
+                update(Job)
+                .where(*stale, Job.attempts >= self.max_attempts)
+                .values(
+                    status="failed",
+                    error="Job process stopped responding",
+                    finished_at=datetime.now(),
+                )
+            )
+            db.exec(update(Job).where(*stale).values(status="queued"))
+            db.commit()
+
+
+job_engine = JobEngine()
@@ -0,0 +1,150 @@
+import logging
+import os
+import threading
+
+from fastapi import Request
+from sqlmodel import Session, select
+
+from src.config.base.utils import canonical_id
+from src.config.exception_handler import forbidden_exception, unauthorized_exception
+from src.entities.user.models import UserRole
+
+logger = logging.getLogger("uvicorn.error")
+
+# Exigir token en las rutas que declaran permisos; solo para desarrollo local
+# se desactiva explícitamente con AUTH_REQUIRED=0
+AUTH_REQUIRED = os.environ.get("AUTH_REQUIRED", "1") != "0"
+if not AUTH_REQUIRED:
+    logger.warning("AUTH_REQUIRED=0: las rutas protegidas no exigen token")
+
+# Sufijo de los permisos limitados al propio sujeto del token
+# ("device:write:own" solo permite escribir en /device/{id} con id == sub)
+OWN_SUFFIX = ":own"
+
+# Permisos por nombre de rol; "*" concede todos
+ROLE_PERMISSIONS: dict[str, set[str]] = {
+    "Admin": {"*"},
+    "Master": {
+        "device:read",
+        "device:write",
+        "device:delete",
+        "device_relation:read",
+        "device_relation:write",
+        "device_relation:delete",
+        "state:read",
+        "users:read",
+        "roles:read",
+    },
+    "User": {"device:read", "device_relation:read", "state:read", "roles:read"},
+    # Un dispositivo solo modifica su propio registro
+    "Device": {
+        "device:read",
+        "device:write:own",
+        "device_relation:read",
+        "state:read",
+    },
+}
+
+# Roles sin fila en la base de datos (id en el token -> nombre de rol)
+PSEUDO_ROLES = {"device": "Device"}
+
+ALL_PERMISSIONS = -1
+
+
+class PermissionRegistry:
+    """Assigns a stable bit to every permission name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bits: dict[str, int] = {}
+
+    def bit(self, name: str) -> int:
+        """Returns the bit mask of a permission, registering it if needed."""
+        with self._lock:
+            if name not in self._bits:
+                self._bits[name] = 1 << len(self._bits)
+            return self._bits[name]
+
+    def mask(self, names: set[str]) -> int:
+        """Returns the combined bit mask of several permissions."""
+        if "*" in names:
+            return ALL_PERMISSIONS
+        mask = 0
+        for name in names:
+            mask |= self.bit(name)
+        return mask
+
+
+class RolePermissionCache:
+    """Precomputed permission bitsets per role ID.
+
+    `load` reads the role names once and bumps `version`; afterwards resolving
+    the permissions of a token is a dictionary lookup and never touches the
+    database. Combined bitsets for a set of roles are memoized per version.
+    """
+
+    def __init__(self, registry: PermissionRegistry):
+        self.registry = registry
+        self.version = 0
+        self._by_role: dict[str, int] = {}
+        self._combined: dict[tuple[int, frozenset[str]], int] = {}
+
+    def load(self, db: Session):
+        """Recomputes the bitset of every role from `ROLE_PERMISSIONS`."""
+        by_role = {
+            role_id: self.registry.mask(ROLE_PERMISSIONS.get(name, set()))
+            for role_id, name in PSEUDO_ROLES.items()
+        }
+        for role in db.exec(select(UserRole)).all():
+            by_role[role.id] = self.registry.mask(
+                ROLE_PERMISSIONS.get(role.name, set())
+            )
+        self._by_role = by_role
+        self._combined = {}
+        self.version += 1
+
+    def resolve(self, role_ids: frozenset[str]) -> int:
+        """Returns the permission bitset granted by a set of roles.
+
+        Unknown role IDs (e.g. created after the last `load`) grant nothing.
+        """
+        key = (self.version, role_ids)
+        bits = self._combined.get(key)
+        if bits is None:
+            bits = 0
+            for role_id in role_ids:
+                bits |= self._by_role.get(role_id, 0)
+            self._combined[key] = bits
+        return bits
+
+
+permission_registry = PermissionRegistry()
+role_permissions = RolePermissionCache(permission_registry)
+
+
+def require_permission(name: str):
+    """Builds a dependency that checks a permission from the request token.
+
+    The principal is set by `TokenAuthMiddleware`, so the check is a bitwise
+    AND and does not query the database. Roles granted ``{name}:own`` pass
+    only on routes whose ``{id}`` path parameter is the token subject.
+    """
+    bit = permission_registry.bit(name)
+    own_bit = permission_registry.bit(name + OWN_SUFFIX)
+
+    async def dependency(request: Request):
+        if not AUTH_REQUIRED:
+            return
+        principal = getattr(request.state, "principal", None)
+        if principal is None:
+            raise unauthorized_exception("Se requiere un token de acceso")
+        granted = role_permissions.resolve(principal.role_ids)
+        if granted & bit == bit:
+            return
+        id = request.path_params.get("id")
+        if granted & own_bit != own_bit or id is None:
+            raise forbidden_exception(f"Falta el permiso {name}")
+        if canonical_id(id) != principal.subject:
+            raise forbidden_exception(f"El permiso {name} solo cubre el propio sujeto")
+
+    return dependency
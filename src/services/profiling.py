@@ -0,0 +1,285 @@
+import gc
+import os
+import random
+import resource
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
+from typing import Any
+
+from fastapi import Request
+from sqlmodel import Session
+from starlette.middleware.base import BaseHTTPMiddleware
+
+# Perfilado de memoria por ruta ("1" lo activa; desactivado no añade coste)
+PROFILING = os.environ.get("PROFILING", "0") == "1"
+# Fracción de solicitudes medidas con tracemalloc
+PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", 0.01))
+# Marcos de pila guardados por asignación (más marcos, más coste)
+PROFILING_FRAMES = int(os.environ.get("PROFILING_FRAMES", 10))
+# Puntos de asignación conservados por ruta y devueltos por instantánea
+PROFILING_TOP = int(os.environ.get("PROFILING_TOP", 25))
+PROFILING_MAX_SNAPSHOTS = int(os.environ.get("PROFILING_MAX_SNAPSHOTS", 8))
+
+# Asignaciones del propio perfilador y del sistema de importación
+IGNORED_FRAMES = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def rss() -> dict[str, int | None]:
+    """Current and peak resident set size of this process, in bytes."""
+    current = None
+    try:
+        with open("/proc/self/statm") as statm:
+            current = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        pass
+    # ru_maxrss está en KiB en Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {"rss_bytes": current, "max_rss_bytes": peak}
+
+
+def session_objects() -> dict[str, Any]:
+    """Counts ORM instances held by the open sessions of this process, by model.
+
+    Walks the garbage collector's objects, so it costs nothing until called.
+    """
+    sessions = 0
+    counts: Counter[str] = Counter()
+    for obj in gc.get_objects():
+        if not isinstance(obj, Session):
+            continue
+        sessions += 1
+        for instance in (*obj.identity_map.values(), *obj.new):
+            counts[type(instance).__name__] += 1
+    return {"sessions": sessions, "instances": dict(counts.most_common())}
+
+
+def _site(statistic: tracemalloc.Statistic | tracemalloc.StatisticDiff) -> str:
+    frame = statistic.traceback[0]
+    return f"{frame.filename}:{frame.lineno}"
+
+
+class MemoryProfiler:
+    """Samples the memory allocated per route and keeps heap snapshots.
+
+    A sampled request is traced with `tracemalloc` from start to finish:
+    its peak (memory allocated above the level at its start), what it left
+    allocated and the lines that allocated it are added to the statistics
+    of its route. Tracing only runs while a sampled request is in flight and
+    one request is sampled at a time; requests running concurrently on the
+    same worker are counted with it, so attribution is approximate under
+    load. All figures are per worker process.
+
+    `take_snapshot` keeps tracing on until `clear_snapshots`, so snapshots
+    can be compared to find what grows between them.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = PROFILING,
+        sample_rate: float = PROFILING_SAMPLE_RATE,
+        frames: int = PROFILING_FRAMES,
+        top: int = PROFILING_TOP,
+        max_snapshots: int = PROFILING_MAX_SNAPSHOTS,
+    ):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.frames = frames
+        self.top = top
+        self.max_snapshots = max_snapshots
+        self.routes: dict[str, dict[str, Any]] = {}
+        self.snapshots: OrderedDict[int, tuple[float, tracemalloc.Snapshot]] = (
+            OrderedDict()
+        )
+        self._next_snapshot = 1
+        # Trazado continuo pedido por las instantáneas
+        self._continuous = False
+        self._sampling = False
+
+    def should_sample(self) -> bool:
+        return not self._sampling and random.random() < self.sample_rate
+
+    def begin(self) -> int:
+        """Starts tracing a sampled request; returns the traced baseline."""
+        self._sampling = True
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        tracemalloc.reset_peak()
+        return tracemalloc.get_traced_memory()[0]
+
+    def end(self, route: str, baseline: int, request_bytes: int, response_bytes: int):
+        """Stops tracing a sampled request and adds it to its route."""
+        try:
+            current, peak = tracemalloc.get_traced_memory()
+            sites = []
+            if not self._continuous:
+                # Solo quedan trazados los bloques que la solicitud no liberó
+                snapshot = tracemalloc.take_snapshot().filter_traces(IGNORED_FRAMES)
+                sites = snapshot.statistics("lineno")[: self.top]
+                tracemalloc.stop()
+        finally:
+            self._sampling = False
+        stats = self.routes.setdefault(
+            route,
+            {
+                "samples": 0,
+                "peak_max": 0,
+                "peak_total": 0,
+                "retained_total": 0,
+                "request_bytes_max": 0,
+                "response_bytes_max": 0,
+                "sites": Counter(),
+            },
+        )
+        stats["samples"] += 1
+        stats["peak_max"] = max(stats["peak_max"], peak - baseline)
+        stats["peak_total"] += peak - baseline
+        stats["retained_total"] += current - baseline
+        stats["request_bytes_max"] = max(stats["request_bytes_max"], request_bytes)
+        stats["response_bytes_max"] = max(stats["response_bytes_max"], response_bytes)
+        for statistic in sites:
+            stats["sites"][_site(statistic)] += statistic.size
+        if len(stats["sites"]) > 4 * self.top:
+            stats["sites"] = Counter(dict(stats["sites"].most_common(self.top)))
+
+    def route_stats(self) -> dict[str, dict[str, Any]]:
+        """Per-route sampled allocation statistics, heaviest peaks first."""
+        result = {}
+        for route, stats in sorted(
+            self.routes.items(), key=lambda item: -item[1]["peak_max"]
+        ):
+            samples = stats["samples"]
+            result[route] = {
+                "samples": samples,
+                "peak_bytes_max": stats["peak_max"],
+                "peak_bytes_avg": stats["peak_total"] // samples,
+                "retained_bytes_avg": stats["retained_total"] // samples,
+                "request_bytes_max": stats["request_bytes_max"],
+                "response_bytes_max": stats["response_bytes_max"],
+                "top_sites": [
+                    {"site": site, "size": size}
+                    for site, size in stats["sites"].most_common(self.top)
+                ],
+            }
+        return result
+
+    def take_snapshot(self) -> dict[str, Any]:
+        """Takes a heap snapshot, starting continuous tracing if needed.
+
+        Only allocations made after tracing started are visible, so the first
+        snapshot is the baseline for later ones.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self._continuous = True
+        snapshot = tracemalloc.take_snapshot().filter_traces(IGNORED_FRAMES)
+        id = self._next_snapshot
+        self._next_snapshot += 1
+        self.snapshots[id] = (time.time(), snapshot)
+        while len(self.snapshots) > self.max_snapshots:
+            self.snapshots.popitem(last=False)
+        return self._describe(id)
+
+    def list_snapshots(self) -> list[dict[str, Any]]:
+        return [self._describe(id) for id in self.snapshots]
+
+    def _describe(self, id: int) -> dict[str, Any]:
+        taken_at, snapshot = self.snapshots[id]
+        traces = snapshot.traces
+        return {
+            "id": id,
+            "taken_at": taken_at,
+            "blocks": len(traces),
+            "size": sum(trace.size for trace in traces),
+        }
+
+    def top_sites(
+        self,
+        id: int,
+        compare_to: int | None = None,
+        group_by: str = "lineno",
+        limit: int | None = None,
+    ) -> list[dict[str, Any]]:
+        """Top allocation sites of a snapshot, or its differences to another.
+
+        Raises:
+            KeyError: If a snapshot does not exist (or was discarded).
+        """
+        snapshot = self.snapshots[id][1]
+        limit = limit or self.top
+        if compare_to is None:
+            statistics = snapshot.statistics(group_by)[:limit]
+        else:
+            statistics = snapshot.compare_to(self.snapshots[compare_to][1], group_by)
+            statistics = statistics[:limit]
+        sites = []
+        for statistic in statistics:
+            site = {
+                "site": _site(statistic),
+                "size": statistic.size,
+                "count": statistic.count,
+            }
+            if compare_to is not None:
+                site["size_diff"] = statistic.size_diff
+                site["count_diff"] = statistic.count_diff
+            if group_by == "traceback":
+                site["traceback"] = statistic.traceback.format()
+            sites.append(site)
+        return sites
+
+    def clear_snapshots(self):
+        """Drops the snapshots and stops continuous tracing."""
+        self.snapshots.clear()
+        self._continuous = False
+        if tracemalloc.is_tracing() and not self._sampling:
+            tracemalloc.stop()
+
+    def stats(self) -> dict[str, Any]:
+        traced, peak = (
+            tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        )
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "tracing": tracemalloc.is_tracing(),
+            "continuous": self._continuous,
+            "traced_bytes": traced,
+            "traced_peak_bytes": peak,
+            **rss(),
+            "gc_counts": gc.get_count(),
+        }
+
+
+memory_profiler = MemoryProfiler()
+
+
+# Middleware de perfilado: solo se instala con PROFILING=1
+class ProfilingMiddleware(BaseHTTPMiddleware):
+    def __init__(self, app, profiler: MemoryProfiler = memory_profiler):
+        super().__init__(app)
+        self.profiler = profiler
+
+    async def dispatch(self, request: Request, call_next):
+        # Las rutas de diagnóstico no se miden a sí mismas
+        if request.url.path.startswith("/debug/") or not self.profiler.should_sample():
+            return await call_next(request)
+        baseline = self.profiler.begin()
+        response = None
+        try:
+            response = await call_next(request)
+            return response
+        finally:
+            # Plantilla de la ruta (p. ej. /device/{id}), no la URL concreta
+            route = request.scope.get("route")
+            name = getattr(route, "path", None) or "(sin ruta)"
+            self.profiler.end(
+                f"{request.method} {name}",
+                baseline,
+                int(request.headers.get("content-length") or 0),
+                int(response.headers.get("content-length") or 0) if response else 0,
+            )
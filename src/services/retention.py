@@ -0,0 +1,354 @@
+"""Retention policies for the append-only tables: ``python -m src.services.retention``.
+
+``run`` moves expired rows to the cold archive (`src.shared.archive`) in
+batches of `RETENTION_BATCH_SIZE` and then gives the freed pages back to the
+file system, ``vacuum`` only does the latter, ``convert`` switches existing
+files to incremental auto-vacuum and ``query TABLE`` reads archived rows.
+Admins can also queue a ``data_retention`` job with ``POST /jobs/``.
+
+- ``statehistory``: entries older than `STATE_HISTORY_RETENTION_DAYS` are
+  archived, except the latest entry of each entity (its current state).
+  Before deleting them, the time spent in each state is added to
+  `StateDurationDaily` per entity and day in the same transaction, so the
+  rollups never count an entry twice.
+- ``devicerelation``: relations whose devices no longer exist are archived,
+  and with `RELATION_RETENTION_DAYS` set, also those created before it.
+  Deletions go through the session, so they reach the change feed and the
+  relation counters.
+- ``changerecord``: change feed records older than
+  `CHANGE_FEED_RETENTION_DAYS` are deleted (not archived); consumers with an
+  older cursor get ``410 Gone`` and reload the listing.
+
+Every batch is on disk in the archive before its rows are deleted. Files
+created by `create_db_and_tables` use incremental auto-vacuum; older files
+keep their pages in the free list (reused by new rows) until converted.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from collections.abc import Callable, Iterator
+from datetime import date, datetime, timedelta
+from functools import cache
+
+from sqlalchemy import Engine, delete, tuple_
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, func, select
+
+from src.config.base import SQLITE_FILE_NAME, RoutingSession, engine, shards
+from src.config.base.schema import startup_lock
+from src.config.base.utils import stored_id
+from src.entities.device.routes import device_relation_repository, device_repository
+from src.entities.state.models import StateDurationDaily, StateHistory
+from src.services.jobs import JobContext
+from src.shared.archive import ARCHIVE_DIR, cold_archive
+from src.shared.change_feed import change_feed
+
+logger = logging.getLogger(__name__)
+
+# Días de historial de estados que se conservan en la base de datos
+STATE_HISTORY_RETENTION_DAYS = int(os.environ.get("STATE_HISTORY_RETENTION_DAYS", 365))
+# Días que se conserva una relación (0 = solo se archivan las huérfanas)
+RELATION_RETENTION_DAYS = int(os.environ.get("RELATION_RETENTION_DAYS", 0))
+# Días que se conservan los registros del change feed
+CHANGE_FEED_RETENTION_DAYS = float(os.environ.get("CHANGE_FEED_RETENTION_DAYS", 7))
+# Filas archivadas y eliminadas por transacción
+RETENTION_BATCH_SIZE = int(os.environ.get("RETENTION_BATCH_SIZE", 1000))
+# Páginas liberadas por paso del vacuum incremental y pausa entre pasos
+RETENTION_VACUUM_PAGES = int(os.environ.get("RETENTION_VACUUM_PAGES", 1000))
+RETENTION_VACUUM_SLEEP = float(os.environ.get("RETENTION_VACUUM_SLEEP", 0.05))
+# Valor de PRAGMA auto_vacuum en modo incremental
+INCREMENTAL = 2
+
+# Tabla archivada -> campo de fecha que la particiona
+ARCHIVED_TABLES = {"statehistory": "changed_at", "devicerelation": "created_at"}
+
+# Clave primaria de StateDurationDaily
+ROLLUP_KEY = ("entity_type", "entity_id", "day", "state_id")
+
+# (hechos, total, mensaje)
+Progress = Callable[[int, int, str], None]
+
+
+def split_by_day(start: datetime, end: datetime) -> Iterator[tuple[date, float]]:
+    """Yields the seconds of ``[start, end)`` that fall on each calendar day."""
+    while start < end:
+        midnight = datetime.combine(
+            start.date() + timedelta(days=1), datetime.min.time()
+        )
+        step = min(midnight, end)
+        yield start.date(), (step - start).total_seconds()
+        start = step
+
+
+def store_engines() -> dict[str, Engine]:
+    """Returns the engine of every SQLite file of the store by path."""
+    return {SQLITE_FILE_NAME: engine, **shards.engines}
+
+
+def archive_state_history(
+    cutoff: datetime, progress: Callable[[int], None] | None = None
+) -> int:
+    """Archives state history entries older than `cutoff` and rolls them up.
+
+    Returns:
+        The number of entries archived.
+    """
+    entity = (StateHistory.entity_type, StateHistory.entity_id)
+    # Inicio de la entrada siguiente de la misma entidad (fin de esta): una
+    # pasada por ix_statehistory_entity, sin una subconsulta por fila
+    ended_at = func.lead(
+        StateHistory.changed_at, type_=StateHistory.changed_at.type
+    ).over(partition_by=entity, order_by=(StateHistory.changed_at, StateHistory.id))
+
+    def next_batch(after: tuple | None):
+        windowed = select(StateHistory, ended_at.label("ended_at"))
+        if after is not None:
+            # Descarta entidades completas: no cambia el fin de ninguna entrada
+            windowed = windowed.where(tuple_(*entity) >= after)
+        windowed = windowed.subquery()
+        entry = aliased(StateHistory, windowed)
+        # Sin ORDER BY externo: las filas salen en el orden de la ventana
+        # (por entidad) y LIMIT detiene el recorrido
+        return (
+            select(entry, windowed.c.ended_at)
+            .where(entry.changed_at < cutoff, windowed.c.ended_at.is_not(None))
+            .limit(RETENTION_BATCH_SIZE)
+        )
+
+    upsert = insert(StateDurationDaily.__table__)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=ROLLUP_KEY,
+        set_={"seconds": StateDurationDaily.seconds + upsert.excluded.seconds},
+    )
+    archived = 0
+    with Session(engine) as db:
+        after = None
+        while rows := db.exec(next_batch(after)).all():
+            # Cada ID se convierte una vez por lote, no una vez por día
+            stored = cache(stored_id)
+            durations: dict[tuple[str, str | bytes, date, str | bytes], float] = {}
+            for entry, end in rows:
+                entity_id, state_id = stored(entry.entity_id), stored(entry.state_id)
+                for day, seconds in split_by_day(entry.changed_at, end):
+                    key = (entry.entity_type, entity_id, day, state_id)
+                    durations[key] = durations.get(key, 0.0) + seconds
+            cold_archive.write(
+                "statehistory",
+                [entry.model_dump(mode="json") for entry, _ in rows],
+                ARCHIVED_TABLES["statehistory"],
+            )
+            db.exec(
+                upsert,
+                params=[
+                    dict(zip(ROLLUP_KEY, key), seconds=seconds)
+                    for key, seconds in durations.items()
+                ],
+            )
+            ids = [entry.id for entry, _ in rows]
+            # Las entradas ya archivadas de la última entidad se eliminan aquí
+            after = (rows[-1][0].entity_type, rows[-1][0].entity_id)
+            db.exec(delete(StateHistory).where(StateHistory.id.in_(ids)))
+            db.commit()
+            db.expunge_all()
+            archived += len(rows)
+            if progress is not None:
+                progress(len(rows))
+    return archived
+
+
+def archive_relations(
+    cutoff: datetime | None, progress: Callable[[int], None] | None = None
+) -> int:
+    """Archives orphan relations and, with a `cutoff`, those created before it.
+
+    Returns:
+        The number of relations archived.
+    """
+    archived = 0
+    with RoutingSession(engine, shards) as db:
+        for page in device_relation_repository.iter_pages(db, RETENTION_BATCH_SIZE):
+            referenced = {r.device_id1 for r in page} | {r.device_id2 for r in page}
+            found = device_repository.get_by_ids(db, list(referenced))
+            stale = [
+                relation
+                for relation in page
+                if relation.device_id1 not in found
+                or relation.device_id2 not in found
+                or (cutoff is not None and relation.created_at < cutoff)
+            ]
+            if stale:
+                cold_archive.write(
+                    "devicerelation",
+                    [relation.model_dump(mode="json") for relation in stale],
+                    ARCHIVED_TABLES["devicerelation"],
+                )
+                for relation in stale:
+                    db.delete(relation)
+                # Las filas se enrutan a su shard por su propio ID al confirmar
+                db.commit()
+                archived += len(stale)
+            db.expunge_all()
+            if progress is not None:
+                progress(len(page))
+    return archived
+
+
+def vacuum(
+    pages: int = RETENTION_VACUUM_PAGES, pause: float = RETENTION_VACUUM_SLEEP
+) -> dict[str, int]:
+    """Releases free pages of every file in steps of `pages`.
+
+    Each step is a short write transaction, so writers wait at most one step.
+    Files not in incremental auto-vacuum mode are skipped.
+
+    Returns:
+        The pages released per file.
+    """
+    released = {}
+    for path, target in store_engines().items():
+        with target.connect() as conn:
+            raw: sqlite3.Connection = conn.connection.driver_connection
+            if raw.execute("PRAGMA auto_vacuum").fetchone()[0] != INCREMENTAL:
+                logger.info("%s is not in incremental auto-vacuum mode", path)
+                continue
+            released[path] = 0
+            while free := raw.execute("PRAGMA freelist_count").fetchone()[0]:
+                raw.execute(f"PRAGMA incremental_vacuum({min(pages, free)})").fetchall()
+                remaining = raw.execute("PRAGMA freelist_count").fetchone()[0]
+                if remaining >= free:
+                    break
+                released[path] += free - remaining
+                time.sleep(pause)
+    return released
+
+
+def convert_to_incremental() -> list[str]:
+    """Switches every file to incremental auto-vacuum with a full ``VACUUM``.
+
+    The ``VACUUM`` rewrites the whole file and blocks writers meanwhile: run
+    it once, in a maintenance window.
+
+    Returns:
+        The paths converted.
+    """
+    converted = []
+    for path, target in store_engines().items():
+        with target.connect() as conn:
+            raw: sqlite3.Connection = conn.connection.driver_connection
+            if raw.execute("PRAGMA auto_vacuum").fetchone()[0] == INCREMENTAL:
+                continue
+            raw.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            raw.execute("VACUUM")
+            converted.append(path)
+    return converted
+
+
+def apply_retention(
+    run_vacuum: bool = True, progress: Progress | None = None
+) -> dict[str, int]:
+    """Applies every retention policy, then vacuums the files.
+
+    Only one process archives at a time (file lock in `ARCHIVE_DIR`).
+
+    Returns:
+        The rows archived per table and the pages released.
+    """
+    now = datetime.now()
+    history_cutoff = now - timedelta(days=STATE_HISTORY_RETENTION_DAYS)
+    relation_cutoff = (
+        now - timedelta(days=RELATION_RETENTION_DAYS)
+        if RELATION_RETENTION_DAYS > 0
+        else None
+    )
+    with Session(engine) as db:
+        total = db.exec(
+            select(func.count()).where(StateHistory.changed_at < history_cutoff)
+        ).one()
+    with RoutingSession(engine, shards) as db:
+        total += device_relation_repository.count(db)
+    done = 0
+
+    def advance(rows: int):
+        nonlocal done
+        done += rows
+        if progress is not None:
+            progress(done, total, f"{done} de {total} filas revisadas")
+
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    with startup_lock(os.path.join(ARCHIVE_DIR, ".retention.lock")):
+        summary = {
+            "statehistory": archive_state_history(history_cutoff, advance),
+            "devicerelation": archive_relations(relation_cutoff, advance),
+            "changerecord": change_feed.purge(
+                (now - timedelta(days=CHANGE_FEED_RETENTION_DAYS)).timestamp(),
+                RETENTION_BATCH_SIZE,
+            ),
+        }
+        if run_vacuum:
+            summary["pages_released"] = sum(vacuum().values())
+    return summary
+
+
+def data_retention(job: JobContext) -> str:
+    """Job applying the retention policies; ``{"vacuum": false}`` skips vacuum."""
+    summary = apply_retention(
+        run_vacuum=bool(job.params.get("vacuum", True)), progress=job.report
+    )
+    message = (
+        f"{summary['statehistory']} entradas de historial y "
+        f"{summary['devicerelation']} relaciones archivadas, "
+        f"{summary['changerecord']} cambios purgados"
+    )
+    if "pages_released" in summary:
+        message += f", {summary['pages_released']} páginas liberadas"
+    return message
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m src.services.retention",
+        description="Retención y archivo en frío del historial y las relaciones.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="archiva las filas caducadas")
+    run.add_argument("--no-vacuum", action="store_true", help="sin vacuum posterior")
+    commands.add_parser("vacuum", help="libera las páginas vacías")
+    commands.add_parser(
+        "convert", help="activa el vacuum incremental (VACUUM completo)"
+    )
+    query = commands.add_parser("query", help="lee filas archivadas como NDJSON")
+    query.add_argument("table", choices=sorted(ARCHIVED_TABLES))
+    query.add_argument("--since", type=datetime.fromisoformat)
+    query.add_argument("--until", type=datetime.fromisoformat)
+    query.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        for name, count in apply_retention(run_vacuum=not args.no_vacuum).items():
+            print(f"{name}: {count}")
+    elif args.command == "vacuum":
+        for path, pages in vacuum().items():
+            print(f"{path}: {pages} páginas liberadas")
+    elif args.command == "convert":
+        for path in convert_to_incremental():
+            print(f"{path}: vacuum incremental activado")
+    else:
+        for row in cold_archive.query(
+            args.table,
+            ARCHIVED_TABLES[args.table],
+            args.since,
+            args.until,
+            limit=args.limit,
+        ):
+            print(json.dumps(row))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
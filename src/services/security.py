@@ -1,11 +1,35 @@
 from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
 from starlette.middleware.base import BaseHTTPMiddleware
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.backends import default_backend
 import base64
 import json
 import os
 
+from .codecs import CODECS, negotiate
+
+# Respuestas más pequeñas se cifran sin comprimir
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))
+ACCEPT_ENCODING_HEADER = "accept-payload-encoding"
+ENCODING_HEADER = "payload-encoding"
+# Cargas masivas: el cuerpo (CSV/NDJSON) se transmite sin cifrar ni leer entero
+STREAMED_BODY_PREFIXES = ("/import/",)
+# Diagnóstico para operadores: respuestas en claro
+PLAIN_RESPONSE_PREFIXES = ("/debug/",)
+
+
+def aes_cbc(key: bytes, iv: bytes):
+    """Returns an AES-256-CBC cipher, importing the crypto backend on first use."""
+    # Importación diferida: cryptography no se carga hasta la primera solicitud cifrada
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+    return Cipher(algorithms.AES(key), modes.CBC(iv))
+
+
+def pkcs7_padder():
+    from cryptography.hazmat.primitives import padding
+
+    return padding.PKCS7(128).padder()
+
 
 # Middleware de Descifrado (para las solicitudes entrantes)
 class DecryptionMiddleware(BaseHTTPMiddleware):
@@ -17,6 +41,8 @@ class DecryptionMiddleware(BaseHTTPMiddleware):
         # Excluir rutas como /docs y /openapi.json (documentación de FastAPI)
         if request.url.path in ["/docs", "/openapi.json"]:
             return await call_next(request)
+        if request.url.path.startswith(STREAMED_BODY_PREFIXES):
+            return await call_next(request)
 
         # No descifrar solicitudes GET, HEAD o OPTIONS
         if request.method in ["GET", "HEAD", "OPTIONS", "DELETE"]:
@@ -33,21 +59,25 @@ class DecryptionMiddleware(BaseHTTPMiddleware):
             if not encrypted_body:
                 raise Exception("Falta el cuerpo de la solicitud")
             # Separar IV y texto cifrado (formato: "IV:cuerpo_cifrado" en base64)
-            iv_b64, encrypted_b64 = encrypted_body.decode().split(":")
+            iv_b64, encrypted_b64 = encrypted_body.split(":")
             iv = base64.b64decode(iv_b64)
             encrypted = base64.b64decode(encrypted_b64)
 
             # Descifrar con AES-256-CBC
-            cipher = Cipher(
-                algorithms.AES(self.key), modes.CBC(iv), backend=default_backend()
-            )
-            decryptor = cipher.decryptor()
+            decryptor = aes_cbc(self.key, iv).decryptor()
             padded_data = decryptor.update(encrypted) + decryptor.finalize()
 
             # Eliminar el padding PKCS7
             pad_len = padded_data[-1]
             decrypted_data = padded_data[:-pad_len]
 
+            # Descomprimir si el cliente comprimió antes de cifrar
+            encoding = request.headers.get(ENCODING_HEADER)
+            if encoding:
+                if encoding not in CODECS:
+                    raise Exception(f"Codificación no soportada: {encoding}")
+                decrypted_data = CODECS[encoding].decompress(decrypted_data)
+
             # Reemplazar el cuerpo de la solicitud con los datos descifrados
             json_data = json.loads(decrypted_data.decode())
             request._body = json.dumps(json_data).encode()
@@ -60,6 +90,14 @@ class DecryptionMiddleware(BaseHTTPMiddleware):
 
 # Middleware de Cifrado (para las respuestas salientes)
 class EncryptionMiddleware(BaseHTTPMiddleware):
+    """Compresses, then encrypts response bodies as ``{"pl": "IV:cuerpo"}``.
+
+    The codec is negotiated with the ``Accept-Payload-Encoding`` request header
+    and announced in the ``Payload-Encoding`` response header; clients decrypt
+    first and then decompress. Bodies are processed chunk by chunk, so large
+    responses are never held in memory as a whole.
+    """
+
     def __init__(self, app, key: bytes):
         super().__init__(app)
         self.key = key
@@ -69,43 +107,98 @@ class EncryptionMiddleware(BaseHTTPMiddleware):
         # Excluir el cifrado para /docs y /openapi.json
         if request.url.path in ["/docs", "/openapi.json"]:
             return response
+        if request.url.path.startswith(PLAIN_RESPONSE_PREFIXES):
+            return response
 
-        try:
-            # Leer el cuerpo de la respuesta
-            response_body = [chunk async for chunk in response.body_iterator]
-            response_body = b"".join(response_body)
-            json_response = json.loads(response_body.decode())
-
-            # Convertir a string JSON
-            json_str = json.dumps(json_response)
-
-            # Generar un IV aleatorio
-            iv = os.urandom(16)
-
-            # Cifrar con AES-256-CBC
-            cipher = Cipher(
-                algorithms.AES(self.key), modes.CBC(iv), backend=default_backend()
+        media_type = response.headers.get("content-type", "")
+        if media_type.startswith("text/event-stream"):
+            return self._keep_headers(
+                response,
+                StreamingResponse(
+                    self._encrypt_events(response.body_iterator),
+                    status_code=response.status_code,
+                    media_type="text/event-stream",
+                ),
             )
-            encryptor = cipher.encryptor()
-
-            # Agregar padding PKCS7
-            pad_len = 16 - (len(json_str) % 16)
-            padded_data = json_str.encode() + bytes([pad_len] * pad_len)
-            encrypted = encryptor.update(padded_data) + encryptor.finalize()
-
-            # Codificar IV y texto cifrado en base64
-            iv_b64 = base64.b64encode(iv).decode()
-            encrypted_b64 = base64.b64encode(encrypted).decode()
-            encrypted_response = f"{iv_b64}:{encrypted_b64}"
 
-            # Crear un JSON con la clave 'pl' y el valor cifrado
-            final_response = {"pl": encrypted_response}
+        codec = negotiate(request.headers.get(ACCEPT_ENCODING_HEADER))
+        content_length = response.headers.get("content-length")
+        if content_length is not None and int(content_length) < COMPRESSION_MIN_SIZE:
+            codec = None
 
-            # Devolver el JSON como respuesta
-            return Response(
-                content=json.dumps(final_response),
+        encrypted = self._keep_headers(
+            response,
+            StreamingResponse(
+                self._encrypt(response.body_iterator, codec),
                 status_code=response.status_code,
-                headers={"Content-Type": "application/json"},
-            )
-        except Exception as e:
-            return Response(content=f"Error al cifrar: {str(e)}", status_code=500)
+                media_type="application/json",
+            ),
+        )
+        if codec is not None:
+            encrypted.headers[ENCODING_HEADER] = codec.name
+        return encrypted
+
+    @staticmethod
+    def _keep_headers(response: Response, encrypted: StreamingResponse):
+        # Conservar las cabeceras originales salvo las del cuerpo
+        encrypted.raw_headers.extend(
+            (name, value)
+            for name, value in response.raw_headers
+            if name not in (b"content-length", b"content-type")
+        )
+        return encrypted
+
+    async def _encrypt_events(self, body_iterator):
+        # Server-sent events: cifrar el campo data de cada evento por separado
+        # para que el cliente pueda procesarlos a medida que llegan
+        pending = b""
+        async for chunk in body_iterator:
+            pending += chunk
+            *events, pending = pending.split(b"\n\n")
+            if events:
+                yield b"".join(self._encrypt_event(event) for event in events)
+
+    def _encrypt_event(self, event: bytes) -> bytes:
+        lines = []
+        for line in event.split(b"\n"):
+            if line.startswith(b"data: "):
+                iv = os.urandom(16)
+                encryptor = aes_cbc(self.key, iv).encryptor()
+                padder = pkcs7_padder()
+                encrypted = encryptor.update(
+                    padder.update(line[6:]) + padder.finalize()
+                )
+                encrypted += encryptor.finalize()
+                line = (
+                    b'data: {"pl": "'
+                    + base64.b64encode(iv)
+                    + b":"
+                    + base64.b64encode(encrypted)
+                    + b'"}'
+                )
+            lines.append(line)
+        return b"\n".join(lines) + b"\n\n"
+
+    async def _encrypt(self, body_iterator, codec):
+        # Generar un IV aleatorio y cifrar con AES-256-CBC + padding PKCS7
+        iv = os.urandom(16)
+        encryptor = aes_cbc(self.key, iv).encryptor()
+        padder = pkcs7_padder()
+        compressor = codec.compressor() if codec is not None else None
+
+        yield b'{"pl": "' + base64.b64encode(iv) + b":"
+        # Texto cifrado pendiente de codificar (base64 trabaja en bloques de 3)
+        pending = b""
+        async for chunk in body_iterator:
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            pending += encryptor.update(padder.update(chunk))
+            cut = len(pending) - len(pending) % 3
+            if cut:
+                yield base64.b64encode(pending[:cut])
+                pending = pending[cut:]
+
+        tail = compressor.flush() if compressor is not None else b""
+        pending += encryptor.update(padder.update(tail) + padder.finalize())
+        pending += encryptor.finalize()
+        yield base64.b64encode(pending) + b'"}'
@@ -0,0 +1,90 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from dataclasses import dataclass
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+# Con varios workers TOKEN_SECRET debe ser compartido (python -m src.server
+# lo genera si falta); fuera del lanzador cada proceso genera el suyo
+TOKEN_SECRET = os.environ.get("TOKEN_SECRET", "").encode() or os.urandom(32)
+TOKEN_TTL = int(os.environ.get("TOKEN_TTL", 900))
+
+
+class InvalidTokenError(Exception):
+    """Raised when a token is malformed, tampered with or expired."""
+
+
+@dataclass(frozen=True, slots=True)
+class Principal:
+    """Identity carried by a verified access token."""
+
+    subject: str
+    role_ids: frozenset[str]
+    expires_at: int
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(payload: str) -> str:
+    return _b64encode(hmac.new(TOKEN_SECRET, payload.encode(), hashlib.sha256).digest())
+
+
+def issue_token(subject: str, role_ids: list[str], ttl: int = TOKEN_TTL) -> str:
+    """Issues a signed, short-lived access token.
+
+    The token is ``payload.signature`` where the payload is base64url JSON with
+    the subject, its role IDs and the expiry, and the signature is
+    HMAC-SHA256 over the encoded payload.
+    """
+    claims = {"sub": subject, "roles": role_ids, "exp": int(time.time()) + ttl}
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+    return f"{payload}.{_sign(payload)}"
+
+
+def verify_token(token: str) -> Principal:
+    """Verifies a token signature and expiry without any database access.
+
+    Raises:
+        InvalidTokenError: If the token cannot be trusted.
+    """
+    payload, _, signature = token.partition(".")
+    if not signature or not hmac.compare_digest(signature, _sign(payload)):
+        raise InvalidTokenError("Firma inválida")
+    try:
+        claims = json.loads(_b64decode(payload))
+        principal = Principal(
+            subject=claims["sub"],
+            role_ids=frozenset(claims["roles"]),
+            expires_at=int(claims["exp"]),
+        )
+    except (ValueError, KeyError, TypeError):
+        raise InvalidTokenError("Token mal formado")
+    if principal.expires_at <= time.time():
+        raise InvalidTokenError("Token expirado")
+    return principal
+
+
+# Middleware de autenticación (verifica el token Bearer de cada solicitud)
+class TokenAuthMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        request.state.principal = None
+        authorization = request.headers.get("authorization", "")
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() == "bearer" and token:
+            try:
+                request.state.principal = verify_token(token)
+            except InvalidTokenError as e:
+                return JSONResponse(status_code=401, content={"message": str(e)})
+        return await call_next(request)
@@ -0,0 +1,206 @@
+import sqlite3
+from collections.abc import Callable
+
+from sqlalchemy import Engine, text
+from sqlmodel import Field, SQLModel
+
+from src.config.base import shards
+from src.config.base.utils import IdType
+
+
+class AggregateCounter(SQLModel, table=True):
+    # Contador por agregado y valor agrupado (p. ej. estado o tipo de relación)
+    name: str = Field(primary_key=True, max_length=50)
+    key: str = Field(primary_key=True, sa_type=IdType)
+    total: int = 0
+
+
+class CountBy:
+    """Row count of a table grouped by one column, kept by SQLite triggers."""
+
+    def __init__(self, name: str, table: str, column: str):
+        self.name = name
+        self.table = table
+        self.column = column
+
+    def triggers(self) -> list[str]:
+        """Returns the DDL of the insert, delete and update triggers."""
+        prefix = f"{self.table}_{self.name}"
+        increment = (
+            "INSERT INTO aggregatecounter (name, key, total) "
+            f"VALUES ('{self.name}', NEW.{self.column}, 1) "
+            "ON CONFLICT (name, key) DO UPDATE SET total = total + 1;"
+        )
+        decrement = (
+            "UPDATE aggregatecounter SET total = total - 1 "
+            f"WHERE name = '{self.name}' AND key = OLD.{self.column};"
+        )
+        return [
+            f"CREATE TRIGGER {prefix}_ai AFTER INSERT ON {self.table} "
+            f"BEGIN {increment} END",
+            f"CREATE TRIGGER {prefix}_ad AFTER DELETE ON {self.table} "
+            f"BEGIN {decrement} END",
+            f"CREATE TRIGGER {prefix}_au AFTER UPDATE OF {self.column} "
+            f"ON {self.table} WHEN OLD.{self.column} IS NOT NEW.{self.column} "
+            f"BEGIN {decrement} {increment} END",
+        ]
+
+    def bulk_increment(self, rows: str) -> str:
+        """Returns the statement counting the rows of ``SELECT ... {rows}``."""
+        return (
+            "INSERT INTO aggregatecounter (name, key, total) "
+            f"SELECT '{self.name}', {self.column}, COUNT(*) {rows} "
+            f"GROUP BY {self.column} "
+            "ON CONFLICT (name, key) DO UPDATE SET total = total + excluded.total"
+        )
+
+    def trigger_names(self) -> list[str]:
+        prefix = f"{self.table}_{self.name}"
+        return [f"{prefix}_ai", f"{prefix}_ad", f"{prefix}_au"]
+
+
+class Aggregates:
+    """Counters maintained in the same transaction as every write.
+
+    SQLite triggers on the counted table update ``aggregatecounter``, so ORM
+    writes, bulk updates from the write-behind queue and manual SQL are all
+    counted atomically with the change. A sharded table keeps its counters in
+    each shard file and reads sum them, so answering a summary reads one row
+    per distinct value and shard instead of scanning the table.
+    """
+
+    def __init__(self):
+        self.counters: dict[str, CountBy] = {}
+
+    def count_by(self, name: str, model: type[SQLModel], column: str):
+        """Declares a counter of `model` rows grouped by `column`."""
+        counter = CountBy(name, model.__tablename__, column)
+        self.counters[name] = counter
+        # La huella del esquema incluye los triggers: cambiarlos los reinstala
+        SQLModel.metadata.info.setdefault("ddl", []).extend(counter.triggers())
+
+    def engines_for(self, counter: CountBy, primary: Engine) -> list[Engine]:
+        if shards.enabled and counter.table in shards.tables:
+            return list(shards.engines.values())
+        return [primary]
+
+    def install(self, primary: Engine):
+        """(Re)creates the triggers and recounts every counter.
+
+        Runs with the schema setup, so it happens once per schema version.
+        """
+        for counter in self.counters.values():
+            for engine in self.engines_for(counter, primary):
+                AggregateCounter.__table__.create(engine, checkfirst=True)
+                with engine.begin() as conn:
+                    for name in counter.trigger_names():
+                        conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {name}")
+                    for statement in counter.triggers():
+                        conn.exec_driver_sql(statement)
+                    self._recount(conn, counter)
+
+    def reconcile(
+        self, primary: Engine, progress: Callable[[int, int], None] | None = None
+    ) -> dict[str, int]:
+        """Recomputes every counter from its table to correct drift.
+
+        Returns:
+            The number of counter values that were wrong, per counter.
+        """
+        drift = {}
+        for done, counter in enumerate(self.counters.values(), start=1):
+            drift[counter.name] = 0
+            for engine in self.engines_for(counter, primary):
+                # Una transacción por archivo: recuento consistente con las escrituras
+                with engine.begin() as conn:
+                    before = self._read(conn, counter)
+                    self._recount(conn, counter)
+                    after = self._read(conn, counter)
+                drift[counter.name] += sum(
+                    before.get(key, 0) != after.get(key, 0)
+                    for key in before.keys() | after.keys()
+                )
+            if progress is not None:
+                progress(done, len(self.counters))
+        return drift
+
+    def suspend_insert_triggers(
+        self, raw: sqlite3.Connection, table: str
+    ) -> list[CountBy]:
+        """Drops the insert triggers of `table` inside a write transaction.
+
+        Bulk loads call `count_inserted` before committing, so one grouped
+        statement replaces an upsert per inserted row. The transaction is
+        opened here with ``BEGIN IMMEDIATE`` if none is open: other
+        connections wait for the write lock instead of inserting while the
+        triggers are missing, and a rollback restores them.
+        """
+        counters = [c for c in self.counters.values() if c.table == table]
+        # sqlite3 no abre transacción antes de un DDL: sin BEGIN explícito
+        # cada DROP TRIGGER se confirmaría en el acto
+        if counters and not raw.in_transaction:
+            raw.execute("BEGIN IMMEDIATE")
+        for counter in counters:
+            raw.execute(f"DROP TRIGGER IF EXISTS {counter.trigger_names()[0]}")
+        return counters
+
+    @staticmethod
+    def count_inserted(raw: sqlite3.Connection, counters: list[CountBy], rows: str):
+        """Counts the rows of ``SELECT ... {rows}`` and restores the triggers."""
+        for counter in counters:
+            raw.execute(counter.bulk_increment(rows))
+            raw.execute(counter.triggers()[0])
+
+    def restore_insert_triggers(self, target: Engine, table: str):
+        """Recreates the insert triggers of `table` if a failed load dropped them."""
+        with target.begin() as conn:
+            for counter in self.counters.values():
+                if counter.table == table:
+                    conn.exec_driver_sql(
+                        counter.triggers()[0].replace(
+                            "CREATE TRIGGER", "CREATE TRIGGER IF NOT EXISTS", 1
+                        )
+                    )
+
+    def counts(self, name: str, primary: Engine) -> dict[str, int]:
+        """Returns the current non-zero totals of a counter by grouped value."""
+        counter = self.counters[name]
+        totals: dict[str, int] = {}
+        for engine in self.engines_for(counter, primary):
+            with engine.connect() as conn:
+                for key, total in self._read(conn, counter).items():
+                    totals[key] = totals.get(key, 0) + total
+        return {key: total for key, total in totals.items() if total}
+
+    @staticmethod
+    def _read(conn, counter: CountBy) -> dict[str, int]:
+        rows = conn.execute(
+            text("SELECT key, total FROM aggregatecounter WHERE name = :name").columns(
+                AggregateCounter.key, AggregateCounter.total
+            ),
+            {"name": counter.name},
+        )
+        return {key: total for key, total in rows}
+
+    @staticmethod
+    def _recount(conn, counter: CountBy):
+        conn.execute(
+            text("DELETE FROM aggregatecounter WHERE name = :name"),
+            {"name": counter.name},
+        )
+        conn.execute(
+            text(
+                "INSERT INTO aggregatecounter (name, key, total) "
+                f"SELECT :name, {counter.column}, COUNT(*) FROM {counter.table} "
+                f"GROUP BY {counter.column}"
+            ),
+            {"name": counter.name},
+        )
+
+
+aggregates = Aggregates()
+
+
+def install_aggregates(engine: Engine):
+    """Seeder installing the counter triggers (see `Aggregates.install`)."""
+    aggregates.install(engine)
@@ -0,0 +1,171 @@
+"""Cold tier for rows moved out of SQLite by the retention policies.
+
+Rows are stored as NDJSON in one gzip file per table and month
+(``ARCHIVE_DIR/<table>/YYYY-MM.ndjson.gz``), partitioned by a timestamp
+field of the row. Every batch is appended as a separate gzip member and
+synced to disk before the caller deletes the rows, so a batch is either
+archived and deleted, or still in the database (and possibly archived
+twice: readers drop repeated IDs). A member cut short by a crash is
+truncated away before the next append and ignored by readers.
+
+Reads decompress whole partitions, which makes them much slower than the
+database: they are meant for audits and occasional lookups.
+"""
+
+import gzip
+import json
+import logging
+import os
+import zlib
+from collections.abc import Callable, Iterable, Iterator
+from datetime import datetime
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# Directorio del almacenamiento en frío (una carpeta por tabla)
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "archive")
+ARCHIVE_COMPRESSLEVEL = int(os.environ.get("ARCHIVE_COMPRESSLEVEL", 6))
+SUFFIX = ".ndjson.gz"
+# Bytes leídos por vez al descomprimir
+READ_CHUNK_SIZE = 1 << 16
+
+
+def _members(path: str) -> Iterator[tuple[int, bytes]]:
+    """Yields (end offset, payload) of every complete gzip member of `path`."""
+    consumed = 0
+    with open(path, "rb") as file:
+        pending = b""
+        while True:
+            decompressor = zlib.decompressobj(wbits=31)
+            parts = []
+            while not decompressor.eof:
+                chunk = pending or file.read(READ_CHUNK_SIZE)
+                pending = b""
+                if not chunk:
+                    return
+                try:
+                    parts.append(decompressor.decompress(chunk))
+                except zlib.error:
+                    # Miembro dañado: lo anterior sigue siendo válido
+                    logger.warning("Corrupt archive member in %s at %d", path, consumed)
+                    return
+                consumed += len(chunk)
+            pending = decompressor.unused_data
+            consumed -= len(pending)
+            yield consumed, b"".join(parts)
+            if not pending and not (pending := file.read(READ_CHUNK_SIZE)):
+                return
+
+
+class ColdArchive:
+    """Append-only, month-partitioned NDJSON archive of table rows."""
+
+    def __init__(self, directory: str = ARCHIVE_DIR):
+        self.directory = directory
+        # Particiones ya verificadas por este proceso antes de añadirles datos
+        self._checked: set[str] = set()
+
+    def partition_path(self, table: str, month: str) -> str:
+        return os.path.join(self.directory, table, f"{month}{SUFFIX}")
+
+    def partitions(self, table: str) -> list[str]:
+        """Returns the archived months (``YYYY-MM``) of `table`, oldest first."""
+        folder = os.path.join(self.directory, table)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(
+            name.removesuffix(SUFFIX)
+            for name in os.listdir(folder)
+            if name.endswith(SUFFIX)
+        )
+
+    def write(
+        self, table: str, rows: Iterable[dict[str, Any]], time_field: str
+    ) -> dict[str, int]:
+        """Appends `rows` to the partitions of their `time_field` month.
+
+        Timestamps are ISO strings, so the month is their first 7 characters.
+        Returns when the data is on disk.
+
+        Returns:
+            The number of rows written per month.
+        """
+        by_month: dict[str, list[str]] = {}
+        for row in rows:
+            by_month.setdefault(row[time_field][:7], []).append(json.dumps(row))
+        os.makedirs(os.path.join(self.directory, table), exist_ok=True)
+        for month, lines in by_month.items():
+            path = self.partition_path(table, month)
+            self._repair(path)
+            member = gzip.compress(
+                ("\n".join(lines) + "\n").encode(),
+                compresslevel=ARCHIVE_COMPRESSLEVEL,
+                mtime=0,
+            )
+            with open(path, "ab") as file:
+                file.write(member)
+                file.flush()
+                os.fsync(file.fileno())
+        return {month: len(lines) for month, lines in by_month.items()}
+
+    def _repair(self, path: str):
+        if path in self._checked:
+            return
+        if os.path.exists(path):
+            valid = 0
+            for valid, _ in _members(path):
+                pass
+            if valid < os.path.getsize(path):
+                logger.warning("Truncating incomplete archive member in %s", path)
+                os.truncate(path, valid)
+        self._checked.add(path)
+
+    def scan(self, table: str, month: str) -> Iterator[dict[str, Any]]:
+        """Yields the rows of one partition in the order they were archived."""
+        path = self.partition_path(table, month)
+        if not os.path.exists(path):
+            return
+        for _, payload in _members(path):
+            for line in payload.splitlines():
+                yield json.loads(line)
+
+    def query(
+        self,
+        table: str,
+        time_field: str,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        match: Callable[[dict[str, Any]], bool] | None = None,
+        offset: int = 0,
+        limit: int = 100,
+    ) -> list[dict[str, Any]]:
+        """Returns archived rows with ``since <= time_field < until``.
+
+        Only the partitions overlapping the range are read. Rows are ordered
+        by `time_field` and ID and filtered by `match`; repeated IDs are
+        returned once.
+        """
+        low = since.isoformat() if since else ""
+        high = until.isoformat() if until else "\uffff"
+        found: list[dict[str, Any]] = []
+        seen: set[str] = set()
+        for month in self.partitions(table):
+            if month < low[:7] or month > high[:7]:
+                continue
+            rows = []
+            for row in self.scan(table, month):
+                if row["id"] in seen or not low <= row[time_field] < high:
+                    continue
+                if match is None or match(row):
+                    seen.add(row["id"])
+                    rows.append(row)
+            rows.sort(key=lambda row: (row[time_field], row["id"]))
+            found.extend(rows)
+            # Las particiones siguientes son posteriores: ya hay suficientes
+            if len(found) >= offset + limit:
+                break
+        return found[offset : offset + limit]
+
+
+cold_archive = ColdArchive()
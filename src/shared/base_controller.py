@@ -1,13 +1,35 @@
-from typing import Final, Annotated
-from fastapi import HTTPException, FastAPI, status, Query
+from typing import Final, Annotated, Any
+from collections.abc import Awaitable, Callable
+from fastapi import Depends, HTTPException, FastAPI, Request, Response, status, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter, create_model
 from .base_types import (
     ModelType,
     CreateSchemaType,
     UpdateSchemaType,
 )
-from sqlmodel import SQLModel
-from src.config.base import SessionDep
+from sqlmodel import Session, SQLModel
+from src.config.base import ReadSessionDep, SessionDep, last_write, replicas
+from src.config.base.utils import canonical_id
+from src.services.permissions import require_permission
 from .base_repository import BaseRepository
+from .change_feed import change_feed, format_sse
+from .single_flight import SingleFlight
+from .idempotency import (
+    IDEMPOTENCY_HEADER,
+    IdempotencyStore,
+)
+from .write_behind import (
+    DuplicateValueError,
+    QueueFullError,
+    WriteAccepted,
+    WriteBehindQueue,
+    WriteOperationStatus,
+)
+
+# Cabecera con la versión esperada del registro (concurrencia optimista)
+IF_MATCH_HEADER = "If-Match"
 
 
 class ControllerBuilder:
@@ -36,6 +58,12 @@ class ControllerBuilder:
         self.create_schema: type[SQLModel] | None = None
         self.update_schema: type[SQLModel] | None = None
         self.methods: set[str] = set()
+        self.batch_max_ids: int = 100
+        self.single_flight: SingleFlight[bytes] | None = None
+        self.write_behind: WriteBehindQueue | None = None
+        self.input_hook: Callable[[SQLModel], Awaitable[SQLModel]] | None = None
+        self.permissions: dict[str, str] = {}
+        self.idempotency: IdempotencyStore | None = None
 
     def enable_get(self):
         """Enables the GET /{path}/ endpoint to fetch all items."""
@@ -51,6 +79,18 @@ class ControllerBuilder:
         self.methods.add("GETID")
         return self
 
+    def enable_get_batch(self, max_ids: int = 100):
+        """Enables the GET /{path}/batch endpoint to fetch several items by ID.
+
+        Args:
+            max_ids: Maximum number of distinct IDs accepted per request.
+        """
+        if "GETBATCH" in self.methods:
+            raise ValueError("GET batch endpoint is already enabled.")
+        self.batch_max_ids = max_ids
+        self.methods.add("GETBATCH")
+        return self
+
     def enable_create(self, schema: type[SQLModel]):
         """Enables the POST /{path}/ endpoint to create a new item."""
         if "POST" in self.methods:
@@ -82,16 +122,126 @@ class ControllerBuilder:
         self.methods.add("DELETE")
         return self
 
+    def enable_single_flight(self, window: float = 0.0):
+        """Coalesces concurrent identical requests on the read endpoints.
+
+        Requests with the same path, query parameters and Authorization header
+        share one repository call and one serialized JSON body.
+
+        Args:
+            window: Seconds a finished response is reused for new identical
+                requests. ``0`` only coalesces requests that overlap.
+        """
+        if self.single_flight is not None:
+            raise ValueError("Single-flight is already enabled.")
+        self.single_flight = SingleFlight(window)
+        return self
+
+    def enable_write_behind(
+        self,
+        max_pending: int = 10_000,
+        batch_size: int = 500,
+        flush_interval: float = 0.05,
+    ):
+        """Makes PATCH /{path}/{id} queue updates and answer ``202 Accepted``.
+
+        Updates are validated and checked for existence synchronously, then
+        merged per row and written in batches by a background thread. The
+        ``202`` carries an operation ID whose outcome (``queued``, ``applied``
+        or ``failed``) is served by GET /{path}/operations/{operation}. When
+        the queue is full the endpoint answers ``503`` with ``Retry-After``.
+        Conditional updates (``If-Match``) skip the queue and are applied
+        synchronously, since they must report a version conflict.
+
+        Args:
+            max_pending: Maximum number of distinct rows waiting to be written.
+            batch_size: Number of pending rows that triggers an early flush.
+            flush_interval: Maximum seconds an update waits before being written.
+        """
+        if self.write_behind is not None:
+            raise ValueError("Write-behind is already enabled.")
+        self.write_behind = WriteBehindQueue(
+            self.repository, max_pending, batch_size, flush_interval
+        )
+        return self
+
+    def with_input_hook(self, hook: Callable[[SQLModel], Awaitable[SQLModel]]):
+        """Transforms POST/PATCH/PUT bodies with an async hook before the write.
+
+        The hook runs on the event loop as a dependency, so it can await
+        off-thread work (e.g. password hashing) without holding a threadpool
+        slot; the route itself still runs in the threadpool.
+
+        Args:
+            hook: Coroutine function receiving and returning the parsed body.
+        """
+        self.input_hook = hook
+        return self
+
+    def require_permissions(
+        self,
+        read: str | None = None,
+        write: str | None = None,
+        delete: str | None = None,
+    ):
+        """Declares the permissions checked on every enabled route.
+
+        Checks use the token principal set by `TokenAuthMiddleware` and the
+        precomputed role bitsets, so they never query the database.
+
+        Args:
+            read: Permission for GET routes (default ``"{path}:read"``).
+            write: Permission for POST/PATCH/PUT (default ``"{path}:write"``).
+            delete: Permission for DELETE (default ``"{path}:delete"``).
+        """
+        self.permissions = {
+            "read": read or f"{self.path_name}:read",
+            "write": write or f"{self.path_name}:write",
+            "delete": delete or f"{self.path_name}:delete",
+        }
+        return self
+
+    def enable_idempotency(self, ttl: float = 86_400):
+        """Honors the ``Idempotency-Key`` header on POST, PATCH and PUT.
+
+        A retry with the same key and body gets the stored response (with
+        ``Idempotent-Replayed: true``) without running the write or the input
+        hook again. While the first request runs, duplicates get ``409``; a
+        key reused with a different body gets ``422``.
+
+        Args:
+            ttl: Seconds a completed response is kept for replay.
+        """
+        if self.idempotency is not None:
+            raise ValueError("Idempotency is already enabled.")
+        self.idempotency = IdempotencyStore(self.path_name, ttl)
+        return self
+
+    def enable_change_feed(self):
+        """Records writes in the outbox and enables GET /{path}/changes.
+
+        The endpoint streams server-sent events (``id`` is the sequence
+        number, ``event`` the operation, ``data`` the changed ID) and resumes
+        after ``?since=`` or the ``Last-Event-ID`` header, so consumers stop
+        polling the listing to detect changes. A cursor older than the
+        retained records gets ``410 Gone``.
+        """
+        if "CHANGES" in self.methods:
+            raise ValueError("Change feed is already enabled.")
+        change_feed.track(self.repository.model)
+        self.methods.add("CHANGES")
+        return self
+
     def enable_read_only(self):
-        """Enables only read operations: GET and GET by ID."""
-        return self.enable_get().enable_get_by_id()
+        """Enables only read operations: GET, GET by ID and GET batch."""
+        return self.enable_get().enable_get_by_id().enable_get_batch()
 
     def enable_full_crud(
         self,
         create_schema: type[SQLModel],
         update_schema: type[SQLModel],
     ):
-        """Enables all CRUD operations: GET, POST, PATCH, DELETE.
+        """Enables all CRUD operations: GET, GET batch, POST, PATCH, DELETE.
 
         Args:
             create_schema: Schema for creating items (used in POST).
@@ -100,6 +250,7 @@ class ControllerBuilder:
         return (
             self.enable_get()
             .enable_get_by_id()
+            .enable_get_batch()
             .enable_create(create_schema)
             .enable_update(update_schema)
             .enable_delete()
@@ -137,8 +288,12 @@ class ControllerBuilder:
 
         self._validate_schema_dependencies()
 
+        # El orden importa: /{path}/batch y /{path}/changes deben registrarse
+        # antes que /{path}/{id}
         method_to_register = {
             "GET": self.__register_get_all,
+            "GETBATCH": self.__register_get_batch,
+            "CHANGES": self.__register_changes,
             "GETID": self.__register_get_by_id,
             "POST": self.__register_create,
             "PATCH": self.__register_update,
@@ -146,9 +301,9 @@ class ControllerBuilder:
             "DELETE": self.__register_delete,
         }
 
-        for method in self.methods:
-            if method in method_to_register:
-                method_to_register[method](app)
+        for method, register in method_to_register.items():
+            if method in self.methods:
+                register(app)
 
     def _validate_schema_dependencies(self):
         """Validates that required schemas are defined for enabled endpoints.
@@ -165,64 +320,420 @@ class ControllerBuilder:
         ) and not self.update_schema:
             raise ValueError("PATCH/PUT endpoint requires update_schema")
 
+        if self.write_behind is not None and "PATCH" not in self.methods:
+            raise ValueError("Write-behind requires the PATCH endpoint")
+
+    def _read(
+        self,
+        request: Request,
+        session: Session,
+        adapter: TypeAdapter,
+        fetch: Callable[[], Any],
+    ) -> Response:
+        """Runs a read, coalescing it with identical in-flight requests if enabled.
+
+        The result is serialized inside the route and the session is closed
+        right after, so the connection is back in the pool before the
+        response goes through the middlewares.
+
+        Args:
+            request: The incoming request, used to build the coalescing key.
+            session: The request session, closed once the body is built.
+            adapter: Adapter used to serialize the result once for all callers.
+            fetch: The repository call producing the result.
+
+        Returns:
+            A JSON `Response`, shared by coalesced callers.
+        """
+
+        def run() -> bytes:
+            result = adapter.validate_python(fetch(), from_attributes=True)
+            return adapter.dump_json(result)
+
+        try:
+            # Un cliente que acaba de escribir no comparte resultados ajenos
+            if self.single_flight is None or replicas.is_pinned(last_write(request)):
+                content = run()
+            else:
+                key = (
+                    request.url.path,
+                    tuple(sorted(request.query_params.multi_items())),
+                    request.headers.get("authorization"),
+                )
+                content = self.single_flight.do(key, run)
+        finally:
+            session.close()
+        return Response(content=content, media_type="application/json")
+
+    def _write(
+        self,
+        request: Request,
+        session: Session,
+        adapter: TypeAdapter,
+        write: Callable[[], Any],
+        status_code: int = status.HTTP_200_OK,
+    ) -> Response:
+        """Runs a repository write and serializes the result before releasing
+        the session, like `_read`. Stores the response for replay when the
+        request holds an idempotency key."""
+        try:
+            result = adapter.validate_python(write(), from_attributes=True)
+            content = adapter.dump_json(result)
+        finally:
+            session.close()
+        key = getattr(request.state, "idempotency_key", None)
+        if key is not None:
+            self.idempotency.complete(key, status_code, content)
+            request.state.idempotency_key = None
+        return Response(
+            content=content, status_code=status_code, media_type="application/json"
+        )
+
+    def _expected_version(self, request: Request) -> int | None:
+        """Returns the record version required by the ``If-Match`` header.
+
+        The header carries the ``version`` of the response body, quoted or
+        not; ``*`` (or no header) makes the write unconditional.
+
+        Raises:
+            HTTPException: 400 if the header is not a version or the model
+                is not versioned.
+        """
+        value = request.headers.get(IF_MATCH_HEADER)
+        if value is None or value.strip() == "*":
+            return None
+        if not self.repository.versioned:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"{self.path_name} does not support {IF_MATCH_HEADER}",
+            )
+        version = value.strip().strip('"')
+        if not version.isdigit():
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"{IF_MATCH_HEADER} must be a record version",
+            )
+        return int(version)
+
+    def _body(self, schema: type[SQLModel]):
+        """Returns the body annotation for `schema`, applying the input hook."""
+        if self.input_hook is None:
+            return schema
+
+        async def prepared_body(body: schema) -> SQLModel:
+            return await self.input_hook(body)
+
+        return Annotated[schema, Depends(prepared_body)]
+
+    def _guard(self, action: str) -> list:
+        """Returns the route dependencies enforcing the permission of `action`."""
+        if action not in self.permissions:
+            return []
+        return [Depends(require_permission(self.permissions[action]))]
+
+    def _idempotent(self) -> list:
+        """Returns the route dependencies claiming the ``Idempotency-Key``."""
+        if self.idempotency is None:
+            return []
+
+        async def claim(request: Request):
+            request.state.idempotency_key = None
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not key:
+                yield
+                return
+            storage_key = self.idempotency.key_for(request, key)
+            fingerprint = self.idempotency.fingerprint(request, await request.body())
+            await run_in_threadpool(self.idempotency.claim, storage_key, fingerprint)
+            request.state.idempotency_key = storage_key
+            try:
+                yield
+            finally:
+                # Sin respuesta almacenada (error o validación): liberar la clave
+                if request.state.idempotency_key is not None:
+                    await run_in_threadpool(self.idempotency.release, storage_key)
+
+        return [Depends(claim)]
+
     # ——— Private methods for route registration ———
 
     def __register_get_all(self, app: FastAPI):
         """Registers the GET /{path}/ endpoint."""
+        adapter = TypeAdapter(list[self.response_schema])
 
-        @app.get(f"/{self.path_name}/", response_model=list[self.response_schema])
+        @app.get(
+            f"/{self.path_name}/",
+            response_model=list[self.response_schema],
+            dependencies=self._guard("read"),
+        )
         def _(
-            session: SessionDep,
+            request: Request,
+            session: ReadSessionDep,
             offset: int = 0,
             limit: Annotated[int, Query(le=100)] = 100,
         ):
-            return self.repository.get_all(session, offset, limit)
+            return self._read(
+                request,
+                session,
+                adapter,
+                lambda: self.repository.get_all(session, offset, limit),
+            )
+
+    def __register_changes(self, app: FastAPI):
+        """Registers the GET /{path}/changes server-sent event stream."""
+        entity = self.repository.model.__tablename__
+
+        @app.get(
+            f"/{self.path_name}/changes",
+            response_class=StreamingResponse,
+            dependencies=self._guard("read"),
+        )
+        async def _(
+            request: Request,
+            since: Annotated[int | None, Query(ge=0)] = None,
+        ):
+            # Los clientes SSE reanudan con la última secuencia recibida
+            last_event_id = request.headers.get("last-event-id")
+            if last_event_id and last_event_id.isdigit():
+                since = int(last_event_id)
+            if since is not None and since < await run_in_threadpool(
+                change_feed.available_since
+            ):
+                raise HTTPException(
+                    status_code=status.HTTP_410_GONE,
+                    detail="Changes after this sequence were purged; reload the listing",
+                )
+
+            async def events():
+                async for batch in change_feed.stream(entity, since):
+                    yield format_sse(batch)
+
+            return StreamingResponse(
+                events(),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
 
     def __register_get_by_id(self, app: FastAPI):
         """Registers the GET /{path}/{id} endpoint."""
+        adapter = TypeAdapter(self.response_schema)
+
+        @app.get(
+            f"/{self.path_name}/{{id}}",
+            response_model=self.response_schema,
+            dependencies=self._guard("read"),
+        )
+        def _(id: str, request: Request, session: ReadSessionDep):
+            def fetch():
+                item = self.repository.get_by_id(session, id)
+                if item is None:
+                    raise HTTPException(
+                        status_code=status.HTTP_404_NOT_FOUND,
+                        detail=f"{self.path_name} with ID {id} not found",
+                    )
+                return item
+
+            return self._read(request, session, adapter, fetch)
+
+    def __register_get_batch(self, app: FastAPI):
+        """Registers the GET /{path}/batch endpoint.
+
+        IDs may be repeated (``?ids=a&ids=b``) or comma separated (``?ids=a,b``).
+        Found items keep the request order and unknown IDs are listed in
+        ``missing``.
+        """
+        batch_schema = create_model(
+            f"{self.response_schema.__name__}Batch",
+            items=(list[self.response_schema], ...),
+            missing=(list[str], ...),
+        )
+        adapter = TypeAdapter(batch_schema)
 
-        @app.get(f"/{self.path_name}/{{id}}", response_model=self.response_schema)
-        def _(id: str, session: SessionDep):
-            item = self.repository.get_by_id(session, id)
-            if item is None:
+        @app.get(
+            f"/{self.path_name}/batch",
+            response_model=batch_schema,
+            dependencies=self._guard("read"),
+        )
+        def _(
+            request: Request,
+            session: ReadSessionDep,
+            ids: Annotated[list[str], Query()],
+        ):
+            # Misma forma que las IDs leídas, para cruzarlas con los encontrados
+            requested = list(
+                dict.fromkeys(
+                    canonical_id(i) for raw in ids for i in raw.split(",") if i
+                )
+            )
+            if len(requested) > self.batch_max_ids:
                 raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail=f"{self.path_name} with ID {id} not found",
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"At most {self.batch_max_ids} IDs are allowed per request",
                 )
-            return item
+
+            def fetch():
+                found = self.repository.get_by_ids(session, requested)
+                return {
+                    "items": [found[i] for i in requested if i in found],
+                    "missing": [i for i in requested if i not in found],
+                }
+
+            return self._read(request, session, adapter, fetch)
 
     def __register_create(self, app: FastAPI):
         """Registers the POST /{path}/ endpoint."""
+        adapter = TypeAdapter(self.response_schema)
 
         @app.post(
             f"/{self.path_name}/",
             response_model=self.response_schema,
             status_code=status.HTTP_201_CREATED,
+            dependencies=self._guard("write") + self._idempotent(),
         )
-        def _(item_in: self.create_schema, session: SessionDep):
-            return self.repository.create(session, item_in)
+        def _(
+            request: Request,
+            item_in: self._body(self.create_schema),
+            session: SessionDep,
+        ):
+            return self._write(
+                request,
+                session,
+                adapter,
+                lambda: self.repository.create(session, item_in),
+                status.HTTP_201_CREATED,
+            )
 
     def __register_update(self, app: FastAPI):
         """Registers the PATCH /{path}/{id} endpoint."""
+        if self.write_behind is not None:
+            self.__register_queued_update(app)
+            return
+        adapter = TypeAdapter(self.response_schema)
+
+        @app.patch(
+            f"/{self.path_name}/{{id}}",
+            response_model=self.response_schema,
+            dependencies=self._guard("write") + self._idempotent(),
+        )
+        def _(
+            id: str,
+            request: Request,
+            obj: self._body(self.update_schema),
+            session: SessionDep,
+        ):
+            version = self._expected_version(request)
+            return self._write(
+                request,
+                session,
+                adapter,
+                lambda: self.repository.update(session, id, obj, version),
+            )
+
+    def __register_queued_update(self, app: FastAPI):
+        """Registers the PATCH /{path}/{id} endpoint backed by the write-behind queue."""
+        adapter = TypeAdapter(WriteAccepted)
+        conditional_adapter = TypeAdapter(self.response_schema)
+
+        @app.patch(
+            f"/{self.path_name}/{{id}}",
+            response_model=WriteAccepted,
+            status_code=status.HTTP_202_ACCEPTED,
+            dependencies=self._guard("write") + self._idempotent(),
+        )
+        def _(
+            id: str,
+            request: Request,
+            obj: self._body(self.update_schema),
+            session: SessionDep,
+        ):
+            version = self._expected_version(request)
+            if version is not None:
+                return self._write(
+                    request,
+                    session,
+                    conditional_adapter,
+                    lambda: self.repository.update(session, id, obj, version),
+                )
 
-        @app.patch(f"/{self.path_name}/{{id}}", response_model=self.response_schema)
-        def _(id: str, obj: self.update_schema, session: SessionDep):
-            return self.repository.update(session, id, obj)
+            def enqueue() -> WriteAccepted:
+                if self.repository.get_by_id(session, id) is None:
+                    raise HTTPException(status_code=404, detail="Record not found")
+                self.repository.validate_update(session, obj)
+                # Lo que fallaría al escribir se rechaza ahora, no tras el 202
+                values = self.repository.update_values(obj)
+                self.repository.validate_unique(session, id, values)
+                if not values:
+                    return WriteAccepted(id=id)
+                try:
+                    operation = self.write_behind.enqueue(id, values)
+                except DuplicateValueError as e:
+                    raise HTTPException(
+                        status_code=status.HTTP_409_CONFLICT, detail=str(e)
+                    )
+                except QueueFullError as e:
+                    raise HTTPException(
+                        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        detail=str(e),
+                        headers={"Retry-After": "1"},
+                    )
+                return WriteAccepted(id=id, operation=operation)
+
+            return self._write(
+                request, session, adapter, enqueue, status.HTTP_202_ACCEPTED
+            )
+
+        @app.get(
+            f"/{self.path_name}/operations/{{operation}}",
+            response_model=WriteOperationStatus,
+            dependencies=self._guard("read"),
+        )
+        def _(operation: str):
+            result = self.write_behind.status(operation)
+            if result is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Operation {operation} not found",
+                )
+            return result
 
     def __register_put(self, app: FastAPI):
         """Registers the PUT /{path}/{id} endpoint."""
+        adapter = TypeAdapter(self.response_schema)
 
-        @app.put(f"/{self.path_name}/{{id}}", response_model=self.response_schema)
-        def _(id: str, obj: self.update_schema, session: SessionDep):
-            return self.repository.update(session, id, obj)
+        @app.put(
+            f"/{self.path_name}/{{id}}",
+            response_model=self.response_schema,
+            dependencies=self._guard("write") + self._idempotent(),
+        )
+        def _(
+            id: str,
+            request: Request,
+            obj: self._body(self.update_schema),
+            session: SessionDep,
+        ):
+            version = self._expected_version(request)
+            return self._write(
+                request,
+                session,
+                adapter,
+                lambda: self.repository.update(session, id, obj, version),
+            )
 
     def __register_delete(self, app: FastAPI):
         """Registers the DELETE /{path}/{id} endpoint."""
+        adapter = TypeAdapter(self.response_schema)
 
         @app.delete(
             f"/{self.path_name}/{{id}}",
             response_model=self.response_schema,
             status_code=status.HTTP_200_OK,
+            dependencies=self._guard("delete"),
         )
-        def _(id: str, session: SessionDep):
-            return self.repository.delete(session, id)
+        def _(id: str, request: Request, session: SessionDep):
+            version = self._expected_version(request)
+            return self._write(
+                request,
+                session,
+                adapter,
+                lambda: self.repository.delete(session, id, version),
+            )
@@ -1,5 +1,9 @@
-from typing import Generic
-from collections.abc import Sequence
+import functools
+import threading
+from typing import Any, Generic
+from collections.abc import Callable, Sequence
+from sqlalchemy import bindparam, delete, inspect, update
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlmodel import select, Session
 from fastapi import HTTPException
 from .base_types import (
@@ -7,18 +11,116 @@ from .base_types import (
     CreateSchemaType,
     UpdateSchemaType,
 )
+from .entity_cache import EntityCache
+from .statements import cached_statement
+
+# Máximo de parámetros por cláusula IN (SQLite antiguo limita a 999 variables)
+IN_CLAUSE_CHUNK_SIZE = 500
+
+# Columna de versión para la concurrencia optimista (opcional en cada modelo)
+VERSION_COLUMN = "version"
+
+# Métodos de escritura que invalidan la caché de entidades
+CACHE_INVALIDATING_METHODS = ("create", "update", "delete")
+
+
+# Sentencias de los repositorios, construidas una vez por modelo (statements.py)
+def select_page(model: type) -> Any:
+    return select(model).offset(bindparam("offset")).limit(bindparam("limit"))
+
+
+def select_by_id(model: type) -> Any:
+    return select(model).where(model.id == bindparam("id"))
+
+
+def select_by_ids(model: type) -> Any:
+    return select(model).where(model.id.in_(bindparam("ids", expanding=True)))
+
+
+def select_id(model: type) -> Any:
+    return select(model.id).where(model.id == bindparam("id"))
+
+
+def select_unique_conflicts(model: type) -> dict[str, Any]:
+    # Una sentencia por columna única: otro registro con el mismo valor
+    return {
+        column.key: select(model.id)
+        .where(
+            column == bindparam("value", type_=column.type),
+            model.id != bindparam("id"),
+        )
+        .limit(1)
+        for column in model.__table__.columns
+        if column.unique
+    }
+
+
+# Profundidad de escrituras anidadas por repositorio (p. ej. override con super())
+_write_depth = threading.local()
+
+
+def invalidates_cache(method: Callable) -> Callable:
+    """Drops the returned record from the repository cache after a write.
+
+    Nested calls, such as an override delegating to ``super()``, invalidate
+    only once when the outermost call returns.
+    """
+    if getattr(method, "__invalidates_cache__", False):
+        return method
+
+    @functools.wraps(method)
+    def wrapper(self: "BaseRepository", db: Session, *args, **kwargs):
+        depths: dict[int, int] = _write_depth.__dict__.setdefault("by_repo", {})
+        depth = depths.get(id(self), 0)
+        depths[id(self)] = depth + 1
+        try:
+            result = method(self, db, *args, **kwargs)
+        finally:
+            depths[id(self)] = depth
+        if depth == 0 and self.cache is not None and result is not None:
+            self.cache.invalidate(result.id)
+        return result
+
+    wrapper.__invalidates_cache__ = True
+    return wrapper
 
 
 class BaseRepository(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
     """Base repository class for handling common database operations."""
 
-    def __init__(self, model: type[ModelType]):
+    def __init_subclass__(cls, **kwargs):
+        """Wraps write overrides in subclasses so they invalidate the cache too."""
+        super().__init_subclass__(**kwargs)
+        for name in CACHE_INVALIDATING_METHODS:
+            if name in cls.__dict__:
+                setattr(cls, name, invalidates_cache(cls.__dict__[name]))
+
+    def __init__(self, model: type[ModelType], cache: EntityCache | None = None):
         """Initializes the repository with a specific SQLModel class.
 
         Args:
             model: The SQLModel class for the entity.
+            cache: Optional entity cache consulted by `get_by_id`.
         """
         self.model: type[ModelType] = model
+        self.cache: EntityCache | None = cache
+
+    @property
+    def versioned(self) -> bool:
+        """Whether the model has a version column for optimistic concurrency."""
+        return VERSION_COLUMN in self.model.__table__.columns
+
+    def _load_by_id(self, db: Session, id: str) -> ModelType | None:
+        """Reads a record by its ID from the database, bypassing the cache.
+
+        Like ``Session.get``, an instance already loaded in the session is
+        returned without a query; otherwise the prebuilt by-ID statement runs.
+        """
+        obj = db.identity_map.get(db.identity_key(self.model, id))
+        if obj is not None and not inspect(obj).expired:
+            return obj
+        statement = cached_statement(select_by_id, self.model)
+        return db.exec(statement, params={"id": id}).unique().one_or_none()
 
     def get_by_id(self, db: Session, id: str) -> ModelType | None:
         """Fetches a record by its ID.
@@ -31,12 +133,38 @@ class BaseRepository(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
             The model instance if found, else None.
         """
         try:
-            return db.get(self.model, id)
+            if self.cache is not None:
+                return self.cache.get(db, self.model, id, self._load_by_id)
+            return self._load_by_id(db, id)
         except Exception as e:
             raise HTTPException(
                 status_code=500, detail=f"Error fetching record: {str(e)}"
             )
 
+    def get_by_ids(self, db: Session, ids: Sequence[str]) -> dict[str, ModelType]:
+        """Fetches several records by ID with chunked ``WHERE id IN (...)`` queries.
+
+        Args:
+            db: Database session.
+            ids: The IDs of the records. Duplicates are queried only once.
+
+        Returns:
+            A mapping of ID to model instance containing only the records found.
+        """
+        try:
+            unique_ids = list(dict.fromkeys(ids))
+            found: dict[str, ModelType] = {}
+            statement = cached_statement(select_by_ids, self.model)
+            for start in range(0, len(unique_ids), IN_CLAUSE_CHUNK_SIZE):
+                chunk = unique_ids[start : start + IN_CLAUSE_CHUNK_SIZE]
+                for obj in db.exec(statement, params={"ids": chunk}).unique().all():
+                    found[obj.id] = obj
+            return found
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Error fetching records: {str(e)}"
+            )
+
     def get_all(
         self,
         db: Session,
@@ -54,14 +182,18 @@ class BaseRepository(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
             A sequence of model instances.
         """
         try:
+            statement = cached_statement(select_page, self.model)
             return (
-                db.exec(select(self.model).offset(offset).limit(limit)).unique().all()
+                db.exec(statement, params={"offset": offset, "limit": limit})
+                .unique()
+                .all()
             )
         except Exception as e:
             raise HTTPException(
                 status_code=500, detail=f"Error fetching records: {str(e)}"
             )
 
+    @invalidates_cache
     def create(self, db: Session, obj_in: CreateSchemaType) -> ModelType:
         """Creates a new record in the database.
 
@@ -84,37 +216,100 @@ class BaseRepository(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
                 status_code=500, detail=f"Error creating record: {str(e)}"
             )
 
+    def validate_update(self, db: Session, obj_in: UpdateSchemaType) -> None:
+        """Checks update data against the database before it is applied.
+
+        Subclasses override this to verify references (e.g. foreign keys) so
+        the same checks run for synchronous and queued updates.
+
+        Args:
+            db: Database session.
+            obj_in: The updated data.
+
+        Raises:
+            HTTPException: If the data is not valid.
+        """
+
+    def update_values(self, obj_in: UpdateSchemaType) -> dict[str, Any]:
+        """Returns the values an update writes.
+
+        Unset fields are left out, and so are nulls for non-nullable columns:
+        update schemas declare every field, so clients send null for the
+        fields they do not change.
+        """
+        columns = self.model.__table__.columns
+        return {
+            key: value
+            for key, value in obj_in.model_dump(exclude_unset=True).items()
+            if value is not None or key not in columns or columns[key].nullable
+        }
+
+    def validate_unique(self, db: Session, id: str, values: dict[str, Any]) -> None:
+        """Checks that `values` do not repeat a unique column of another record.
+
+        Raises:
+            HTTPException: 409 if another record already has one of the values.
+        """
+        conflicts = cached_statement(select_unique_conflicts, self.model)
+        for key, statement in conflicts.items():
+            if key not in values:
+                continue
+            params = {"value": values[key], "id": id}
+            if self._first(db, statement, params) is not None:
+                raise HTTPException(
+                    status_code=409, detail=f"Duplicate value for {key}"
+                )
+
+    def _first(
+        self, db: Session, statement: Any, params: dict[str, Any] | None = None
+    ) -> Any:
+        """Returns the first result of `statement`, or None."""
+        return db.exec(statement, params=params).first()
+
+    @invalidates_cache
     def update(
         self,
         db: Session,
         id: str,
         obj_in: UpdateSchemaType,
+        version: int | None = None,
     ) -> ModelType:
-        """Updates an existing record.
+        """Updates an existing record with a single ``UPDATE ... RETURNING``.
+
+        The row is not loaded first: `validate_update` runs, then one
+        statement writes the changes, bumps the version of versioned models
+        and returns the updated row.
 
         Args:
             db: Database session.
             id: The ID of the record to update.
             obj_in: The updated data.
+            version: Expected current version; the update only applies if the
+                row still has it (optimistic concurrency).
 
         Returns:
             The updated model instance.
 
         Raises:
-            HTTPException: If the record is not found.
+            HTTPException: 404 if the record is not found, 409 if its version
+                is not `version`.
         """
-        try:
-            obj_db = db.get(self.model, id)
+        self.validate_update(db, obj_in)
+        values = self.update_values(obj_in)
+        if self.versioned:
+            values[VERSION_COLUMN] = self.model.version + 1
+        elif not values:
+            obj_db = self._load_by_id(db, id)
             if not obj_db:
                 raise HTTPException(status_code=404, detail="Record not found")
-
-            obj_data = obj_in.model_dump(exclude_unset=True)
-            obj_db.sqlmodel_update(obj_data)
-            db.add(obj_db)
-            db.commit()
-            db.refresh(obj_db)
+            return obj_db
+        try:
+            statement = update(self.model).values(values)
+            obj_db = self._returning(db, statement, id, version)
+            self._commit_loaded(db, obj_db)
             return obj_db
         except HTTPException:
+            db.rollback()
             raise
         except Exception as e:
             db.rollback()
@@ -122,31 +317,78 @@ class BaseRepository(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
                 status_code=500, detail=f"Error updating record: {str(e)}"
             )
 
-    def delete(self, db: Session, id: str) -> ModelType:
-        """Deletes a record by its ID.
+    @invalidates_cache
+    def delete(self, db: Session, id: str, version: int | None = None) -> ModelType:
+        """Deletes a record by its ID with a single ``DELETE ... RETURNING``.
 
         Args:
             db: Database session.
             id: The ID of the record to delete.
+            version: Expected current version (see `update`).
 
         Returns:
             The deleted model instance.
 
         Raises:
-            HTTPException: If the record is not found.
+            HTTPException: 404 if the record is not found, 409 if its version
+                is not `version`.
         """
         try:
-            obj_db = db.get(self.model, id)
-            if not obj_db:
-                raise HTTPException(status_code=404, detail="Record not found")
-
-            db.delete(obj_db)
+            obj_db = self._returning(db, delete(self.model), id, version)
+            db.expunge(obj_db)
             db.commit()
             return obj_db
         except HTTPException:
+            db.rollback()
             raise
         except Exception as e:
             db.rollback()
             raise HTTPException(
                 status_code=500, detail=f"Error deleting record: {str(e)}"
             )
+
+    def _returning(
+        self, db: Session, statement: Any, id: str, version: int | None
+    ) -> ModelType:
+        """Runs an UPDATE/DELETE on row `id` (at `version`) returning the row."""
+        criteria = [self.model.id == id]
+        if version is not None:
+            if not self.versioned:
+                raise HTTPException(status_code=400, detail="Record is not versioned")
+            criteria.append(self.model.version == version)
+        statement = (
+            statement.where(*criteria).returning(self.model)
+            # La fila devuelta reemplaza la copia de la sesión sin evaluar el
+            # criterio sobre el mapa de identidad; target_ids la anota en el
+            # outbox de cambios
+            .execution_options(
+                synchronize_session=False,
+                populate_existing=True,
+                target_ids=[id],
+            )
+        )
+        obj_db = db.execute(statement).scalar_one_or_none()
+        if obj_db is not None:
+            return obj_db
+        if version is not None:
+            # Solo en el caso de fallo: distinguir conflicto de inexistencia
+            statement = cached_statement(select_id, self.model)
+            exists = db.exec(statement, params={"id": id}).first()
+            if exists is not None:
+                raise HTTPException(status_code=409, detail="Version conflict")
+        raise HTTPException(status_code=404, detail="Record not found")
+
+    @staticmethod
+    def _commit_loaded(db: Session, obj_db: ModelType):
+        """Commits keeping the columns of `obj_db` loaded.
+
+        The values came back with RETURNING and are current, so reading them
+        after the commit must not query the row again.
+        """
+        loaded = {
+            attr.key: getattr(obj_db, attr.key)
+            for attr in inspect(obj_db).mapper.column_attrs
+        }
+        db.commit()
+        for key, value in loaded.items():
+            set_committed_value(obj_db, key, value)
@@ -0,0 +1,337 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from collections.abc import AsyncIterator
+from itertools import takewhile
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Engine, delete, event, insert
+from sqlmodel import Field, Session, SQLModel, func, select
+
+from src.config.base import engine
+from src.config.base.utils import IdType
+
+logger = logging.getLogger(__name__)
+
+# Eventos recientes servidos desde memoria
+CHANGE_FEED_BUFFER = int(os.environ.get("CHANGE_FEED_BUFFER", 4096))
+# Intervalo de lectura de la tabla outbox (cambios de otros procesos)
+CHANGE_FEED_POLL_INTERVAL = float(os.environ.get("CHANGE_FEED_POLL_INTERVAL", 1.0))
+# Comentario SSE enviado a conexiones inactivas (segundos)
+CHANGE_FEED_HEARTBEAT = float(os.environ.get("CHANGE_FEED_HEARTBEAT", 15.0))
+# Filas leídas por consulta al ponerse al día desde la tabla
+CATCH_UP_PAGE_SIZE = 500
+
+
+class ChangeRecord(SQLModel, table=True):
+    # AUTOINCREMENT: las secuencias nunca se reutilizan tras purgar filas
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq: int | None = Field(default=None, primary_key=True)
+    entity: str = Field(max_length=32)
+    entity_id: str = Field(sa_type=IdType)
+    op: str = Field(max_length=6)
+    changed_at: float
+
+
+# (seq, entity, entity_id, op, changed_at)
+ChangeEvent = tuple[int, str, str, str, float]
+
+
+class ChangeFeed:
+    """Transactional outbox plus an in-memory fan-out of recent changes.
+
+    Flushes of tracked models append a `ChangeRecord` in the same session, so
+    a change is published if and only if its write commits. A background
+    thread tails the outbox into a ring buffer (immediately after a local
+    commit, every `poll_interval` seconds for other workers), and
+    subscribers are served from the buffer; older sequence numbers are read
+    back from the table. The retention job purges old records (`purge`);
+    cursors older than the oldest record left cannot resume (`available_since`).
+
+    ORM bulk UPDATE/DELETE statements are recorded when executed with one
+    parameter set per primary key (as the write-behind queue does) or with
+    the ``target_ids`` execution option (as the repositories do); criteria
+    updates without IDs are not. With sharding enabled the outbox lives in the
+    primary file and commits right after the shard, not atomically with it.
+    """
+
+    def __init__(
+        self,
+        primary: Engine,
+        buffer_size: int = CHANGE_FEED_BUFFER,
+        poll_interval: float = CHANGE_FEED_POLL_INTERVAL,
+    ):
+        self.primary = primary
+        self.poll_interval = poll_interval
+        self.tracked: set[str] = set()
+        self._buffer: deque[ChangeEvent] = deque(maxlen=buffer_size)
+        # Secuencia más alta que el buffer ya no cubre
+        self._floor = 0
+        self._last_seq = 0
+        self._lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup = asyncio.Event()
+
+    def track(self, model: type[SQLModel]):
+        """Records creates, updates and deletes of `model` in the outbox."""
+        self.tracked.add(model.__tablename__)
+
+    @property
+    def last_seq(self) -> int:
+        return self._last_seq
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Loads the most recent changes and starts tailing the outbox."""
+        if self._thread is not None:
+            return
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        with Session(self.primary) as db:
+            rows = db.exec(
+                select(ChangeRecord)
+                .order_by(ChangeRecord.seq.desc())
+                .limit(self._buffer.maxlen)
+            ).all()
+            oldest = rows[-1].seq if rows else None
+            if oldest is None:
+                self._floor = db.exec(select(func.max(ChangeRecord.seq))).one() or 0
+            else:
+                self._floor = oldest - 1
+        self._last_seq = self._floor
+        self._append([_as_event(row) for row in reversed(rows)])
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="change-feed", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._dirty.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def available_since(self) -> int:
+        """Returns the oldest cursor whose following changes are all kept.
+
+        Sequence numbers have no gaps except the purged ones, and `purge`
+        always keeps the newest record.
+        """
+        with Session(self.primary) as db:
+            oldest = db.exec(select(func.min(ChangeRecord.seq))).one()
+        return 0 if oldest is None else oldest - 1
+
+    def purge(self, before: float, batch_size: int = CATCH_UP_PAGE_SIZE) -> int:
+        """Deletes the records changed before `before` (Unix time).
+
+        Records are scanned in sequence order and the purge stops at the
+        first newer one, so it only reads the primary key index. The newest
+        record is always kept so `available_since` stays exact.
+
+        Returns:
+            The number of records deleted.
+        """
+        deleted = 0
+        with Session(self.primary) as db:
+            last = db.exec(select(func.max(ChangeRecord.seq))).one()
+            while last is not None:
+                rows = db.exec(
+                    select(ChangeRecord.seq, ChangeRecord.changed_at)
+                    .where(ChangeRecord.seq < last)
+                    .order_by(ChangeRecord.seq)
+                    .limit(batch_size)
+                ).all()
+                # Prefijo caducado del lote (changed_at crece con la secuencia)
+                expired = list(takewhile(lambda row: row[1] < before, rows))
+                if not expired:
+                    break
+                deleted += db.exec(
+                    delete(ChangeRecord).where(ChangeRecord.seq <= expired[-1][0])
+                ).rowcount
+                db.commit()
+                if len(expired) < len(rows):
+                    break
+        return deleted
+
+    def notify_commit(self):
+        """Wakes the tailer after a local commit that wrote change records."""
+        self._dirty.set()
+
+    async def stream(
+        self, entity: str, since: int | None = None
+    ) -> AsyncIterator[list[ChangeEvent]]:
+        """Yields batches of changes to `entity` after sequence `since`.
+
+        ``since=None`` starts at the current end of the feed. An empty batch
+        means nothing changed for `heartbeat` seconds. The stream ends if the
+        records after `since` are purged while it catches up.
+        """
+        cursor = self._last_seq if since is None else since
+        while True:
+            wakeup = self._wakeup
+            if cursor < self._floor:
+                # Fuera del buffer: leer de la tabla hasta alcanzarlo
+                page = await run_in_threadpool(self._read_outbox, cursor)
+                if page and page[0][0] > cursor + 1:
+                    # Purgado mientras se leía: al reanudar, el cliente recibe 410
+                    return
+                if page:
+                    cursor = page[-1][0]
+                    batch = [change for change in page if change[1] == entity]
+                    if batch:
+                        yield batch
+                    continue
+                cursor = max(cursor, self._floor)
+            batch, cursor = self._since(entity, cursor)
+            if batch:
+                yield batch
+                continue
+            try:
+                await asyncio.wait_for(wakeup.wait(), CHANGE_FEED_HEARTBEAT)
+            except TimeoutError:
+                yield []
+
+    def _since(self, entity: str, cursor: int) -> tuple[list[ChangeEvent], int]:
+        with self._lock:
+            newer = []
+            for change in reversed(self._buffer):
+                if change[0] <= cursor:
+                    break
+                newer.append(change)
+            last = self._last_seq
+        newer.reverse()
+        return [change for change in newer if change[1] == entity], max(cursor, last)
+
+    def _read_outbox(self, cursor: int) -> list[ChangeEvent]:
+        with Session(self.primary) as db:
+            rows = db.exec(
+                select(ChangeRecord)
+                .where(ChangeRecord.seq > cursor)
+                .order_by(ChangeRecord.seq)
+                .limit(CATCH_UP_PAGE_SIZE)
+            ).all()
+            return [_as_event(row) for row in rows]
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._dirty.wait(self.poll_interval)
+            self._dirty.clear()
+            try:
+                while page := self._read_outbox(self._last_seq):
+                    self._append(page)
+                    if len(page) < CATCH_UP_PAGE_SIZE:
+                        break
+            except Exception:
+                logger.exception("Change feed poll failed")
+
+    def _append(self, changes: list[ChangeEvent]):
+        if not changes:
+            return
+        with self._lock:
+            for change in changes:
+                if len(self._buffer) == self._buffer.maxlen:
+                    self._floor = self._buffer[0][0]
+                self._buffer.append(change)
+            self._last_seq = changes[-1][0]
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        # Despertar a todos los suscriptores y preparar el siguiente aviso
+        wakeup, self._wakeup = self._wakeup, asyncio.Event()
+        wakeup.set()
+
+
+def _as_event(row: ChangeRecord) -> ChangeEvent:
+    return (row.seq, row.entity, row.entity_id, row.op, row.changed_at)
+
+
+def format_sse(batch: list[ChangeEvent]) -> bytes:
+    """Renders a batch as server-sent events, or a heartbeat if empty."""
+    if not batch:
+        return b": keepalive\n\n"
+    return "".join(
+        f"id: {seq}\nevent: {op}\n"
+        f"data: {json.dumps({'seq': seq, 'id': id, 'op': op, 'at': at})}\n\n"
+        for seq, _, id, op, at in batch
+    ).encode()
+
+
+change_feed = ChangeFeed(engine)
+
+
+def _record(
+    session: Session, entity: str, ids: list[str], op: str, flushing: bool = True
+):
+    # El outbox vive en el primario aunque la sesión escriba en un shard
+    if session.bind is not engine:
+        session.bind_mapper(ChangeRecord, engine)
+    now = time.time()
+    rows = [
+        {"entity": entity, "entity_id": id, "op": op, "changed_at": now} for id in ids
+    ]
+    if flushing:
+        session.add_all(ChangeRecord(**row) for row in rows)
+    else:
+        # Fuera de un flush: INSERT de Core en la conexión del primario, sin
+        # autoflush ni el INSERT masivo del ORM (no admite sesiones con shards)
+        connection = session.connection(bind_arguments={"mapper": ChangeRecord})
+        connection.execute(insert(ChangeRecord.__table__), rows)
+    session.info["change_feed"] = True
+
+
+@event.listens_for(Session, "before_flush")
+def _record_flush(session: Session, flush_context, instances):
+    if not change_feed.tracked:
+        return
+    for objects, op in (
+        (session.new, "create"),
+        (session.dirty, "update"),
+        (session.deleted, "delete"),
+    ):
+        for obj in objects:
+            entity = getattr(obj, "__tablename__", None)
+            if entity not in change_feed.tracked:
+                continue
+            if op == "update" and not session.is_modified(obj):
+                continue
+            _record(session, entity, [obj.id], op)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _record_bulk(state):
+    if not (state.is_update or state.is_delete) or state.bind_mapper is None:
+        return
+    entity = state.bind_mapper.local_table.name
+    if entity not in change_feed.tracked:
+        return
+    op = "update" if state.is_update else "delete"
+    # Sentencias por clave primaria de los repositorios (UPDATE ... RETURNING)
+    target_ids = state.execution_options.get("target_ids")
+    if target_ids is not None:
+        _record(state.session, entity, list(target_ids), op, flushing=False)
+        return
+    params = state.parameters
+    if isinstance(params, list) and all("id" in row for row in params):
+        ids = [row["id"] for row in params]
+        _record(state.session, entity, ids, op, flushing=False)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish(session: Session):
+    if session.info.pop("change_feed", False):
+        change_feed.notify_commit()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session: Session):
+    session.info.pop("change_feed", None)
@@ -0,0 +1,290 @@
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Any, Protocol
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+from sqlmodel import Session, SQLModel
+
+# Directorio del nivel compartido entre workers (desactivado si no se define)
+ENTITY_CACHE_DIR = os.environ.get("ENTITY_CACHE_DIR")
+
+# Registro global de cachés para exponer estadísticas
+CACHES: dict[str, "EntityCache"] = {}
+
+
+class SharedCacheTier(Protocol):
+    """Cache tier shared by every worker process."""
+
+    def get(self, key: str) -> bytes | None: ...
+
+    def set(self, key: str, value: bytes, ttl: float) -> None: ...
+
+    def delete(self, key: str) -> None: ...
+
+
+class InMemorySharedCache:
+    """Process-local stand-in for the shared tier, intended for tests."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data: dict[str, tuple[float, bytes]] = {}
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._data.get(key)
+        if entry is None or entry[0] <= time.time():
+            return None
+        return entry[1]
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class FileSharedCache:
+    """Shared tier backed by one file per key in a local directory.
+
+    Files are replaced atomically, so workers on the same machine never read a
+    partially written entry. Each file starts with its expiry timestamp.
+    """
+
+    _HEADER = struct.Struct("<d")
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key: str) -> bytes | None:
+        try:
+            with open(self._path(key), "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return None
+        if len(raw) < self._HEADER.size:
+            return None
+        (expires_at,) = self._HEADER.unpack_from(raw)
+        if expires_at <= time.time():
+            return None
+        return raw[self._HEADER.size :]
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(self._HEADER.pack(time.time() + ttl) + value)
+        os.replace(tmp_path, self._path(key))
+
+    def delete(self, key: str) -> None:
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+def default_shared_tier() -> SharedCacheTier | None:
+    """Returns the file-backed shared tier when `ENTITY_CACHE_DIR` is set."""
+    if ENTITY_CACHE_DIR:
+        return FileSharedCache(ENTITY_CACHE_DIR)
+    return None
+
+
+class EntityCache:
+    """Two-tier cache of entity rows used by `BaseRepository.get_by_id`.
+
+    The first tier is an in-process LRU bounded by size and TTL; the optional
+    second tier is shared by all workers. Writes delete the entry from both
+    tiers, so other workers observe a change at most `local_ttl` seconds
+    later. Rows are cached as column snapshots and re-attached to the caller's
+    session without SQL; many-to-one relationships listed in `related` are
+    cached alongside so that properties such as `Device.current_state` do not
+    trigger a lazy load either. Misses loaded through a replica session
+    (``db.info["replica"]``) are returned but not cached, since a lagging
+    replica may still hold the row a write just invalidated.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_size: int = 1024,
+        local_ttl: float = 5.0,
+        shared: SharedCacheTier | None = None,
+        shared_ttl: float = 60.0,
+        related: tuple[str, ...] = (),
+    ):
+        """Initializes the cache and registers it for statistics.
+
+        Args:
+            name: Unique name, used as key prefix and in statistics.
+            max_size: Maximum number of entries in the local tier.
+            local_ttl: Seconds an entry stays valid in the local tier.
+            shared: Optional tier shared between workers.
+            shared_ttl: Seconds an entry stays valid in the shared tier.
+            related: Many-to-one relationships cached with each row.
+        """
+        self.name = name
+        self.max_size = max_size
+        self.local_ttl = local_ttl
+        self.shared = shared
+        self.shared_ttl = shared_ttl
+        self.related = related
+        self._lock = threading.Lock()
+        self._local: OrderedDict[str, tuple[float, dict[str, Any]]] = OrderedDict()
+        self._generation = 0
+        self._stats = {
+            "local_hits": 0,
+            "shared_hits": 0,
+            "misses": 0,
+            "invalidations": 0,
+        }
+        CACHES[name] = self
+
+    # ——— Local tier ———
+
+    def _local_get(self, id: str) -> dict[str, Any] | None:
+        with self._lock:
+            entry = self._local.get(id)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._local[id]
+                return None
+            self._local.move_to_end(id)
+            return entry[1]
+
+    def _local_set(self, id: str, payload: dict[str, Any], generation: int) -> bool:
+        with self._lock:
+            # Una escritura ocurrida durante la carga invalida el resultado
+            if generation != self._generation:
+                return False
+            self._local[id] = (time.monotonic() + self.local_ttl, payload)
+            self._local.move_to_end(id)
+            while len(self._local) > self.max_size:
+                self._local.popitem(last=False)
+            return True
+
+    def _shared_key(self, id: str) -> str:
+        return f"{self.name}:{id}"
+
+    # ——— Public API ———
+
+    def get(
+        self,
+        db: Session,
+        model: type[SQLModel],
+        id: str,
+        load: Callable[[Session, str], SQLModel | None],
+    ) -> SQLModel | None:
+        """Returns the entity attached to `db`, loading it on a miss.
+
+        Args:
+            db: Session the returned instance is attached to.
+            model: The SQLModel class of the entity.
+            id: The ID of the record.
+            load: Callable ``(db, id)`` reading the record from the database.
+
+        Returns:
+            The model instance if found, else None.
+        """
+        payload = self._local_get(id)
+        if payload is not None:
+            self._count("local_hits")
+            return self._attach(db, model, payload)
+
+        if self.shared is not None:
+            raw = self.shared.get(self._shared_key(id))
+            if raw is not None:
+                self._count("shared_hits")
+                payload = json.loads(raw)
+                self._local_set(id, payload, self._generation)
+                return self._attach(db, model, payload)
+
+        self._count("misses")
+        generation = self._generation
+        obj = load(db, id)
+        if obj is None or db.info.get("replica"):
+            return obj
+        payload = self._snapshot(obj)
+        if self._local_set(id, payload, generation) and self.shared is not None:
+            key = self._shared_key(id)
+            self.shared.set(key, json.dumps(payload).encode(), self.shared_ttl)
+            # invalidate() avanza la generación antes de borrar la clave: si
+            # ocurrió mientras se escribía, la copia compartida ya es antigua
+            if generation != self._generation:
+                self.shared.delete(key)
+        return obj
+
+    def invalidate(self, id: str):
+        """Removes an entry from both tiers."""
+        with self._lock:
+            self._generation += 1
+            self._local.pop(id, None)
+            self._stats["invalidations"] += 1
+        if self.shared is not None:
+            self.shared.delete(self._shared_key(id))
+
+    def clear(self):
+        """Empties the local tier."""
+        with self._lock:
+            self._generation += 1
+            self._local.clear()
+
+    def stats(self) -> dict[str, int | float]:
+        """Returns hit/miss counters and the local hit ratio."""
+        with self._lock:
+            stats = dict(self._stats, size=len(self._local))
+        lookups = stats["local_hits"] + stats["shared_hits"] + stats["misses"]
+        hits = stats["local_hits"] + stats["shared_hits"]
+        stats["hit_ratio"] = round(hits / lookups, 4) if lookups else 0.0
+        return stats
+
+    # ——— Serialization ———
+
+    def _count(self, counter: str):
+        with self._lock:
+            self._stats[counter] += 1
+
+    def _snapshot(self, obj: SQLModel) -> dict[str, Any]:
+        payload: dict[str, Any] = {"row": obj.model_dump(mode="json"), "related": {}}
+        for name in self.related:
+            target = getattr(obj, name)
+            if target is not None:
+                payload["related"][name] = target.model_dump(mode="json")
+        return payload
+
+    def _attach(
+        self, db: Session, model: type[SQLModel], payload: dict[str, Any]
+    ) -> SQLModel:
+        obj = _attach_row(db, model, payload["row"])
+        relationships = inspect(model).relationships
+        for name, row in payload["related"].items():
+            target = _attach_row(db, relationships[name].mapper.class_, row)
+            set_committed_value(obj, name, target)
+        return obj
+
+
+def _attach_row(db: Session, model: type[SQLModel], row: dict[str, Any]) -> SQLModel:
+    """Attaches a cached row to the session as a clean persistent instance."""
+    key = identity_key(model, row["id"])
+    existing = db.identity_map.get(key)
+    if existing is not None:
+        return existing
+    obj = model.model_validate(row)
+    make_transient_to_detached(obj)
+    db.add(obj)
+    return obj
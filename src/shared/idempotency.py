@@ -0,0 +1,160 @@
+import hashlib
+import time
+
+from fastapi import HTTPException, Request, Response, status
+from sqlalchemy import LargeBinary, delete
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Field, Session, SQLModel
+
+from src.config.base import client_key, engine
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+# Segundos que una solicitud en curso retiene la clave antes de darse por abandonada
+PENDING_TIMEOUT = 30
+# Intervalo mínimo entre purgas de registros caducados
+PURGE_INTERVAL = 60
+# Intentos de reservar una clave que otras solicitudes reservan y liberan
+CLAIM_ATTEMPTS = 3
+
+
+class IdempotencyRecord(SQLModel, table=True):
+    # SHA-256 del cliente, el recurso y la clave recibida
+    key: bytes = Field(primary_key=True, sa_type=LargeBinary)
+    # SHA-256 del método, la ruta y el cuerpo original
+    fingerprint: bytes = Field(sa_type=LargeBinary)
+    # None mientras la solicitud original sigue en curso
+    status_code: int | None = None
+    body: bytes | None = Field(default=None, sa_type=LargeBinary)
+    expires_at: float = Field(index=True)
+
+
+class IdempotentReplay(Exception):
+    """Raised to answer a retried request with the stored response."""
+
+    def __init__(self, status_code: int, body: bytes):
+        self.status_code = status_code
+        self.body = body
+
+
+async def idempotent_replay_handler(request: Request, exc: IdempotentReplay):
+    return Response(
+        content=exc.body,
+        status_code=exc.status_code,
+        media_type="application/json",
+        headers={REPLAYED_HEADER: "true"},
+    )
+
+
+class IdempotencyStore:
+    """Deduplicates write requests carrying an ``Idempotency-Key`` header.
+
+    The first request inserts a pending record keyed by a 32-byte digest, so
+    concurrent duplicates race on the primary key and exactly one wins. Once
+    the winner finishes, its status and body are stored for `ttl` seconds and
+    retries get them back with a single primary-key lookup.
+    """
+
+    def __init__(self, scope: str, ttl: float = 86_400):
+        """Initializes the store.
+
+        Args:
+            scope: Resource name mixed into every key (e.g. the route path).
+            ttl: Seconds a completed response is replayed.
+        """
+        self.scope = scope
+        self.ttl = ttl
+        self._last_purge = 0.0
+
+    def key_for(self, request: Request, key: str) -> bytes:
+        """Returns the storage key of a client-supplied idempotency key."""
+        client = client_key(request) or ""
+        return hashlib.sha256(f"{client}\0{self.scope}\0{key}".encode()).digest()
+
+    @staticmethod
+    def fingerprint(request: Request, body: bytes) -> bytes:
+        """Returns the digest identifying the request a key was used for."""
+        digest = hashlib.sha256(f"{request.method} {request.url.path}\0".encode())
+        digest.update(body)
+        return digest.digest()
+
+    def claim(self, key: bytes, fingerprint: bytes):
+        """Reserves `key` for the current request.
+
+        Raises:
+            IdempotentReplay: If the key already has a stored response.
+            HTTPException: ``409`` if the original request is still running,
+                ``422`` if the key was used with a different request.
+        """
+        now = time.time()
+        with Session(engine) as db:
+            if now - self._last_purge > PURGE_INTERVAL:
+                self._last_purge = now
+                db.exec(
+                    delete(IdempotencyRecord).where(IdempotencyRecord.expires_at < now)
+                )
+                db.commit()
+            for _ in range(CLAIM_ATTEMPTS):
+                record = db.get(IdempotencyRecord, key)
+                if record is not None and record.expires_at <= now:
+                    # Borrado condicional: otra solicitud puede haberla borrado ya
+                    db.exec(
+                        delete(IdempotencyRecord).where(
+                            IdempotencyRecord.key == key,
+                            IdempotencyRecord.expires_at <= now,
+                        )
+                    )
+                    db.commit()
+                    db.expunge_all()
+                    record = None
+                if record is not None:
+                    break
+                db.add(
+                    IdempotencyRecord(
+                        key=key,
+                        fingerprint=fingerprint,
+                        expires_at=now + PENDING_TIMEOUT,
+                    )
+                )
+                try:
+                    db.commit()
+                    return
+                except IntegrityError:
+                    # Otra solicitud la reservó; puede liberarla antes de leerla
+                    db.rollback()
+
+        if record is None:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A request with this Idempotency-Key is in progress",
+                headers={"Retry-After": "1"},
+            )
+        if record.fingerprint != fingerprint:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Idempotency-Key reused with a different request",
+            )
+        if record.status_code is None:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A request with this Idempotency-Key is in progress",
+                headers={"Retry-After": "1"},
+            )
+        raise IdempotentReplay(record.status_code, record.body)
+
+    def complete(self, key: bytes, status_code: int, body: bytes):
+        """Stores the response of the request holding `key`."""
+        with Session(engine) as db:
+            record = db.get(IdempotencyRecord, key)
+            if record is not None:
+                record.status_code = status_code
+                record.body = body
+                record.expires_at = time.time() + self.ttl
+                db.add(record)
+                db.commit()
+
+    def release(self, key: bytes):
+        """Frees `key` after a failed request so the client can retry it."""
+        with Session(engine) as db:
+            db.exec(delete(IdempotencyRecord).where(IdempotencyRecord.key == key))
+            db.commit()
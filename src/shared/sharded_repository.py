@@ -0,0 +1,183 @@
+import heapq
+import itertools
+from collections.abc import Iterator, Sequence
+from typing import Any
+from sqlalchemy import bindparam
+from sqlmodel import func, select, Session
+from sqlmodel.sql.expression import SelectOfScalar
+from fastapi import HTTPException
+from src.config.base.shards import ShardSet
+from .base_types import (
+    ModelType,
+    CreateSchemaType,
+    UpdateSchemaType,
+)
+from .base_repository import BaseRepository
+from .entity_cache import EntityCache
+from .statements import cached_statement
+
+
+def select_count(model: type) -> Any:
+    return select(func.count()).select_from(model)
+
+
+def select_first_by_id(model: type) -> Any:
+    return select(model).order_by(model.id).limit(bindparam("limit"))
+
+
+def select_after_id(model: type) -> Any:
+    return (
+        select(model)
+        .where(model.id > bindparam("after"))
+        .order_by(model.id)
+        .limit(bindparam("limit"))
+    )
+
+
+class ShardedRepository(BaseRepository[ModelType, CreateSchemaType, UpdateSchemaType]):
+    """Repository whose table is partitioned by ID across a `ShardSet`.
+
+    By-ID operations are routed to the shard owning the ID. Listings query
+    every shard ordered by ID and merge the results, so pages follow the same
+    key order regardless of the number of shards. Unique columns are only
+    enforced within each shard, so creates and updates check them on every
+    shard first. When sharding is disabled it behaves exactly like
+    `BaseRepository`.
+    """
+
+    def __init__(
+        self,
+        model: type[ModelType],
+        shards: ShardSet,
+        cache: EntityCache | None = None,
+    ):
+        """Initializes the repository.
+
+        Args:
+            model: The SQLModel class for the entity.
+            shards: The shard set storing the model's table.
+            cache: Optional entity cache consulted by `get_by_id`.
+        """
+        super().__init__(model, cache)
+        self.shards: ShardSet = shards
+
+    def _route(self, db: Session, id: str):
+        if self.shards.enabled:
+            self.shards.route(db, self.shards.shard_for(id))
+
+    def scatter(
+        self,
+        db: Session,
+        statement: SelectOfScalar[Any],
+        params: dict[str, Any] | None = None,
+    ) -> list[Any]:
+        """Runs a query on every shard and concatenates the results."""
+        if not self.shards.enabled:
+            return list(db.exec(statement, params=params).unique().all())
+        results = []
+        for shard in self.shards.engines:
+            self.shards.route(db, shard)
+            results.extend(db.exec(statement, params=params).unique().all())
+        return results
+
+    def _first(
+        self, db: Session, statement: Any, params: dict[str, Any] | None = None
+    ) -> Any:
+        # Las columnas únicas solo lo son dentro de cada shard: buscar en todos
+        return next(iter(self.scatter(db, statement, params)), None)
+
+    def count(self, db: Session) -> int:
+        """Counts the records on every shard."""
+        return sum(self.scatter(db, cached_statement(select_count, self.model)))
+
+    def iter_pages(
+        self, db: Session, page_size: int = 1000
+    ) -> Iterator[Sequence[ModelType]]:
+        """Yields every record in pages ordered by ID, one shard after another.
+
+        Pages use keyset pagination (``WHERE id > last``), so each page costs
+        the same however far the scan is. Callers may query other shards
+        between pages.
+        """
+        for shard in self.shards.engines or [None]:
+            last = None
+            while True:
+                if shard is not None:
+                    self.shards.route(db, shard)
+                params = {"limit": page_size}
+                if last is None:
+                    statement = cached_statement(select_first_by_id, self.model)
+                else:
+                    statement = cached_statement(select_after_id, self.model)
+                    params["after"] = last
+                page = db.exec(statement, params=params).unique().all()
+                if not page:
+                    break
+                # Leer la clave antes de ceder: el llamador puede confirmar y expirar
+                last = page[-1].id
+                yield page
+                if len(page) < page_size:
+                    break
+
+    def _load_by_id(self, db: Session, id: str) -> ModelType | None:
+        self._route(db, id)
+        return super()._load_by_id(db, id)
+
+    def get_by_ids(self, db: Session, ids: Sequence[str]) -> dict[str, ModelType]:
+        if not self.shards.enabled:
+            return super().get_by_ids(db, ids)
+        by_shard: dict[str, list[str]] = {}
+        for id in dict.fromkeys(ids):
+            by_shard.setdefault(self.shards.shard_for(id), []).append(id)
+        found: dict[str, ModelType] = {}
+        for shard, shard_ids in by_shard.items():
+            self.shards.route(db, shard)
+            found.update(super().get_by_ids(db, shard_ids))
+        return found
+
+    def get_all(
+        self,
+        db: Session,
+        offset: int = 0,
+        limit: int = 100,
+    ) -> Sequence[ModelType]:
+        if not self.shards.enabled:
+            return super().get_all(db, offset, limit)
+        try:
+            # Cada shard devuelve sus primeras offset + limit filas por ID
+            pages = []
+            statement = cached_statement(select_first_by_id, self.model)
+            for shard in self.shards.engines:
+                self.shards.route(db, shard)
+                params = {"limit": offset + limit}
+                pages.append(db.exec(statement, params=params).unique().all())
+            merged = heapq.merge(*pages, key=lambda obj: obj.id)
+            return list(itertools.islice(merged, offset, offset + limit))
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Error fetching records: {str(e)}"
+            )
+
+    def create(self, db: Session, obj_in: CreateSchemaType) -> ModelType:
+        db_obj = self.model.model_validate(obj_in)
+        if self.shards.enabled:
+            # El índice único de cada shard no ve las filas de los demás
+            self.validate_unique(db, db_obj.id, db_obj.model_dump())
+        try:
+            self._route(db, db_obj.id)
+            db.add(db_obj)
+            db.commit()
+            db.refresh(db_obj)
+            return db_obj
+        except Exception as e:
+            db.rollback()
+            raise HTTPException(
+                status_code=500, detail=f"Error creating record: {str(e)}"
+            )
+
+    def _returning(
+        self, db: Session, statement: Any, id: str, version: int | None
+    ) -> ModelType:
+        # Enrutar justo antes de escribir: validate_update puede consultar otros shards
+        self._route(db, id)
+        return super()._returning(db, statement, id, version)
@@ -0,0 +1,84 @@
+import threading
+from collections.abc import Callable, Hashable
+from time import monotonic
+from typing import Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call(Generic[T]):
+    """An in-flight call whose result is shared with concurrent callers."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: T | None = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight(Generic[T]):
+    """Coalesces concurrent calls that share the same key into one execution.
+
+    The first caller for a key (the leader) runs the function; callers that
+    arrive while it is running wait for it and receive the same result or
+    exception. With a positive `window`, successful results are also kept for
+    that many seconds so that bursts arriving right after completion (for
+    example after a cache invalidation) are absorbed too.
+    """
+
+    def __init__(self, window: float = 0.0):
+        """Initializes the coalescing layer.
+
+        Args:
+            window: Seconds a completed result stays reusable. ``0`` disables
+                the micro-cache and only coalesces overlapping calls.
+        """
+        self.window: float = window
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, _Call[T]] = {}
+        self._recent: dict[Hashable, tuple[float, T]] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        """Runs `fn` once for all concurrent callers using `key`.
+
+        Args:
+            key: Identifies calls that are interchangeable.
+            fn: The function producing the result.
+
+        Returns:
+            The result of the leader's call.
+        """
+        with self._lock:
+            recent = self._recent.get(key)
+            if recent is not None and recent[0] > monotonic():
+                return recent[1]
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                if self.window > 0 and call.error is None:
+                    self._remember(key, call.value)
+            call.done.set()
+        return call.value
+
+    def _remember(self, key: Hashable, value: T):
+        """Stores a result in the micro-cache, dropping expired entries."""
+        now = monotonic()
+        expired = [k for k, (expires, _) in self._recent.items() if expires <= now]
+        for k in expired:
+            del self._recent[k]
+        self._recent[key] = (now + self.window, value)
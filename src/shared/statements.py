@@ -0,0 +1,89 @@
+"""Statements built once per model and shape, reused on every call.
+
+SQLAlchemy caches the compiled SQL of a statement under its cache key, but
+building a ``select()`` and computing that key again on every call costs as
+much as a small SQLite query. A statement built once, with bind parameters
+for everything that varies, keeps its memoized key: each execution goes
+straight to the compiled cache.
+
+With ``STATEMENT_STATS=1``, `compiled_cache` counts the cache outcome of
+every statement executed by any engine (``GET /cache/statements``); the
+counting listener runs on every query, so it is off by default.
+"""
+
+import os
+import threading
+from collections import Counter
+from collections.abc import Callable, Iterable
+from typing import Any
+
+from sqlalchemy import Engine, event
+from sqlalchemy.engine.default import CacheStats
+
+# Contar aciertos de la caché en cada ejecución (diagnóstico)
+STATEMENT_STATS = os.environ.get("STATEMENT_STATS", "0") == "1"
+
+# (constructor, modelo) -> sentencia ya construida
+_statements: dict[tuple[Callable, type], Any] = {}
+_lock = threading.Lock()
+
+
+def cached_statement(build: Callable[[type], Any], model: type) -> Any:
+    """Returns ``build(model)``, building it on the first call only.
+
+    `build` must take every varying value as a ``bindparam``, so one
+    statement serves all calls; values are passed when executing it.
+    """
+    statement = _statements.get((build, model))
+    if statement is None:
+        with _lock:
+            statement = _statements.get((build, model))
+            if statement is None:
+                statement = _statements[(build, model)] = build(model)
+    return statement
+
+
+class CompiledCacheStats:
+    """Counts how executions were served by SQLAlchemy's compiled cache."""
+
+    def __init__(self, enabled: bool = STATEMENT_STATS):
+        self.enabled = enabled
+        self._counts: Counter[CacheStats] = Counter()
+        if enabled:
+            event.listen(Engine, "after_cursor_execute", self.record)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            self._counts[context.cache_hit] += 1
+
+    def stats(self, engines: Iterable[Engine] = ()) -> dict[str, Any]:
+        """Hit rate so far (None unless enabled), plus the fill of each
+        engine's cache in `engines`.
+        """
+        hits = self._counts[CacheStats.CACHE_HIT]
+        misses = self._counts[CacheStats.CACHE_MISS]
+        counted = self.enabled and hits + misses
+        return {
+            "enabled": self.enabled,
+            "hits": hits if self.enabled else None,
+            "misses": misses if self.enabled else None,
+            # SQL textual del driver (PRAGMA, SQL crudo): nunca pasa por la caché
+            "uncached": (
+                sum(self._counts.values()) - hits - misses if self.enabled else None
+            ),
+            "hit_rate": round(hits / (hits + misses), 4) if counted else None,
+            "engines": {
+                str(engine.url): {
+                    "entries": len(engine._compiled_cache),
+                    "capacity": engine._compiled_cache.capacity,
+                }
+                for engine in engines
+                if engine._compiled_cache is not None
+            },
+            "statements": sorted(
+                f"{model.__name__}.{build.__name__}" for build, model in _statements
+            ),
+        }
+
+
+compiled_cache = CompiledCacheStats()
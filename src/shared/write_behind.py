@@ -0,0 +1,374 @@
+import logging
+import os
+import threading
+import time
+from typing import Any
+
+from sqlalchemy import JSON, delete, update
+from sqlmodel import Field, Session, SQLModel
+
+from src.config.base import engine, shards
+from src.config.base.utils import IdType, uuid7
+from .base_repository import BaseRepository
+
+logger = logging.getLogger(__name__)
+
+# Intentos de escribir una fila antes de pasarla a la tabla de fallidas
+WRITE_BEHIND_ATTEMPTS = int(os.environ.get("WRITE_BEHIND_ATTEMPTS", 3))
+# Segundos que se conserva el resultado de una operación aplicada
+OPERATION_TTL = float(os.environ.get("WRITE_BEHIND_OPERATION_TTL", 86_400))
+# Una operación sin resultado tras este tiempo se da por perdida (p. ej. caída)
+OPERATION_TIMEOUT = float(os.environ.get("WRITE_BEHIND_OPERATION_TIMEOUT", 60))
+# Intervalo mínimo entre purgas de resultados caducados
+PURGE_INTERVAL = 60
+
+# Colas registradas, arrancadas y drenadas desde el lifespan de la aplicación
+WRITE_BEHIND_QUEUES: list["WriteBehindQueue"] = []
+
+
+class QueueFullError(Exception):
+    """Raised when a write-behind queue cannot accept more pending rows."""
+
+
+class DuplicateValueError(Exception):
+    """Raised when a queued update repeats a unique value of another pending row."""
+
+
+class WriteOperation(SQLModel, table=True):
+    """Outcome of a queued update; failed rows keep their values for replay."""
+
+    id: str = Field(primary_key=True, sa_type=IdType)
+    entity: str = Field(max_length=32)
+    entity_id: str = Field(sa_type=IdType)
+    # "applied" o "failed"
+    status: str = Field(max_length=8)
+    error: str | None = None
+    values: dict | None = Field(default=None, sa_type=JSON)
+    finished_at: float = Field(index=True)
+
+
+class WriteAccepted(SQLModel):
+    """Response returned when an update is queued instead of applied."""
+
+    id: str
+    status: str = "queued"
+    # Consultable en GET /{path}/operations/{operation}
+    operation: str | None = None
+
+
+class WriteOperationStatus(SQLModel):
+    """Status of a queued update: ``queued``, ``applied`` or ``failed``."""
+
+    operation: str
+    id: str | None = None
+    status: str
+    error: str | None = None
+
+
+def operation_age(operation: str) -> float | None:
+    """Returns the seconds since `operation` was queued, from its UUIDv7 prefix."""
+    try:
+        timestamp_ms = int(operation.replace("-", "")[:12], 16)
+    except ValueError:
+        return None
+    return time.time() - timestamp_ms / 1000
+
+
+class WriteBehindQueue:
+    """Bounded in-process queue that applies updates asynchronously in batches.
+
+    Pending updates are keyed by row ID, so several updates to the same row
+    are merged and written once. A background thread flushes the queue when
+    `batch_size` rows are pending or every `flush_interval` seconds, using a
+    single ORM bulk UPDATE by primary key per transaction (one per shard).
+
+    Every update gets an operation ID whose outcome is stored in
+    `WriteOperation` once written. A row that fails is merged back under any
+    newer update and retried in the next batches; after `max_attempts` it is
+    stored as ``failed`` together with its values instead of being dropped.
+    """
+
+    def __init__(
+        self,
+        repository: BaseRepository,
+        max_pending: int = 10_000,
+        batch_size: int = 500,
+        flush_interval: float = 0.05,
+        max_attempts: int = WRITE_BEHIND_ATTEMPTS,
+    ):
+        """Initializes the queue and registers it for the application lifespan.
+
+        Args:
+            repository: Repository whose model is updated.
+            max_pending: Maximum number of distinct rows waiting to be written.
+            batch_size: Number of pending rows that triggers an early flush.
+            flush_interval: Maximum seconds an update waits before being written.
+            max_attempts: Writes of a failing row before it is stored as failed.
+        """
+        self.repository = repository
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self._cond = threading.Condition()
+        self._pending: dict[str, dict[str, Any]] = {}
+        # ID de fila -> operaciones fusionadas en la actualización pendiente
+        self._operations: dict[str, list[str]] = {}
+        # ID de fila -> escrituras fallidas de la actualización pendiente
+        self._attempts: dict[str, int] = {}
+        self._last_purge = 0.0
+        # Columnas únicas y valores reservados por filas pendientes -> ID
+        self._unique = tuple(
+            column.key for column in repository.model.__table__.columns if column.unique
+        )
+        self._claimed: dict[tuple[str, Any], str] = {}
+        self._stopping = False
+        self._thread: threading.Thread | None = None
+        self._stats = {
+            "enqueued": 0,
+            "coalesced": 0,
+            "written": 0,
+            "retried": 0,
+            "failed": 0,
+        }
+        WRITE_BEHIND_QUEUES.append(self)
+
+    def enqueue(self, id: str, values: dict[str, Any]) -> str:
+        """Queues an update, merging it with a pending update of the same row.
+
+        Returns:
+            The operation ID under which the outcome is stored.
+
+        Raises:
+            QueueFullError: If the row is not pending and the queue is full.
+            DuplicateValueError: If another pending row sets the same value of
+                a unique column.
+        """
+        with self._cond:
+            if self._stopping:
+                raise QueueFullError("Queue is shutting down")
+            pending = self._pending.get(id)
+            if pending is None and len(self._pending) >= self.max_pending:
+                raise QueueFullError("Write queue is full")
+            self._claim(id, pending or {}, values)
+            operation = str(uuid7())
+            if pending is not None:
+                pending.update(values)
+                self._stats["coalesced"] += 1
+            else:
+                self._pending[id] = dict(values)
+            self._operations.setdefault(id, []).append(operation)
+            self._stats["enqueued"] += 1
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+            return operation
+
+    def _claim(self, id: str, pending: dict[str, Any], values: dict[str, Any]):
+        keys = [key for key in self._unique if key in values]
+        for key in keys:
+            owner = self._claimed.get((key, values[key]))
+            if owner is not None and owner != id:
+                raise DuplicateValueError(f"Duplicate value for {key}")
+        for key in keys:
+            if key in pending:
+                self._claimed.pop((key, pending[key]), None)
+            self._claimed[(key, values[key])] = id
+
+    def _requeue(
+        self, id: str, values: dict[str, Any], operations: list[str], attempts: int
+    ):
+        """Puts a failed row back, under any update queued since the batch."""
+        newer = self._pending.get(id, {})
+        self._pending[id] = {**values, **newer}
+        self._operations[id] = operations + self._operations.get(id, [])
+        self._attempts[id] = attempts
+        for key in self._unique:
+            if key in values and key not in newer:
+                self._claimed.setdefault((key, values[key]), id)
+
+    def status(self, operation: str) -> WriteOperationStatus | None:
+        """Returns the status of an operation, or None if it is unknown.
+
+        Operations without a stored outcome are reported as ``queued`` until
+        `OPERATION_TIMEOUT`, since another worker may still hold them.
+        """
+        with Session(engine) as db:
+            record = db.get(WriteOperation, operation)
+        if record is not None:
+            return WriteOperationStatus(
+                operation=operation,
+                id=record.entity_id,
+                status=record.status,
+                error=record.error,
+            )
+        age = operation_age(operation)
+        if age is None or not -1 <= age <= OPERATION_TIMEOUT:
+            return None
+        return WriteOperationStatus(operation=operation, status="queued")
+
+    def start(self):
+        """Starts the background writer thread."""
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"write-behind-{self.repository.model.__name__}",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def drain(self):
+        """Stops accepting updates and waits until every pending row is written."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> dict[str, int]:
+        """Returns queue counters and the current number of pending rows."""
+        with self._cond:
+            return dict(self._stats, pending=len(self._pending))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._stopping or len(self._pending) >= self.batch_size,
+                    timeout=self.flush_interval,
+                )
+                batch, self._pending = self._pending, {}
+                operations, self._operations = self._operations, {}
+                attempts, self._attempts = self._attempts, {}
+                self._claimed = {}
+                stopping = self._stopping
+            if batch:
+                self._flush(batch, operations, attempts)
+            with self._cond:
+                # Al detenerse se siguen reintentando las filas devueltas a la cola
+                if stopping and not self._pending:
+                    return
+
+    def _flush(
+        self,
+        batch: dict[str, dict[str, Any]],
+        operations: dict[str, list[str]],
+        attempts: dict[str, int],
+    ):
+        """Writes a batch in one transaction, isolating failing rows on error."""
+        rows = [{"id": id, **values} for id, values in batch.items()]
+        try:
+            self._write(rows)
+            written = rows
+        except Exception:
+            logger.exception("Batch write failed, retrying rows one by one")
+            written = []
+            for row in rows:
+                try:
+                    self._write([row])
+                    written.append(row)
+                except Exception as e:
+                    self._failed(row, operations[row["id"]], attempts, e)
+        self._record(
+            [
+                self._outcome(operation, row["id"], "applied")
+                for row in written
+                for operation in operations[row["id"]]
+            ]
+        )
+
+    def _failed(
+        self,
+        row: dict[str, Any],
+        operations: list[str],
+        attempts: dict[str, int],
+        error: Exception,
+    ):
+        id = row["id"]
+        values = {key: value for key, value in row.items() if key != "id"}
+        attempt = attempts.get(id, 0) + 1
+        if attempt < self.max_attempts:
+            logger.warning("Update for %s failed, retrying: %s", id, error)
+            with self._cond:
+                self._requeue(id, values, operations, attempt)
+                self._stats["retried"] += 1
+            return
+        logger.error("Update for %s failed %d times: %s", id, self.max_attempts, error)
+        self._count("failed")
+        self._record(
+            [
+                self._outcome(operation, id, "failed", str(error), values)
+                for operation in operations
+            ]
+        )
+
+    def _outcome(
+        self,
+        operation: str,
+        id: str,
+        status: str,
+        error: str | None = None,
+        values: dict[str, Any] | None = None,
+    ) -> dict[str, Any]:
+        return {
+            "id": operation,
+            "entity": self.repository.model.__tablename__,
+            "entity_id": id,
+            "status": status,
+            "error": error,
+            "values": values,
+            "finished_at": time.time(),
+        }
+
+    def _record(self, outcomes: list[dict[str, Any]]):
+        """Stores operation outcomes in the primary and purges expired ones."""
+        if not outcomes:
+            return
+        now = time.time()
+        try:
+            with Session(engine) as db:
+                db.execute(WriteOperation.__table__.insert(), outcomes)
+                if now - self._last_purge > PURGE_INTERVAL:
+                    self._last_purge = now
+                    # Las fallidas se conservan para poder reenviarlas
+                    db.execute(
+                        delete(WriteOperation).where(
+                            WriteOperation.status == "applied",
+                            WriteOperation.finished_at < now - OPERATION_TTL,
+                        )
+                    )
+                db.commit()
+        except Exception:
+            logger.exception("Could not store %d operation outcomes", len(outcomes))
+
+    def _write(self, rows: list[dict[str, Any]]):
+        model = self.repository.model
+        statement = update(model)
+        if self.repository.versioned:
+            statement = statement.values(version=model.version + 1)
+        for bind, group in shards.partition(model.__tablename__, rows):
+            with Session(bind) as session:
+                session.execute(statement, group)
+                session.commit()
+        self._count("written", len(rows))
+        if self.repository.cache is not None:
+            for row in rows:
+                self.repository.cache.invalidate(row["id"])
+
+    def _count(self, counter: str, amount: int = 1):
+        with self._cond:
+            self._stats[counter] += amount
+
+
+def start_write_behind_queues():
+    """Starts the writer thread of every registered queue."""
+    for queue in WRITE_BEHIND_QUEUES:
+        queue.start()
+
+
+def drain_write_behind_queues():
+    """Flushes and stops every registered queue."""
+    for queue in WRITE_BEHIND_QUEUES:
+        queue.drain()
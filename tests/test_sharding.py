@@ -0,0 +1,131 @@
+"""Cross-shard behaviour of the device repositories.
+
+Run with ``python -m unittest discover tests``. The shard configuration is
+read when ``src.config.base`` is first imported, so this module sets it up
+in a temporary directory before importing the application.
+"""
+
+import os
+import tempfile
+import unittest
+
+from fastapi import HTTPException
+
+_workdir = tempfile.TemporaryDirectory()
+_previous_cwd = os.getcwd()
+
+
+def setUpModule():
+    os.chdir(_workdir.name)
+    os.environ["SQLITE_SHARDS"] = "s1.db,s2.db"
+    os.environ["SHARD_MAP_FILE"] = "shards.json"
+    os.environ["SQLITE_REPLICAS"] = ""
+
+    global shards, ShardRoutingError, Device, DeviceRelation, State
+    global DeviceCreate, DeviceRelationCreate, DeviceRepository
+    global DeviceRelationRepository, RoutingSession, engine
+    from src.registry import import_models, seeders
+    from src.config.base import RoutingSession, create_db_and_tables, engine, shards
+    from src.config.base.shards import ShardRoutingError
+    from src.entities.device.models import Device, DeviceRelation
+    from src.entities.device.repository import (
+        DeviceRelationRepository,
+        DeviceRepository,
+    )
+    from src.entities.device.schemes import DeviceCreate, DeviceRelationCreate
+    from src.entities.state.models import State
+
+    import_models()
+    create_db_and_tables(seeders())
+    if not shards.enabled:
+        raise unittest.SkipTest("src.config.base was imported without shards")
+
+
+def tearDownModule():
+    os.chdir(_previous_cwd)
+    _workdir.cleanup()
+
+
+class ShardedDeviceTest(unittest.TestCase):
+    def setUp(self):
+        self.devices = DeviceRepository(model=Device, shards=shards)
+        self.relations = DeviceRelationRepository(model=DeviceRelation, shards=shards)
+        self.db = RoutingSession(engine, shards)
+        self.addCleanup(self.db.close)
+        self.state_id = self.db.exec(State.__table__.select()).first().id
+        self.serial = 0
+
+    def create_device(self, shard: str) -> "Device":
+        """Creates devices until one lands on `shard` (IDs pick the shard)."""
+        while True:
+            self.serial += 1
+            device = self.devices.create(
+                self.db,
+                DeviceCreate(
+                    state_id=self.state_id,
+                    nombre=f"device {self.serial}",
+                    serial_number=f"{self._testMethodName[5:30]}-{self.serial}",
+                    password_hash="hash",
+                ),
+            )
+            if shards.shard_for(device.id) == shard:
+                return device
+
+    def test_create_rejects_serial_number_of_another_shard(self):
+        first = self.create_device(shards.files[0])
+        for _ in range(8):
+            with self.assertRaises(HTTPException) as raised:
+                self.devices.create(
+                    self.db,
+                    DeviceCreate(
+                        state_id=self.state_id,
+                        nombre="copy",
+                        serial_number=first.serial_number,
+                        password_hash="hash",
+                    ),
+                )
+            self.assertEqual(raised.exception.status_code, 409)
+
+    def test_lookups_find_devices_on_every_shard(self):
+        devices = [self.create_device(path) for path in shards.files]
+        # Atributos expirados por el último commit: se recargan de su shard
+        expected = {device.id: device.serial_number for device in devices}
+        self.db.expunge_all()
+        for id, serial_number in expected.items():
+            self.assertEqual(self.devices.get_by_id(self.db, id).id, id)
+            found = self.devices.get_by_serial_number(self.db, serial_number)
+            self.assertEqual(found.id, id)
+        self.assertEqual(
+            set(self.devices.get_by_ids(self.db, list(expected))), set(expected)
+        )
+
+    def test_relation_loads_devices_from_their_own_shards(self):
+        device1 = self.create_device(shards.files[0])
+        device2 = self.create_device(shards.files[1])
+        serial_numbers = (device1.serial_number, device2.serial_number)
+        relation = self.relations.create(
+            self.db,
+            DeviceRelationCreate(
+                device_id1=device1.id, device_id2=device2.id, relation_type="parent"
+            ),
+        )
+        relation_id = relation.id
+        self.db.expunge_all()
+        # La sesión apunta al shard de la relación, no al de los dispositivos
+        loaded = self.relations.get_by_id(self.db, relation_id)
+        self.assertEqual(
+            (loaded.device1.serial_number, loaded.device2.serial_number),
+            serial_numbers,
+        )
+
+    def test_collections_spanning_shards_are_not_loaded_from_one_shard(self):
+        device = self.create_device(shards.files[0])
+        self.db.expunge_all()
+        state = self.db.get(State, device.state_id)
+        shards.route(self.db, shards.files[0])
+        with self.assertRaises(ShardRoutingError):
+            state.devices
+
+
+if __name__ == "__main__":
+    unittest.main()